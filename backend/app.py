@@ -1,57 +1,188 @@
-from flask import Flask, jsonify, request, redirect, send_from_directory
+from flask import Blueprint, Flask, Response, current_app, jsonify, request, redirect, send_file, send_from_directory, stream_with_context, session, has_app_context, has_request_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from flask_bcrypt import Bcrypt
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, JWTManager
-from authlib.integrations.flask_client import OAuth
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt, JWTManager
 from dotenv import load_dotenv
 import os
-from werkzeug.utils import secure_filename
+import weakref
+from urllib.parse import urlencode
 import click # Import click for CLI commands
-
-# Load environment variables from .env file
-load_dotenv()
+from listing import ListingQuery, ListingQueryError, FIELDS, SUMMARY_FIELDS, column_fields, parse_fields, serialize_rows
+import db_config
+import replicas
+import compression
+import geo
+import bookings
+import similar
+import oidc
+import stats
+import jobs
+import ratelimit
+import metrics
+import jsonio
+import search
+import sync
+import bulk
+import media
+import hmac
+import secrets
+import json
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import RequestEntityTooLarge
+from cache import ResponseCache, make_backend, watch_session
+from passwords import PasswordHasher, PasswordHasherBusy
+from auth import UserStateCache, token_claims, token_user_id, watch_users
 
 # --- App Configuration ---
-app = Flask(__name__)
-CORS(app)
-
-# Database Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///realestate.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-super-secret-key-change-this')
+# create_app() builds the app; this module only defines its parts, so importing
+# it (CLI, job workers, tests) stays cheap and does no I/O.
 
-# Uploads Configuration
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+
+def config_from_env():
+    """Settings read from the environment (and .env); create_app() applies its overrides on top."""
+    config = {}
+    # Database Configuration
+    config['SQLALCHEMY_DATABASE_URI'] = db_config.database_uri()
+    config['SQLITE_PRAGMAS'] = db_config.sqlite_pragmas()
+    # Read replicas for read-only endpoints (not binds, so create_all and
+    # migrations never touch them)
+    config['DB_REPLICA_URIS'] = db_config.replica_uris()
+    config['DB_REPLICA_STRATEGY'] = os.getenv('DB_REPLICA_STRATEGY', 'round_robin')
+    config['DB_REPLICA_STICKY_SECONDS'] = float(os.getenv('DB_REPLICA_STICKY_SECONDS', 5))
+    config['DB_REPLICA_RETRY_SECONDS'] = float(os.getenv('DB_REPLICA_RETRY_SECONDS', 30))
+    config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-super-secret-key-change-this')
+    # Signs the session cookie that carries the OAuth state and nonce
+    config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-flask-secret-key-change-this')
+    # Google sign-in; nothing is fetched from the provider until its routes are used
+    config['GOOGLE_CLIENT_ID'] = os.getenv('GOOGLE_CLIENT_ID')
+    config['GOOGLE_CLIENT_SECRET'] = os.getenv('GOOGLE_CLIENT_SECRET')
+    config['GOOGLE_DISCOVERY_URL'] = os.getenv('GOOGLE_DISCOVERY_URL', oidc.GOOGLE_DISCOVERY_URL)
+    config['GOOGLE_REDIRECT_URI'] = os.getenv('GOOGLE_REDIRECT_URI', 'http://localhost:5001/api/auth/google/callback')
+    # Calls to the identity provider: connect/read timeouts in seconds, pooled
+    # keep-alive connections, consecutive failures that open the circuit breaker
+    # and how long it stays open, and how long discovery and signing keys are
+    # cached when the provider sends no max-age
+    config['OAUTH_CONNECT_TIMEOUT'] = float(os.getenv('OAUTH_CONNECT_TIMEOUT', 3.05))
+    config['OAUTH_READ_TIMEOUT'] = float(os.getenv('OAUTH_READ_TIMEOUT', 5))
+    config['OAUTH_POOL_SIZE'] = int(os.getenv('OAUTH_POOL_SIZE', 10))
+    config['OAUTH_BREAKER_FAILURES'] = int(os.getenv('OAUTH_BREAKER_FAILURES', 5))
+    config['OAUTH_BREAKER_RESET_SECONDS'] = float(os.getenv('OAUTH_BREAKER_RESET_SECONDS', 30))
+    config['OAUTH_KEYS_TTL'] = int(os.getenv('OAUTH_KEYS_TTL', 3600))
+    # Seconds a user's role and token version are trusted before re-reading them
+    config['AUTH_STATE_CACHE_TTL'] = int(os.getenv('AUTH_STATE_CACHE_TTL', 30))
+
+    # Uploads Configuration
+    config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    # Public URL prefix for content-addressed uploads; may point at a CDN
+    config['MEDIA_URL'] = os.getenv('MEDIA_URL', '/media')
+    config['MEDIA_WORKERS'] = int(os.getenv('MEDIA_WORKERS', 2))
+    # Largest accepted image upload request, in bytes
+    config['MEDIA_MAX_UPLOAD_SIZE'] = int(os.getenv('MEDIA_MAX_UPLOAD_SIZE', 10 * 1024 * 1024))
+    # How /media responses are sent: 'app' streams from Flask, 'x-accel' hands the
+    # file to Nginx via X-Accel-Redirect, 'x-sendfile' to Apache/lighttpd
+    config['MEDIA_OFFLOAD'] = os.getenv('MEDIA_OFFLOAD', 'app')
+    config['MEDIA_ACCEL_PREFIX'] = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media')
+
+    # The Node backend's SQLite store, kept aligned by `flask sync-properties`
+    config['NODE_DATABASE_PATH'] = os.getenv(
+        'NODE_DATABASE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database', 'luxury_properties.db'))
+
+    # Response cache for public property reads ('memory', 'redis' or 'none')
+    config['RESPONSE_CACHE_BACKEND'] = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')
+    config['RESPONSE_CACHE_URL'] = os.getenv('RESPONSE_CACHE_URL')
+    config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 300))
+    config['RESPONSE_CACHE_MAXSIZE'] = int(os.getenv('RESPONSE_CACHE_MAXSIZE', 1024))
+
+    # Background jobs: `flask worker` pool size and mode (thread or process),
+    # per-queue limits on running jobs across all workers ("queue=n,..."), and
+    # how long a claimed job is leased before another worker may retry it
+    config['JOBS_CONCURRENCY'] = int(os.getenv('JOBS_CONCURRENCY', 4))
+    config['JOBS_MODE'] = os.getenv('JOBS_MODE', 'thread')
+    config['JOBS_QUEUE_LIMITS'] = jobs.parse_queue_limits(
+        os.getenv('JOBS_QUEUE_LIMITS', f"media={config['MEDIA_WORKERS']},sync=1"))
+    config['JOBS_POLL_INTERVAL'] = float(os.getenv('JOBS_POLL_INTERVAL', 1))
+    config['JOBS_LEASE_SECONDS'] = int(os.getenv('JOBS_LEASE_SECONDS', 300))
+    config['JOBS_RETENTION_DAYS'] = int(os.getenv('JOBS_RETENTION_DAYS', 7))
+    # Run the Node sync as a periodic job every N seconds (0 = only via the CLI)
+    config['NODE_SYNC_INTERVAL'] = int(os.getenv('NODE_SYNC_INTERVAL', 0))
+
+    # Geocoding of property locations: 'gazetteer' (offline place table, extended
+    # by an optional name,latitude,longitude CSV) or 'none'
+    config['GEOCODER'] = os.getenv('GEOCODER', 'gazetteer')
+    config['GEOCODER_GAZETTEER_PATH'] = os.getenv('GEOCODER_GAZETTEER_PATH')
+
+    # Response compression: bodies under COMPRESS_MIN_SIZE bytes are sent as is;
+    # brotli is used when the client accepts it and the package is installed
+    config['COMPRESS_ENABLED'] = os.getenv('COMPRESS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+    config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 6))
+    config['COMPRESS_BROTLI_QUALITY'] = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+    config['COMPRESS_CACHE_SIZE'] = int(os.getenv('COMPRESS_CACHE_SIZE', 256))
+
+    # Password hashing: bcrypt cost, size of the hashing process pool (0 hashes
+    # inline), how many operations may wait before new ones get a 503, and how
+    # long a successful login is remembered so a repeat skips bcrypt
+    config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+    config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+    config['PASSWORD_HASH_MAX_PENDING'] = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 32))
+    config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+    config['PASSWORD_VERIFY_CACHE_TTL'] = int(os.getenv('PASSWORD_VERIFY_CACHE_TTL', 60))
+
+    # Per-client rate limits ("count/second|minute|hour|day", or "none") kept in
+    # process memory or, with RATELIMIT_BACKEND=redis, shared between workers
+    config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    config['RATELIMIT_BACKEND'] = os.getenv('RATELIMIT_BACKEND', 'memory')
+    config['RATELIMIT_URL'] = os.getenv('RATELIMIT_URL')
+    config['RATELIMIT_LOGIN'] = os.getenv('RATELIMIT_LOGIN', '20/minute')
+    config['RATELIMIT_REGISTER'] = os.getenv('RATELIMIT_REGISTER', '5/minute')
+    config['RATELIMIT_PUBLIC'] = os.getenv('RATELIMIT_PUBLIC', '300/minute')
+    config['RATELIMIT_BOOKING'] = os.getenv('RATELIMIT_BOOKING', '10/minute')
+
+    # Load shedding: answer 503 at once when more requests are in flight than an
+    # adaptive limit (at most SHED_MAX_IN_FLIGHT, lowered while p99 latency is
+    # over SHED_TARGET_P99_MS) or when a request waited longer than
+    # SHED_MAX_QUEUE_MS behind the proxy (X-Request-Start; 0 disables)
+    config['SHED_ENABLED'] = os.getenv('SHED_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    config['SHED_MAX_IN_FLIGHT'] = int(os.getenv('SHED_MAX_IN_FLIGHT', 64))
+    config['SHED_TARGET_P99_MS'] = float(os.getenv('SHED_TARGET_P99_MS', 1000))
+    config['SHED_MAX_QUEUE_MS'] = float(os.getenv('SHED_MAX_QUEUE_MS', 0))
+
+    # Request/query metrics on /metrics (Prometheus text) and in Server-Timing
+    # headers; requests running one statement N_PLUS_ONE_THRESHOLD times are
+    # logged. METRICS_TOKEN, when set, is required as a bearer token on /metrics
+    config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    config['METRICS_SERVER_TIMING'] = os.getenv('METRICS_SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+    config['METRICS_N_PLUS_ONE_THRESHOLD'] = int(os.getenv('METRICS_N_PLUS_ONE_THRESHOLD', 10))
+    config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    # Seconds before the similar-properties matrix is rebuilt to pick up other processes' writes
+    config['SIMILAR_MAX_AGE'] = int(os.getenv('SIMILAR_MAX_AGE', 300))
+    return config
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# --- Extensions Initialization ---
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-bcrypt = Bcrypt(app)
-jwt = JWTManager(app)
-oauth = OAuth(app)
-
-# --- Google OAuth Configuration ---
-google = oauth.register(
-    name='google',
-    client_id=os.getenv('GOOGLE_CLIENT_ID'),
-    client_secret=os.getenv('GOOGLE_CLIENT_SECRET'),
-    access_token_url='https://accounts.google.com/o/oauth2/token',
-    access_token_params=None,
-    authorize_url='https://accounts.google.com/o/oauth2/auth',
-    authorize_params=None,
-    api_base_url='https://www.googleapis.com/oauth2/v1/',
-    userinfo_endpoint='https://openidconnect.googleapis.com/v1/userinfo',
-    client_kwargs={'scope': 'openid email profile'},
-    jwks_uri="https://www.googleapis.com/oauth2/v3/certs",
-)
+def media_root():
+    return os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])
+
+def media_url(path):
+    url = f"{current_app.config['MEDIA_URL'].rstrip('/')}/{path}"
+    if url.startswith('/') and has_request_context():
+        url = request.host_url.rstrip('/') + url
+    return url
+
+# --- Extensions ---
+# Created unbound and set up for an app by create_app(); models, session
+# hooks and view decorators only need these objects.
+db = SQLAlchemy(session_options={'class_': replicas.RoutingSession})
+replicas.watch_session(db.session)
+request_metrics = metrics.RequestMetrics()
+load_shedder = ratelimit.LoadShedder()
+password_hasher = PasswordHasher()
+jwt = JWTManager()
 
 
 # --- Database Models ---
@@ -64,27 +195,174 @@ class User(db.Model):
     # Password can be null for OAuth users
     password_hash = db.Column(db.String(128), nullable=True)
     role = db.Column(db.String(50), default='user', nullable=False) # Added role column
+    # Tokens issued with an older version are rejected; bump to log a user out everywhere
+    token_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return self.password_hash and bcrypt.check_password_hash(self.password_hash, password)
+        return password_hasher.check(password, self.password_hash)
+
+    def password_needs_rehash(self):
+        return bool(self.password_hash) and password_hasher.needs_rehash(self.password_hash)
+
+    def create_token(self):
+        return create_access_token(identity=str(self.id), additional_claims=token_claims(self))
+
+    def revoke_tokens(self):
+        self.token_version = (self.token_version or 0) + 1
+
+def parse_list(value):
+    """Accepts a list or a legacy comma-separated string and returns clean items."""
+    if not value:
+        return []
+    items = value.split(',') if isinstance(value, str) else value
+    return list(dict.fromkeys(item.strip() for item in items if item and item.strip()))
+
+property_amenity = db.Table(
+    'property_amenity',
+    db.Column('property_id', db.Integer, db.ForeignKey('property.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('amenity_id', db.Integer, db.ForeignKey('amenity.id', ondelete='CASCADE'), primary_key=True),
+    # Serves the "has amenity X" filter: amenity -> property ids without touching property
+    db.Index('ix_property_amenity_amenity_property', 'amenity_id', 'property_id'),
+)
+
+class Amenity(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+
+    @staticmethod
+    def resolve(names):
+        """Returns Amenity rows for ``names``, creating the missing ones."""
+        if not names:
+            return []
+        with db.session.no_autoflush:
+            known = {a.name: a for a in db.session.new if isinstance(a, Amenity)}
+            known.update((a.name, a) for a in db.session.scalars(db.select(Amenity).where(Amenity.name.in_(names))))
+            result = []
+            for name in names:
+                if name not in known:
+                    known[name] = Amenity(name=name)
+                    db.session.add(known[name])
+                result.append(known[name])
+            return result
+
+class MediaAsset(db.Model):
+    """An uploaded image stored under its SHA-256, plus its generated variants."""
+    digest = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(20), default='pending', nullable=False) # pending, ready or failed
+    variants = db.Column(db.Text, nullable=True) # JSON list of {width, format, path}
+    placeholder = db.Column(db.Text, nullable=True) # Blurred data: URI
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    def to_dict(self):
+        variants = [dict(v, url=media_url(v['path'])) for v in json.loads(self.variants or '[]')]
+        srcset = {}
+        for variant in variants:
+            srcset.setdefault(variant['format'], []).append(f"{variant['url']} {variant['width']}w")
+        return {
+            'digest': self.digest,
+            'url': media_url(self.path),
+            'status': self.status,
+            'width': self.width,
+            'height': self.height,
+            'placeholder': self.placeholder,
+            'variants': [{'width': v['width'], 'format': v['format'], 'url': v['url']} for v in variants],
+            'srcset': {fmt: ', '.join(entries) for fmt, entries in srcset.items()},
+        }
+
+class PropertyImage(db.Model):
+    __table_args__ = (
+        db.Index('ix_property_image_property_position', 'property_id', 'position'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    property_id = db.Column(db.Integer, db.ForeignKey('property.id', ondelete='CASCADE'), nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    url = db.Column(db.Text, nullable=False)
+    # Set when url points at an uploaded MediaAsset; no FK so external URLs are fine
+    asset_digest = db.Column(db.String(64), nullable=True)
+
+    asset = db.relationship('MediaAsset', primaryjoin='foreign(PropertyImage.asset_digest) == MediaAsset.digest',
+                            viewonly=True, lazy='selectin')
 
 class Property(db.Model):
+    # Composite indexes for the listing/search hot paths; keep in sync with
+    # migrations/versions/4b7e2d9a1c3f_property_table_and_indexes.py
+    __table_args__ = (
+        db.Index('ix_property_available_price', 'is_available', 'price'),
+        db.Index('ix_property_location_bedrooms', 'location', 'bedrooms'),
+        db.Index('ix_property_created_at_id', 'created_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=False)
     price = db.Column(db.Float, nullable=False)
     location = db.Column(db.String(255), nullable=False)
+    # Filled from location by the geocoder unless given; indexed by geo.register
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
     bedrooms = db.Column(db.Integer, nullable=False)
     bathrooms = db.Column(db.Integer, nullable=False)
     area = db.Column(db.Float, nullable=False) # e.g., in sq meters/feet
-    images = db.Column(db.Text, nullable=True) # Comma-separated URLs
-    amenities = db.Column(db.Text, nullable=True) # Comma-separated, or JSON string
     is_available = db.Column(db.Boolean, default=True, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc), nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc), nullable=False)
+    # Callables so each row gets its own timestamp; keyset paging orders by created_at
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+
+    # selectin loading keeps lists of properties at one extra query per relation
+    image_rows = db.relationship('PropertyImage', order_by=PropertyImage.position,
+                                 cascade='all, delete-orphan', lazy='selectin')
+    amenity_rows = db.relationship('Amenity', secondary=property_amenity, order_by=Amenity.name, lazy='selectin')
+
+    @property
+    def images(self):
+        return [image.url for image in self.image_rows]
+
+    @images.setter
+    def images(self, value):
+        self.image_rows = [PropertyImage(url=url, position=i, asset_digest=media.digest_from_url(url))
+                           for i, url in enumerate(parse_list(value))]
+
+    @property
+    def amenities(self):
+        return [amenity.name for amenity in self.amenity_rows]
+
+    @amenities.setter
+    def amenities(self, value):
+        self.amenity_rows = Amenity.resolve(parse_list(value))
+
+    @classmethod
+    def related_values(cls, session, field, ids):
+        """Batch-loads images or amenities for many properties as ``{id: [values]}``."""
+        if field == 'images':
+            stmt = (db.select(PropertyImage.property_id, PropertyImage.url)
+                    .where(PropertyImage.property_id.in_(ids))
+                    .order_by(PropertyImage.property_id, PropertyImage.position))
+        else:
+            stmt = (db.select(property_amenity.c.property_id, Amenity.name)
+                    .join(Amenity, Amenity.id == property_amenity.c.amenity_id)
+                    .where(property_amenity.c.property_id.in_(ids))
+                    .order_by(property_amenity.c.property_id, Amenity.name))
+        values = {property_id: [] for property_id in ids}
+        for property_id, value in session.execute(stmt):
+            values[property_id].append(value)
+        return values
+
+    @classmethod
+    def has_amenity(cls, name):
+        return cls.id.in_(
+            db.select(property_amenity.c.property_id)
+            .join(Amenity, Amenity.id == property_amenity.c.amenity_id)
+            .where(Amenity.name == name)
+        )
 
     def to_dict(self):
         return {
@@ -93,37 +371,238 @@ class Property(db.Model):
             'description': self.description,
             'price': self.price,
             'location': self.location,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
             'bedrooms': self.bedrooms,
             'bathrooms': self.bathrooms,
             'area': self.area,
-            'images': self.images.split(',') if self.images else [],
-            'amenities': self.amenities.split(',') if self.amenities else [],
+            'images': self.images,
+            # Responsive variants per image, aligned with 'images'; None for external URLs
+            'image_variants': [image.asset.to_dict() if image.asset else None for image in self.image_rows],
+            'amenities': self.amenities,
             'is_available': self.is_available,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
 
-from functools import wraps
+class PropertyChange(db.Model):
+    """Change log appended to by triggers on property writes; consumed by sync-properties."""
+    __tablename__ = sync.CHANGE_TABLE
+    # AUTOINCREMENT: ids must keep growing after the consumed log is pruned
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    property_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    changed_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), nullable=False)
+
+class SyncCheckpoint(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    position = db.Column(db.Integer, default=0, nullable=False)
+    gaps = db.Column(db.Text, nullable=True) # JSON {id: first seen}, see sync.replicate
+
+class PropertySyncLink(db.Model):
+    """Matches a local property with its copy in another store."""
+    remote = db.Column(db.String(50), primary_key=True)
+    property_id = db.Column(db.Integer, primary_key=True)
+    remote_id = db.Column(db.Integer, nullable=False)
+    __table_args__ = (db.UniqueConstraint('remote', 'remote_id'),)
+
+class PropertyStats(db.Model):
+    """Market aggregates per (location, bedrooms), maintained by stats.watch_properties."""
+    location = db.Column(db.String(255), primary_key=True)
+    bedrooms = db.Column(db.Integer, primary_key=True)
+    property_count = db.Column(db.Integer, nullable=False)
+    available_count = db.Column(db.Integer, nullable=False)
+    price_sum = db.Column(db.Float, nullable=False)
+    price_min = db.Column(db.Float, nullable=True)
+    price_max = db.Column(db.Float, nullable=True)
+    ppa_sum = db.Column(db.Float, nullable=False) # price per unit of area
+    ppa_count = db.Column(db.Integer, nullable=False)
+    price_sketch = db.Column(db.Text, nullable=False) # JSON stats.QuantileSketch
+    ppa_sketch = db.Column(db.Text, nullable=False)
+
+class Job(db.Model):
+    """A background job; see jobs.py."""
+    __table_args__ = (
+        # The claim query: due jobs of a queue in run_at order
+        db.Index('ix_job_status_queue_run_at', 'status', 'queue', 'run_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    queue = db.Column(db.String(50), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False) # JSON keyword arguments
+    status = db.Column(db.String(20), nullable=False) # queued, running, done or failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False)
+    idempotency_key = db.Column(db.String(255), unique=True, nullable=True)
+    locked_by = db.Column(db.String(255), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class Booking(db.Model):
+    """A stay at a property; see bookings.py for the calendar and overlap rules."""
+    __table_args__ = (
+        # Bookings of a property by date: the overlap lookup where no interval index exists
+        db.Index('ix_booking_property_check_in', 'property_id', 'check_in_date'),
+        db.CheckConstraint('check_out_date > check_in_date', name='ck_booking_dates'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    property_id = db.Column(db.Integer, db.ForeignKey('property.id', ondelete='CASCADE'), nullable=False)
+    # Set when booked with an access token; guests can book without an account
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    guest_name = db.Column(db.String(100), nullable=False)
+    guest_email = db.Column(db.String(100), nullable=False)
+    guest_phone = db.Column(db.String(50), nullable=True)
+    check_in_date = db.Column(db.Date, nullable=False)
+    check_out_date = db.Column(db.Date, nullable=False) # exclusive: the night before is the last one
+    guests_count = db.Column(db.Integer, nullable=False)
+    total_price = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False) # one of bookings.STATUSES
+    special_requests = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'property_id': self.property_id,
+            'user_id': self.user_id,
+            'guest_name': self.guest_name,
+            'guest_email': self.guest_email,
+            'guest_phone': self.guest_phone,
+            'check_in_date': self.check_in_date.isoformat(),
+            'check_out_date': self.check_out_date.isoformat(),
+            'guests_count': self.guests_count,
+            'total_price': self.total_price,
+            'status': self.status,
+            'special_requests': self.special_requests,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+# Keep the FTS5 search index and its sync triggers alongside the property table
+search.register(Property.__table__, property_amenity)
+# Log every property write for incremental sync with the Node store
+sync.register(Property.__table__, PropertyImage.__table__, property_amenity)
+# R*Tree (SQLite) or GiST (PostgreSQL) index over property coordinates
+geo.register(Property.__table__)
+# Interval index over booked nights: R*Tree (SQLite) or an exclusion constraint (PostgreSQL)
+bookings.register(Booking.__table__)
+# Market statistics follow every ORM property write
+stats.watch_properties(db.session, Property, PropertyStats.__table__)
+
+def current_geocoder():
+    """The current app's geocoder (GEOCODER), or None."""
+    return current_app.extensions.get('geocoder') if has_app_context() else None
+
+geo.watch_locations(db.session, Property, current_geocoder)
+
+# Cached public reads are dropped whenever a commit touches a Property
+response_cache = ResponseCache()
+watch_session(db.session, (Property, PropertyImage, Amenity, MediaAsset), response_cache)
+
+# In-memory feature matrix behind /api/properties/<id>/similar, kept current by ORM writes
+similar_index = similar.SimilarityIndex()
+
+def amenity_pairs():
+    return (db.select(property_amenity.c.property_id, Amenity.name)
+            .join(Amenity, Amenity.id == property_amenity.c.amenity_id))
+
+similar.watch_properties(db.session, Property, similar_index, amenity_pairs)
+
+def load_similarity_features(app):
+    """The whole catalogue's feature rows; runs in its own app context, so also in a background thread."""
+    with app.app_context():
+        return similar.fetch(db.session, Property, amenity_pairs())
+
+job_queue = jobs.JobQueue(Job.__table__)
+
+def mark_variants_failed(payload, error):
+    asset = db.session.get(MediaAsset, payload['digest'])
+    if asset is not None:
+        asset.status = 'failed'
+        db.session.commit()
+
+@job_queue.task('media.variants', queue='media', max_attempts=3, on_failure=mark_variants_failed)
+def generate_media_variants(digest):
+    """Builds an uploaded image's responsive variants and placeholder."""
+    asset = db.session.get(MediaAsset, digest)
+    if asset is None or asset.status != 'pending':
+        return
+    result = media.generate_variants(media_root(), digest, asset.path)
+    asset.width = result['width']
+    asset.height = result['height']
+    asset.variants = json.dumps(result['variants'])
+    asset.placeholder = result['placeholder']
+    asset.status = 'ready'
+    db.session.commit()
+
+user_states = UserStateCache(
+    lambda user_id: db.session.execute(db.select(User.role, User.token_version).where(User.id == user_id)).first(),
+)
+watch_users(db.session, User, user_states)
+
+@jwt.token_in_blocklist_loader
+def token_revoked(jwt_header, jwt_payload):
+    return user_states.is_revoked(jwt_payload)
+
+from functools import partial, wraps
 from flask_jwt_extended import verify_jwt_in_request
 
 # --- Decorators ---
 def admin_required():
+    """Verifies the access token and requires its user to currently be an admin."""
     def wrapper(fn):
         @wraps(fn)
         def decorator(*args, **kwargs):
             verify_jwt_in_request()
-            current_user_identity = get_jwt_identity()
-            user = User.query.get(current_user_identity['id'])
-            if user and user.role == 'admin':
+            state = user_states.get(token_user_id(get_jwt()))
+            if state and state.role == 'admin':
                 return fn(*args, **kwargs)
             else:
                 return jsonify(msg='Admins only!'), 403
         return decorator
     return wrapper
 
+def request_user_id():
+    """The user id of a valid access token on the current request, if any."""
+    try:
+        verify_jwt_in_request(optional=True)
+    except Exception:
+        return None
+    claims = get_jwt()
+    return token_user_id(claims) if claims else None
+
+rate_limiter = ratelimit.RateLimiter(identify_user=request_user_id)
+
+def config_value(name):
+    """Reads ``name`` from the config of the app serving the request, for decorator arguments."""
+    return lambda: current_app.config[name]
+
+# --- Blueprints ---
+auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
+properties_bp = Blueprint('properties', __name__, url_prefix='/api/properties')
+bookings_bp = Blueprint('bookings', __name__, url_prefix='/api/bookings')
+admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
+# /media and /metrics, outside the /api tree
+site_bp = Blueprint('site', __name__)
+# Commands added to `flask` itself rather than a `flask commands` group
+commands = Blueprint('commands', __name__, cli_group=None)
+
 # --- Authentication Endpoints ---
 
-@app.route('/api/auth/register', methods=['POST'])
+@auth_bp.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    response = jsonify({'error': 'Too many login attempts in progress, please retry'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@auth_bp.route('/register', methods=['POST'])
+@rate_limiter.limit(config_value('RATELIMIT_REGISTER'))
 def register():
     data = request.get_json()
     name = data.get('name')
@@ -143,7 +622,8 @@ def register():
 
     return jsonify({'message': 'User created successfully'}), 201
 
-@app.route('/api/auth/login', methods=['POST'])
+@auth_bp.route('/login', methods=['POST'])
+@rate_limiter.limit(config_value('RATELIMIT_LOGIN'))
 def login():
     data = request.get_json()
     email = data.get('email')
@@ -152,83 +632,368 @@ def login():
     user = User.query.filter_by(email=email).first()
 
     if user and user.check_password(password):
-        access_token = create_access_token(identity={'id': user.id, 'name': user.name, 'email': user.email, 'role': user.role})
+        if user.password_needs_rehash():
+            # The configured cost changed since this hash was made
+            user.set_password(password)
+            db.session.commit()
+        access_token = user.create_token()
         return jsonify(access_token=access_token)
 
     return jsonify({'error': 'Invalid credentials'}), 401
 
-@app.route('/api/auth/me', methods=['GET'])
+@auth_bp.route('/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
-    current_user_identity = get_jwt_identity()
+    claims = get_jwt()
+    user_id = token_user_id(claims)
+    # The role may have changed since the token was issued; report the current one
+    state = user_states.get(user_id)
+    current_user_identity = {'id': user_id, 'name': claims.get('name'),
+                             'email': claims.get('email'), 'role': state.role if state else None}
     return jsonify(logged_in_as=current_user_identity), 200
 
+@admin_bp.route('/auth/password-hasher', methods=['GET'])
+@admin_required()
+def password_hasher_stats():
+    return jsonify(password_hasher.stats())
+
+# --- Metrics ---
+
+request_metrics.registry.callback('password_hash_queue_depth', 'Password operations waiting or running.',
+                                  lambda: password_hasher.stats()['queue_depth'])
+request_metrics.registry.callback('load_shedder_in_flight_limit', 'Current adaptive in-flight request limit.',
+                                  lambda: load_shedder.in_flight_limit)
+request_metrics.registry.callback('load_shedder_rejected_total', 'Requests answered 503 by the load shedder.',
+                                  lambda: load_shedder.shed, kind='counter')
+
+@site_bp.route('/metrics', methods=['GET'])
+@load_shedder.exempt_view
+def prometheus_metrics():
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    token = current_app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(request_metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 # --- Google OAuth Endpoints ---
 
-@app.route('/api/auth/google/login')
+# Discovery, signing keys and the connection pool are shared by the process's
+# requests; create_app() applies the settings
+google_provider = oidc.Provider()
+request_metrics.registry.callback('oauth_circuit_open', 'Whether calls to the identity provider are suspended.',
+                                  lambda: int(google_provider.breaker.state != 'closed'))
+
+@auth_bp.route('/google/login')
 def google_login():
-    redirect_uri = 'http://localhost:5001/api/auth/google/callback'
-    return google.authorize_redirect(redirect_uri)
+    state, nonce = secrets.token_urlsafe(24), secrets.token_urlsafe(24)
+    try:
+        url = google_provider.authorization_url(current_app.config['GOOGLE_REDIRECT_URI'], state, nonce)
+    except oidc.ProviderError as e:
+        current_app.logger.warning('Google sign-in unavailable: %s', e)
+        return redirect('http://localhost:3001/login?error=oauth_failed')
+    session['google_oauth'] = {'state': state, 'nonce': nonce}
+    return redirect(url)
 
-@app.route('/api/auth/google/callback')
+@auth_bp.route('/google/callback')
 def google_authorize():
+    pending = session.pop('google_oauth', None)
     try:
-        token = google.authorize_access_token()
-        user_info = google.get('userinfo').json()
-        email = user_info['email']
-        name = user_info['name']
-        
+        if pending is None or not hmac.compare_digest(request.args.get('state', ''), pending['state']):
+            raise oidc.SignInRejected('The callback state does not match a sign-in from this browser')
+        if 'error' in request.args:
+            raise oidc.SignInRejected(f"The provider refused the sign-in: {request.args['error']}")
+        # The only outbound call; the ID token is verified against cached keys
+        tokens = google_provider.exchange_code(request.args.get('code'), current_app.config['GOOGLE_REDIRECT_URI'])
+        claims = google_provider.verify_id_token(tokens.get('id_token'), pending['nonce'])
+        email = claims['email']
+        name = claims.get('name') or email.split('@')[0]
+
         # Find or create the user in the database
         user = User.query.filter_by(email=email).first()
         if not user:
             user = User(email=email, name=name)
             db.session.add(user)
-            db.session.commit()
-            
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Created by a concurrent sign-in with the same account
+                db.session.rollback()
+                user = User.query.filter_by(email=email).one()
+
         # Create a JWT token for our application
-        access_token = create_access_token(identity={'id': user.id, 'name': user.name, 'email': user.email, 'role': user.role})
-        
+        access_token = user.create_token()
+
         # Redirect back to the frontend with the token
         # In a real app, you might use a more secure method than query params
         return redirect(f'http://localhost:3001/login/callback?token={access_token}')
 
-    except Exception as e:
-        print(f"Error during Google OAuth callback: {e}")
+    except (oidc.ProviderError, oidc.SignInRejected) as e:
+        current_app.logger.warning('Google sign-in failed: %s', e)
+        return redirect('http://localhost:3001/login?error=oauth_failed')
+    except Exception:
+        current_app.logger.exception('Error during Google OAuth callback')
         return redirect('http://localhost:3001/login?error=oauth_failed')
 
 
 # --- Property Endpoints ---
 
-@app.route('/api/properties', methods=['GET'])
+def listing_response(default_fields, query_class=ListingQuery):
+    """Runs a paginated listing query built from the request arguments.
+
+    The body stays a JSON array of at most ``limit`` items (default 20). When
+    more remain, the cursor for the next page is returned in the X-Next-Cursor
+    and Link headers; their absence means the list is complete.
+    """
+    try:
+        query = query_class(Property, request.args, default_fields=default_fields)
+    except ListingQueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    items, next_cursor = query.execute(db.session)
+    response = jsonify(items)
+    if next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response
+
+@properties_bp.route('', methods=['GET'])
+@rate_limiter.limit(config_value('RATELIMIT_PUBLIC'), key='user', scope='properties')
+@response_cache.cached
+@replicas.read_replica
 def get_properties():
-    properties = Property.query.all()
-    return jsonify([p.to_dict() for p in properties])
+    return listing_response(SUMMARY_FIELDS)
+
+@properties_bp.route('/search', methods=['GET'])
+@rate_limiter.limit(config_value('RATELIMIT_PUBLIC'), key='user', scope='properties')
+@response_cache.cached
+@replicas.read_replica
+def search_properties():
+    if db.engine.dialect.name != 'sqlite':
+        return jsonify({'error': 'Full-text search requires SQLite FTS5'}), 501
+    try:
+        query = search.SearchQuery(Property, request.args)
+    except ListingQueryError as e:
+        return jsonify({'error': str(e)}), 400
 
-@app.route('/api/properties/<int:property_id>', methods=['GET'])
+    items, next_offset = query.execute(db.session)
+    response = jsonify(items)
+    if next_offset is not None:
+        args = request.args.to_dict()
+        args['offset'] = next_offset
+        response.headers['X-Next-Offset'] = str(next_offset)
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response
+
+@properties_bp.route('/<int:property_id>', methods=['GET'])
+@rate_limiter.limit(config_value('RATELIMIT_PUBLIC'), key='user', scope='properties')
+@response_cache.cached
+@replicas.read_replica
 def get_property(property_id):
     property_data = Property.query.get(property_id)
     if property_data:
         return jsonify(property_data.to_dict())
     return jsonify({'error': 'Property not found'}), 404
 
+@properties_bp.route('/near', methods=['GET'])
+@rate_limiter.limit(config_value('RATELIMIT_PUBLIC'), key='user', scope='properties')
+@response_cache.cached
+@replicas.read_replica
+def properties_near():
+    try:
+        query = geo.NearQuery(Property, request.args)
+    except ListingQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(query.execute(db.session))
+
+@properties_bp.route('/bbox', methods=['GET'])
+@rate_limiter.limit(config_value('RATELIMIT_PUBLIC'), key='user', scope='properties')
+@response_cache.cached
+@replicas.read_replica
+def properties_in_bbox():
+    try:
+        query = geo.BoundingBoxQuery(Property, request.args)
+    except ListingQueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    items, truncated = query.execute(db.session)
+    response = jsonify(items)
+    if truncated:
+        # More listings than pins; the client should zoom in or ask for clusters
+        response.headers['X-Truncated'] = 'true'
+    return response
+
+@properties_bp.route('/clusters', methods=['GET'])
+@rate_limiter.limit(config_value('RATELIMIT_PUBLIC'), key='user', scope='properties')
+@response_cache.cached
+@replicas.read_replica
+def property_clusters():
+    try:
+        query = geo.ClusterQuery(Property, request.args)
+    except ListingQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(query.execute(db.session))
+
+@properties_bp.route('/<int:property_id>/similar', methods=['GET'])
+@rate_limiter.limit(config_value('RATELIMIT_PUBLIC'), key='user', scope='properties')
+@response_cache.cached
+@replicas.read_replica
+def similar_properties(property_id):
+    """Available properties most like this one, most similar first, each with a similarity score."""
+    if not similar.available():
+        return jsonify({'error': 'Similar properties require NumPy'}), 501
+    try:
+        limit = similar.parse_limit(request.args.get('limit'))
+        fields = parse_fields(request.args.get('fields'), SUMMARY_FIELDS)
+    except ListingQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    if db.session.scalar(db.select(Property.id).where(Property.id == property_id)) is None:
+        return jsonify({'error': 'Property not found'}), 404
+
+    similar_index.ensure(partial(load_similarity_features, current_app._get_current_object()))
+    if property_id not in similar_index:
+        # Added by another process since the matrix was built
+        similar_index.upsert(*similar.fetch(db.session, Property, amenity_pairs(), ids=[property_id]))
+    matches = similar_index.top_k([property_id], limit).get(property_id, [])
+
+    selected = dict.fromkeys(('id',) + column_fields(fields))
+    rows = db.session.execute(
+        db.select(*(getattr(Property, f) for f in selected)).where(Property.id.in_([m for m, _ in matches]))
+    ).all()
+    by_id = {row.id: row for row in rows}
+    # Listings deleted by another process may linger in the matrix until its rebuild
+    matches = [(match_id, score) for match_id, score in matches if match_id in by_id]
+    items = serialize_rows(db.session, Property, [by_id[match_id] for match_id, _ in matches], fields)
+    for item, (_, score) in zip(items, matches):
+        item['similarity'] = score
+    return jsonify(items)
+
+# Not response-cached: bookings come and go far more often than listings
+# change, and they do not invalidate the cache
+@properties_bp.route('/available', methods=['GET'])
+@rate_limiter.limit(config_value('RATELIMIT_PUBLIC'), key='user', scope='properties')
+@replicas.read_replica
+def available_properties():
+    """The listing narrowed to properties free from check_in to check_out."""
+    query_class = partial(bookings.AvailabilityQuery, booking_table=Booking.__table__,
+                          dialect=db.session.get_bind().dialect.name)
+    return listing_response(SUMMARY_FIELDS, query_class)
+
+@properties_bp.route('/<int:property_id>/calendar', methods=['GET'])
+@rate_limiter.limit(config_value('RATELIMIT_PUBLIC'), key='user', scope='properties')
+@replicas.read_replica
+def property_calendar(property_id):
+    """Booked stays between start and end (default: the next 90 days)."""
+    try:
+        start, end = bookings.parse_window(request.args)
+    except ListingQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    if db.session.scalar(db.select(Property.id).where(Property.id == property_id)) is None:
+        return jsonify({'error': 'Property not found'}), 404
+    return jsonify({
+        'property_id': property_id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'booked': bookings.calendar(db.session, Booking.__table__, property_id, start, end),
+    })
+
+# --- Booking Endpoints ---
+
+@bookings_bp.route('', methods=['POST'])
+@rate_limiter.limit(config_value('RATELIMIT_BOOKING'), key='user', scope='bookings')
+def create_booking():
+    data = request.get_json(silent=True) or {}
+    try:
+        check_in, check_out = bookings.parse_stay(data.get('check_in_date'), data.get('check_out_date'),
+                                                  earliest=bookings.today())
+        booking = Booking(
+            property_id=int(data['property_id']),
+            user_id=request_user_id(),
+            guest_name=data['guest_name'],
+            guest_email=data['guest_email'],
+            guest_phone=data.get('guest_phone'),
+            check_in_date=check_in,
+            check_out_date=check_out,
+            guests_count=int(data['guests_count']),
+            total_price=float(data['total_price']),
+            special_requests=data.get('special_requests'),
+        )
+    except KeyError as e:
+        return jsonify({'error': f'Missing field: {e}'}), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    if booking.guests_count < 1:
+        return jsonify({'error': 'guests_count must be positive'}), 400
+
+    is_available = db.session.scalar(db.select(Property.is_available).where(Property.id == booking.property_id))
+    if is_available is None:
+        return jsonify({'error': 'Property not found'}), 404
+    if not is_available:
+        return jsonify({'error': 'Property not available for booking'}), 409
+    try:
+        bookings.reserve(db.session, booking, Property)
+    except LookupError:
+        return jsonify({'error': 'Property not found'}), 404
+    except bookings.BookingConflict as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(booking.to_dict()), 201
+
+@admin_bp.route('/properties/<int:property_id>/bookings', methods=['GET'])
+@admin_required()
+def get_property_bookings(property_id):
+    """A property's bookings by check-in date, optionally only those with a given status."""
+    stmt = db.select(Booking).where(Booking.property_id == property_id)
+    if request.args.get('status'):
+        stmt = stmt.where(Booking.status == request.args['status'])
+    rows = db.session.scalars(stmt.order_by(Booking.check_in_date, Booking.id))
+    return jsonify([booking.to_dict() for booking in rows])
+
+@admin_bp.route('/bookings/<int:booking_id>', methods=['PUT'])
+@admin_required()
+def update_booking_status(booking_id):
+    booking = db.session.get(Booking, booking_id)
+    if booking is None:
+        return jsonify({'error': 'Booking not found'}), 404
+    status = (request.get_json(silent=True) or {}).get('status')
+    if status not in bookings.STATUSES:
+        return jsonify({'error': f"status must be one of: {', '.join(bookings.STATUSES)}"}), 400
+
+    # A cancelled booking only gets its dates back if nobody took them since
+    reactivated = status in bookings.BLOCKING_STATUSES and booking.status not in bookings.BLOCKING_STATUSES
+    booking.status = status
+    try:
+        if reactivated:
+            bookings.reserve(db.session, booking, Property)
+        else:
+            db.session.commit()
+    except LookupError:
+        return jsonify({'error': 'Property not found'}), 404
+    except bookings.BookingConflict as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(booking.to_dict()), 200
+
 # --- Admin Property Endpoints ---
 
-@app.route('/api/admin/properties', methods=['POST'])
-@jwt_required()
+@admin_bp.route('/properties', methods=['POST'])
 @admin_required()
 def create_property():
     data = request.get_json()
     try:
+        latitude, longitude = geo.point_from(data)
         new_property = Property(
             title=data['title'],
             description=data['description'],
             price=data['price'],
             location=data['location'],
+            latitude=latitude,
+            longitude=longitude,
             bedrooms=data['bedrooms'],
             bathrooms=data['bathrooms'],
             area=data['area'],
-            images=data.get('images', ''), # Optional, default to empty string
-            amenities=data.get('amenities', ''), # Optional, default to empty string
+            images=data.get('images', []), # Optional list (or legacy comma-separated string)
+            amenities=data.get('amenities', []), # Optional list (or legacy comma-separated string)
             is_available=data.get('is_available', True)
         )
         db.session.add(new_property)
@@ -236,19 +1001,19 @@ def create_property():
         return jsonify(new_property.to_dict()), 201
     except KeyError as e:
         return jsonify({'error': f'Missing field: {e}'}), 400
+    except ListingQueryError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/admin/properties', methods=['GET'])
-@jwt_required()
+@admin_bp.route('/properties', methods=['GET'])
 @admin_required()
+@replicas.read_replica
 def get_admin_properties():
-    properties = Property.query.all()
-    return jsonify([p.to_dict() for p in properties])
+    return listing_response(FIELDS)
 
-@app.route('/api/admin/properties/<int:property_id>', methods=['GET'])
-@jwt_required()
+@admin_bp.route('/properties/<int:property_id>', methods=['GET'])
 @admin_required()
 def get_admin_property(property_id):
     property_data = Property.query.get(property_id)
@@ -256,8 +1021,7 @@ def get_admin_property(property_id):
         return jsonify(property_data.to_dict())
     return jsonify({'error': 'Property not found'}), 404
 
-@app.route('/api/admin/properties/<int:property_id>', methods=['PUT'])
-@jwt_required()
+@admin_bp.route('/properties/<int:property_id>', methods=['PUT'])
 @admin_required()
 def update_property(property_id):
     property_to_update = Property.query.get(property_id)
@@ -270,21 +1034,27 @@ def update_property(property_id):
         property_to_update.description = data.get('description', property_to_update.description)
         property_to_update.price = data.get('price', property_to_update.price)
         property_to_update.location = data.get('location', property_to_update.location)
+        property_to_update.latitude, property_to_update.longitude = geo.point_from(
+            data, (property_to_update.latitude, property_to_update.longitude))
         property_to_update.bedrooms = data.get('bedrooms', property_to_update.bedrooms)
         property_to_update.bathrooms = data.get('bathrooms', property_to_update.bathrooms)
         property_to_update.area = data.get('area', property_to_update.area)
-        property_to_update.images = data.get('images', property_to_update.images)
-        property_to_update.amenities = data.get('amenities', property_to_update.amenities)
+        if 'images' in data:
+            property_to_update.images = data['images']
+        if 'amenities' in data:
+            property_to_update.amenities = data['amenities']
         property_to_update.is_available = data.get('is_available', property_to_update.is_available)
 
         db.session.commit()
         return jsonify(property_to_update.to_dict()), 200
+    except ListingQueryError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/admin/properties/<int:property_id>', methods=['DELETE'])
-@jwt_required()
+@admin_bp.route('/properties/<int:property_id>', methods=['DELETE'])
 @admin_required()
 def delete_property(property_id):
     property_to_delete = Property.query.get(property_id)
@@ -300,50 +1070,468 @@ def delete_property(property_id):
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/api/admin/upload-image', methods=['POST'])
-@jwt_required()
+@admin_bp.route('/stats', methods=['GET'])
+@admin_required()
+@replicas.read_replica
+def get_stats():
+    """Overall market statistics plus breakdowns (group_by=location,bedrooms,location_bedrooms)."""
+    try:
+        groupings = stats.parse_groupings(request.args.get('group_by'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Not populated yet (no property written since the table was created)
+    groups = stats.load(db.session, PropertyStats.__table__) or stats.compute(db.session, Property)
+    return jsonify(stats.report(groups, groupings))
+
+
+@admin_bp.route('/upload-image', methods=['POST'])
 @admin_required()
 def upload_image():
-    if 'file' not in request.files:
+    # Only this view takes large bodies, so the limit is set here rather than app-wide
+    request.max_content_length = current_app.config['MEDIA_MAX_UPLOAD_SIZE']
+    try:
+        files = request.files
+    except RequestEntityTooLarge:
+        return jsonify({'error': f"Uploads are limited to {current_app.config['MEDIA_MAX_UPLOAD_SIZE']} bytes"}), 413
+    if 'file' not in files:
         return jsonify({'error': 'No file part'}), 400
-    file = request.files['file']
+    file = files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        # Create the upload folder if it doesn't exist
-        upload_path = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
-        os.makedirs(upload_path, exist_ok=True)
-        
-        file_path = os.path.join(upload_path, filename)
-        file.save(file_path)
-        # Return the URL to access the image
-        return jsonify({'url': f'http://localhost:5000/{app.config['UPLOAD_FOLDER']}/{filename}'}), 200
+        # The bytes decide the format: a renamed text file is not an image
+        ext = media.sniff(file.stream.read(media.SNIFF_SIZE))
+        file.stream.seek(0)
+        if ext is None:
+            return jsonify({'error': 'File is not a PNG, JPEG, GIF or WebP image'}), 400
+        # Stored under its content hash: identical uploads share one file
+        digest, path, size, created = media.store_stream(file.stream, media_root(), ext)
+
+        asset = db.session.get(MediaAsset, digest)
+        if asset is None:
+            try:
+                asset = MediaAsset(digest=digest, path=path, content_type=media.CONTENT_TYPES[ext], size=size)
+                db.session.add(asset)
+                db.session.commit()
+            except IntegrityError:
+                # A concurrent upload of the same bytes registered it first
+                db.session.rollback()
+                asset = db.session.get(MediaAsset, digest)
+        elif created and asset.path != path:
+            # Same bytes uploaded under another extension; keep the first copy
+            os.unlink(os.path.join(media_root(), path))
+
+        if asset.status == 'pending':
+            # One job per image however often it is uploaded
+            job_queue.enqueue(db.session, 'media.variants', {'digest': digest}, idempotency_key=f'media.variants:{digest}')
+            db.session.commit()
+        # Variants are generated in the background; poll the media endpoint for them
+        return jsonify(asset.to_dict()), 202 if asset.status == 'pending' else 200
     else:
         return jsonify({'error': 'File type not allowed'}), 400
 
+@site_bp.route('/media/<path:filename>', methods=['GET'])
+def serve_media(filename):
+    resolved = media.resolve(media_root(), filename, request.accept_mimetypes)
+    if resolved is None:
+        return jsonify({'error': 'Media not found'}), 404
+    relative, content_type = resolved
+
+    if current_app.config['MEDIA_OFFLOAD'] == 'x-accel':
+        # Nginx serves the bytes (ranges, conditional GETs) from an internal location
+        response = Response(mimetype=content_type)
+        response.headers['X-Accel-Redirect'] = f"{current_app.config['MEDIA_ACCEL_PREFIX'].rstrip('/')}/{relative}"
+    else:
+        # The file name is its content hash, so it doubles as a strong ETag;
+        # conditional=True answers If-None-Match and Range requests.
+        response = send_file(os.path.join(media_root(), relative), mimetype=content_type,
+                             conditional=True, etag=os.path.basename(relative), max_age=None)
+    response.headers['Cache-Control'] = media.IMMUTABLE_CACHE_CONTROL
+    response.vary.add('Accept')
+    return response
+
+@admin_bp.route('/media/<digest>', methods=['GET'])
+@admin_required()
+def get_media(digest):
+    asset = db.session.get(MediaAsset, digest)
+    if asset:
+        return jsonify(asset.to_dict())
+    return jsonify({'error': 'Media not found'}), 404
+
+
+def after_core_writes():
+    """Catches up on what Core-level property writes hid from the ORM session hooks."""
+    response_cache.invalidate()
+    similar_index.invalidate()
+    stats.rebuild(db.session, Property, PropertyStats.__table__)
+    db.session.commit()
+
+def run_import(importer, records):
+    """Runs a bulk import; batches committed before an error still reach the caches."""
+    try:
+        return importer.run(records)
+    finally:
+        if importer.inserted or importer.updated:
+            after_core_writes()
+
+@admin_bp.route('/properties/bulk', methods=['POST'])
+@admin_required()
+def bulk_import_properties():
+    try:
+        fmt = bulk.detect_format(content_type=request.content_type, explicit=request.args.get('format'))
+        batch_size = int(request.args.get('batch_size', bulk.DEFAULT_BATCH_SIZE))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if batch_size < 1:
+        return jsonify({'error': 'batch_size must be at least 1'}), 400
+
+    # Read the body as a stream so large feeds are never held in memory at once
+    stream = bulk.open_text(request.stream)
+    importer = bulk.PropertyImporter(db.session, db.metadata, batch_size=batch_size, geocoder=current_geocoder())
+    report = run_import(importer, bulk.iter_records(stream, fmt))
+    return jsonify(report), 200
+
+@admin_bp.route('/properties/export', methods=['GET'])
+@admin_required()
+def export_properties():
+    try:
+        fmt = bulk.detect_format(explicit=request.args.get('format', 'ndjson'), formats=bulk.EXPORT_FORMATS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    mimetype = {'csv': 'text/csv', 'json': 'application/json'}.get(fmt, 'application/x-ndjson')
+    rows = bulk.iter_property_rows(db.session, Property)
+    # Keep FIELDS order in exported records rather than the API's sorted keys
+    chunks = bulk.iter_export(rows, fmt, partial(current_app.json.dumps_bytes, sort_keys=False))
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=properties.{fmt}'})
 
-@app.cli.command('create-admin-user')
+
+@commands.cli.command('import-properties')
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), help='Defaults to the file extension')
+@click.option('--batch-size', default=bulk.DEFAULT_BATCH_SIZE, show_default=True, type=click.IntRange(min=1))
+def import_properties(source, fmt, batch_size):
+    "Imports properties from an NDJSON or CSV file ('-' for stdin)"
+    fmt = bulk.detect_format(filename=source.name, explicit=fmt)
+    stream = bulk.open_text(source)
+    importer = bulk.PropertyImporter(db.session, db.metadata, batch_size=batch_size, geocoder=current_geocoder())
+    report = run_import(importer, bulk.iter_records(stream, fmt))
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Inserted {report['inserted']}, updated {report['updated']}, failed {report['failed']}.")
+
+
+@commands.cli.command('export-properties')
+@click.argument('output', type=click.File('wb'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(bulk.EXPORT_FORMATS), default='ndjson', show_default=True)
+def export_properties_command(output, fmt):
+    "Exports all properties as NDJSON, a JSON array or CSV ('-' for stdout)"
+    rows = bulk.iter_property_rows(db.session, Property)
+    for chunk in bulk.iter_export(rows, fmt, partial(current_app.json.dumps_bytes, sort_keys=False)):
+        output.write(chunk)
+
+
+@commands.cli.command('create-admin-user')
 @click.argument('email')
 @click.argument('password')
 def create_admin_user(email, password):
     "Creates a new admin user"
+    user = User.query.filter_by(email=email).first()
+    if user:
+        click.echo(f'User with email {email} already exists.')
+        return
+
+    new_user = User(name='Admin', email=email, role='admin')
+    new_user.set_password(password)
+    db.session.add(new_user)
+    db.session.commit()
+    click.echo(f'Admin user {email} created successfully!')
+
+
+def sync_with_node(node_db=None, direction='both', batch_size=sync.DEFAULT_BATCH_SIZE):
+    """Exchanges property changes with the Node backend; returns ``[(step, report)]``."""
+    node_db = node_db or current_app.config['NODE_DATABASE_PATH']
+    if not os.path.exists(node_db):
+        raise FileNotFoundError(f'Node database not found: {node_db}')
+    engine = db_config.create_engine(f'sqlite:///{os.path.abspath(node_db)}', current_app.config['SQLITE_PRAGMAS'])
+    reports = []
+    with engine.connect() as connection:
+        local = sync.FlaskStore(db.session, Property, PropertyChange.__table__)
+        node = sync.NodeStore(connection)
+        state = sync.SyncState(db.session, SyncCheckpoint.__table__, PropertySyncLink.__table__)
+        node.ensure_change_log()
+        connection.commit()
+
+        def commit_node_first():
+            # Pushed rows must exist in Node before the links and checkpoint that record them
+            connection.commit()
+            db.session.commit()
+
+        def commit_local_first():
+            db.session.commit()
+            connection.commit()
+
+        for step in ('pull', 'push') if direction == 'both' else (direction,):
+            if step == 'push':
+                report = sync.replicate(local, node, state, 'push', batch_size, commit_node_first)
+            else:
+                report = sync.replicate(node, local, state, 'pull', batch_size, commit_local_first)
+            reports.append((step, report))
+    engine.dispose()
+    return reports
+
+
+@job_queue.task('sync.properties', queue='sync', max_attempts=3)
+def sync_properties_job():
+    for step, report in sync_with_node():
+        current_app.logger.info('Node sync %s: %s', step, report)
+
+
+@commands.cli.command('sync-properties')
+@click.option('--direction', type=click.Choice(sync.DIRECTIONS), default='both',
+              help='push sends local changes to Node, pull applies Node changes here')
+@click.option('--node-db', default=None, help='Path to the Node backend database')
+@click.option('--batch-size', default=sync.DEFAULT_BATCH_SIZE, show_default=True)
+def sync_properties(direction, node_db, batch_size):
+    "Applies property changes since the last sync between this app and the Node backend"
+    try:
+        reports = sync_with_node(node_db, direction, batch_size)
+    except FileNotFoundError as e:
+        raise click.ClickException(str(e))
+    for step, report in reports:
+        for error in report['errors']:
+            click.echo(f"{step}: property {error['id']}: {error['error']}", err=True)
+        click.echo(f"{step}: {report['inserted']} inserted, {report['updated']} updated, "
+                   f"{report['deleted']} deleted, {report['skipped']} skipped, {report['failed']} failed")
+
+
+@commands.cli.command('worker')
+@click.option('--queues', default=None, help='Comma-separated queues to consume (default: every registered queue)')
+@click.option('--concurrency', type=int, default=None, help='Jobs run at once (default: JOBS_CONCURRENCY)')
+@click.option('--mode', type=click.Choice(jobs.MODES), default=None, help='Default: JOBS_MODE')
+def worker(queues, concurrency, mode):
+    "Runs background jobs until interrupted"
+    app = current_app._get_current_object()
+    job_worker = jobs.Worker(
+        app, job_queue, db.engine,
+        queues=[q.strip() for q in queues.split(',') if q.strip()] if queues else None,
+        concurrency=concurrency or app.config['JOBS_CONCURRENCY'],
+        mode=mode or app.config['JOBS_MODE'],
+        queue_limits=app.config['JOBS_QUEUE_LIMITS'],
+        poll_interval=app.config['JOBS_POLL_INTERVAL'],
+        # Process-mode children build their own app from the environment
+        app_import='wsgi:app',
+    )
+    click.echo(f"Worker consuming {', '.join(job_worker.queues)} ({job_worker.concurrency} {job_worker.mode}s)")
+    try:
+        job_worker.run()
+    except KeyboardInterrupt:
+        click.echo('Stopping; waiting for running jobs to finish.')
+
+
+@commands.cli.command('revoke-tokens')
+@click.argument('email')
+def revoke_tokens(email):
+    "Invalidates every access token issued to a user"
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        click.echo(f'No user with email {email}.')
+        return
+    user.revoke_tokens()
+    db.session.commit()
+    click.echo(f'Tokens for {email} revoked.')
+
+
+@commands.cli.command('geocode-properties')
+@click.option('--all', 'overwrite', is_flag=True, help='Re-geocode properties that already have coordinates')
+def geocode_properties(overwrite):
+    "Fills property coordinates from their location"
+    geocoder = current_geocoder()
+    if geocoder is None:
+        raise click.ClickException('No geocoder configured (GEOCODER=none)')
+    geocoded, unresolved = geo.geocode_missing(db.session, Property, geocoder, overwrite=overwrite)
+    response_cache.invalidate()
+    click.echo(f'Geocoded {geocoded} properties; {unresolved} locations not found.')
+
+
+@commands.cli.command('normalize-properties')
+@click.option('--batch-size', default=bulk.DEFAULT_BATCH_SIZE, show_default=True, type=click.IntRange(min=1))
+def normalize_properties(batch_size):
+    "Copies images and amenities from the old property columns into their tables"
+    try:
+        copied = bulk.copy_legacy_lists(db.session, db.metadata, batch_size=batch_size)
+    finally:
+        # Batches committed before an error are already being served
+        after_core_writes()
+    click.echo(f'Copied images and amenities of {copied} properties.')
+
+
+@commands.cli.command('rebuild-stats')
+@click.option('--check', is_flag=True, help='Only report groups that differ from a full recomputation')
+def rebuild_stats(check):
+    "Recomputes market statistics from the property table"
+    table = PropertyStats.__table__
+    mismatched = stats.compare(stats.load(db.session, table), stats.compute(db.session, Property))
+    for location, bedrooms in mismatched:
+        click.echo(f'out of date: {location!r}, {bedrooms} bedrooms', err=True)
+    if check:
+        click.echo(f'{len(mismatched)} groups differ.')
+        if mismatched:
+            raise SystemExit(1)
+        return
+    groups = stats.rebuild(db.session, Property, table)
+    db.session.commit()
+    click.echo(f'Rebuilt {groups} groups ({len(mismatched)} were out of date).')
+
+
+@commands.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    "Rebuilds the full-text property search index"
+    with db.engine.begin() as connection:
+        search.rebuild_index(connection)
+    click.echo('Search index rebuilt.')
+
+
+def init_migrate(app):
+    """Sets Flask-Migrate up for ``app`` unless done already; Alembic is slow to import."""
+    if 'migrate' not in app.extensions:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+class MigrateCommands(click.Command):
+    """`flask db`: stands in for Flask-Migrate's command group until it is run."""
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        from flask_migrate.cli import db as migrate_commands
+        init_migrate(current_app._get_current_object())
+        return migrate_commands.make_context(info_name, args, parent=parent, **extra)
+
+commands.cli.add_command(MigrateCommands('db', help='Perform database migrations.'))
+
+
+# --- Application Factory ---
+
+def create_app(config=None):
+    """
+    Builds the app from the environment, with ``config`` (a mapping of
+    settings) applied on top. Nothing here connects to the database or
+    starts a thread or process, so a preforking server can create the app
+    once and fork its workers from it.
+    """
+    load_dotenv()
+    config = dict(config or {})
+    app = Flask(__name__)
+    # orjson-backed jsonify/request.json when orjson is installed
+    app.json = jsonio.FastJSONProvider(app)
+    app.config.update(config_from_env())
+    app.config.update(config)
+    # Derived settings follow the overrides unless given themselves
+    if 'SQLALCHEMY_ENGINE_OPTIONS' not in config:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_config.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    if 'USE_X_SENDFILE' not in config:
+        app.config['USE_X_SENDFILE'] = app.config['MEDIA_OFFLOAD'] == 'x-sendfile'
+    # Listing and search bodies are bare arrays; browsers only see where the
+    # next page is if these headers are exposed to cross-origin scripts
+    CORS(app, expose_headers=['X-Next-Cursor', 'X-Next-Offset', 'Link'])
+
+    db.init_app(app)
+    replica_router = replicas.ReplicaRouter(
+        [db_config.create_engine(uri, app.config['SQLITE_PRAGMAS']) for uri in app.config['DB_REPLICA_URIS']],
+        strategy=app.config['DB_REPLICA_STRATEGY'],
+        sticky_seconds=app.config['DB_REPLICA_STICKY_SECONDS'],
+        retry_seconds=app.config['DB_REPLICA_RETRY_SECONDS'],
+        last_shared_write=response_cache.last_invalidated,
+    )
     with app.app_context():
-        user = User.query.filter_by(email=email).first()
-        if user:
-            click.echo(f'User with email {email} already exists.')
-            return
+        db_config.install_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+        engines = [*db.engines.values(), *replica_router.replicas]
+    _engines.update(engines)
+    replicas.init_app(app, replica_router)
+    if app.config['METRICS_ENABLED']:
+        request_metrics.n_plus_one_threshold = app.config['METRICS_N_PLUS_ONE_THRESHOLD']
+        request_metrics.server_timing = app.config['METRICS_SERVER_TIMING']
+        request_metrics.init_app(app, engines)
+    compression.init_app(app, compression.Compressor(
+        min_size=app.config['COMPRESS_MIN_SIZE'],
+        level=app.config['COMPRESS_LEVEL'],
+        brotli_quality=app.config['COMPRESS_BROTLI_QUALITY'],
+        cache_size=app.config['COMPRESS_CACHE_SIZE'],
+    ))
+    load_shedder.configure(
+        max_in_flight=app.config['SHED_MAX_IN_FLIGHT'],
+        target_p99_ms=app.config['SHED_TARGET_P99_MS'],
+        max_queue_ms=app.config['SHED_MAX_QUEUE_MS'],
+    )
+    if app.config['SHED_ENABLED']:
+        load_shedder.init_app(app)
+    # The pool itself is only started by the first hash
+    password_hasher.configure(
+        rounds=app.config['BCRYPT_LOG_ROUNDS'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+        verified_ttl=app.config['PASSWORD_VERIFY_CACHE_TTL'],
+    )
+    jwt.init_app(app)
+    user_states.ttl = app.config['AUTH_STATE_CACHE_TTL']
+    rate_limiter.backend = ratelimit.make_backend(app.config)
+    rate_limiter.enabled = app.config['RATELIMIT_ENABLED']
+    response_cache.backend = make_backend(app.config)
+    similar_index.max_age = app.config['SIMILAR_MAX_AGE']
+    google_provider.configure(
+        discovery_url=app.config['GOOGLE_DISCOVERY_URL'],
+        client_id=app.config['GOOGLE_CLIENT_ID'],
+        client_secret=app.config['GOOGLE_CLIENT_SECRET'],
+        connect_timeout=app.config['OAUTH_CONNECT_TIMEOUT'],
+        read_timeout=app.config['OAUTH_READ_TIMEOUT'],
+        pool_size=app.config['OAUTH_POOL_SIZE'],
+        failure_threshold=app.config['OAUTH_BREAKER_FAILURES'],
+        reset_seconds=app.config['OAUTH_BREAKER_RESET_SECONDS'],
+        ttl=app.config['OAUTH_KEYS_TTL'],
+    )
+    app.extensions['geocoder'] = geo.make_geocoder(app.config)
 
-        new_user = User(name='Admin', email=email, role='admin')
-        new_user.set_password(password)
-        db.session.add(new_user)
-        db.session.commit()
-        click.echo(f'Admin user {email} created successfully!')
+    job_queue.lease_seconds = app.config['JOBS_LEASE_SECONDS']
+    job_queue.retention_days = app.config['JOBS_RETENTION_DAYS']
+    job_queue.tasks['sync.properties'].every = app.config['NODE_SYNC_INTERVAL'] or None
+    job_queue.init_app(app)
+
+    for blueprint in (auth_bp, properties_bp, bookings_bp, admin_bp, site_bp, commands):
+        app.register_blueprint(blueprint)
+    return app
+
+
+# Engines of the apps built in this process, reset in forked children
+_engines = weakref.WeakSet()
+
+def _after_fork():
+    """
+    Runs in the child of a fork (e.g. a preforking server's worker). Pooled
+    connections inherited from the parent must not be shared between the
+    processes, so the child forgets them without closing the parent's
+    sockets, and drops the parent's password hashing pool and its
+    connections to the identity provider.
+    """
+    for engine in list(_engines):
+        engine.dispose(close=False)
+    password_hasher.after_fork()
+    google_provider.after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
 
 
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
         db.create_all()
     print("Real Estate API Server Starting...")
     print("Flask Auth Server running on http://localhost:5001")
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Only the reloader's child serves requests; run jobs alongside it
+        with app.app_context():
+            jobs.Worker(app, job_queue, db.engine, concurrency=app.config['JOBS_CONCURRENCY'],
+                        queue_limits=app.config['JOBS_QUEUE_LIMITS'],
+                        poll_interval=app.config['JOBS_POLL_INTERVAL']).start()
     app.run(debug=True, port=5001)
@@ -0,0 +1,92 @@
+"""
+Cached authorization state for JWT-protected endpoints.
+
+Access tokens carry the user id as their subject and the user's name, email,
+role and token version as additional claims. Authorization still follows the
+database: a request is allowed by the user's *current* role, and a token
+whose version is older than the user's ``token_version``, or whose user no
+longer exists, is treated as revoked. Both are read through ``UserStateCache`` so a burst of admin calls
+costs one small query per user per TTL instead of one per request. Commits
+that change a user drop that user's entry immediately; other processes catch
+up within the TTL.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event
+
+UserState = namedtuple('UserState', 'role token_version')
+
+
+def token_claims(user):
+    """Additional claims embedded in access tokens for ``user``."""
+    return {'name': user.name, 'email': user.email, 'role': user.role, 'ver': user.token_version or 0}
+
+
+def token_user_id(claims):
+    return int(claims['sub'])
+
+
+class UserStateCache:
+    """
+    LRU of ``user_id -> UserState`` entries with a short TTL. ``load(user_id)``
+    returns the ``(role, token_version)`` row or None for a missing user;
+    missing users are cached too.
+    """
+
+    def __init__(self, load, ttl=30, maxsize=4096):
+        self.load = load
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                return entry[0]
+        row = self.load(user_id)
+        state = UserState(row.role, row.token_version or 0) if row is not None else None
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[user_id] = (state, now + self.ttl)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return state
+
+    def is_revoked(self, claims):
+        state = self.get(token_user_id(claims))
+        # A deleted user's tokens die with the account
+        return state is None or state.token_version != claims.get('ver', 0)
+
+    def invalidate(self, user_ids=None):
+        with self._lock:
+            if user_ids is None:
+                self._entries.clear()
+            else:
+                for user_id in user_ids:
+                    self._entries.pop(user_id, None)
+
+
+def watch_users(session, model, state_cache):
+    """Drops cached state for every ``model`` row changed by a committed transaction."""
+    @event.listens_for(session, 'after_flush')
+    def _record_changes(sess, flush_context):
+        changed = {obj.id for obj in (*sess.new, *sess.dirty, *sess.deleted) if isinstance(obj, model)}
+        if changed:
+            sess.info.setdefault('user_state_dirty', set()).update(changed)
+
+    @event.listens_for(session, 'after_commit')
+    def _invalidate(sess):
+        changed = sess.info.pop('user_state_dirty', None)
+        if changed:
+            state_cache.invalidate(changed)
+
+    @event.listens_for(session, 'after_rollback')
+    def _discard(sess):
+        sess.info.pop('user_state_dirty', None)
@@ -0,0 +1,90 @@
+"""
+Job enqueue latency as seen by a request handler.
+
+Times ``job_queue.enqueue`` against a throwaway SQLite database, alone and
+followed by the commit a handler would issue, with and without an
+idempotency key, and prints percentiles in microseconds. With ``--drain``
+it then starts a worker and reports how long the queued jobs took to run.
+
+    cd backend
+    python benchmarks/enqueue_latency.py --jobs 5000 --drain
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6
+    return pick(0.5), pick(0.95), pick(0.99), statistics.fmean(samples) * 1e6
+
+
+def run_scenario(job_queue, db, jobs, commit, keyed):
+    samples = []
+    for i in range(jobs):
+        key = f'bench:{commit}:{i}' if keyed else None
+        started = time.perf_counter()
+        job_queue.enqueue(db.session, 'bench.noop', {'n': i}, idempotency_key=key)
+        if commit:
+            db.session.commit()
+        samples.append(time.perf_counter() - started)
+    db.session.commit()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--jobs', type=int, default=2000, help='Jobs enqueued per scenario')
+    parser.add_argument('--drain', action='store_true', help='Run the queued jobs and report throughput')
+    parser.add_argument('--concurrency', type=int, default=4, help='Worker pool size for --drain')
+    args = parser.parse_args()
+
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    import jobs
+    from app import create_app, db, job_queue
+    app = create_app()
+
+    @job_queue.task('bench.noop', queue='bench')
+    def noop(n):
+        pass
+
+    try:
+        with app.app_context():
+            db.create_all()
+            print(f"{'scenario':<22} {'p50 µs':>8} {'p95 µs':>8} {'p99 µs':>8} {'mean µs':>8}")
+            for commit in (False, True):
+                for keyed in (False, True):
+                    name = ('enqueue+commit' if commit else 'enqueue') + (' keyed' if keyed else '')
+                    p50, p95, p99, mean = percentiles(run_scenario(job_queue, db, args.jobs, commit, keyed))
+                    print(f'{name:<22} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {mean:>8.1f}')
+            total = job_queue.counts(db.session)['bench']['queued']
+            engine = db.engine
+
+        if args.drain:
+            worker = jobs.Worker(app, job_queue, engine, queues=['bench'], concurrency=args.concurrency,
+                                 poll_interval=0.01)
+            started = time.perf_counter()
+            thread = worker.start()
+            while True:
+                with app.app_context():
+                    if 'queued' not in job_queue.counts(db.session).get('bench', {}):
+                        break
+                time.sleep(0.05)
+            worker.stop()
+            thread.join()
+            elapsed = time.perf_counter() - started
+            print(f'drained {total} jobs in {elapsed:.2f}s ({total / elapsed:.0f} jobs/s)')
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main()
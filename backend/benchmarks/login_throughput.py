@@ -0,0 +1,91 @@
+"""
+Login throughput at different hashing pool sizes and bcrypt costs.
+
+Runs ``POST /api/auth/login`` from concurrent client threads against a
+throwaway SQLite database and prints logins per second for every
+combination of ``--workers`` and ``--rounds``. The verified-credential cache
+is disabled unless ``--fast-path`` is given, so the numbers reflect bcrypt.
+
+    cd backend
+    python benchmarks/login_throughput.py --workers 0 1 2 4 --rounds 10 12
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_scenario(app, workers, rounds, clients, logins, fast_path):
+    from app import db, User, password_hasher
+    password_hasher.configure(workers=workers, rounds=rounds, max_pending=max(clients, 1) * 2,
+                              verified_ttl=60 if fast_path else 0)
+    password_hasher.max_pending_seen = 0
+    email = f'bench-{workers}-{rounds}@example.com'
+    with app.app_context():
+        user = User(name='Bench', email=email)
+        user.set_password('benchmark-password')
+        db.session.add(user)
+        db.session.commit()
+
+    def login(_):
+        with app.test_client() as client:
+            response = client.post('/api/auth/login', json={'email': email, 'password': 'benchmark-password'})
+            return response.status_code
+
+    # Warm up the pool so process start-up is not measured
+    login(None)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        statuses = list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - started
+    stats = password_hasher.stats()
+    return {
+        'workers': workers,
+        'rounds': rounds,
+        'logins_per_second': logins / elapsed,
+        'p_ok': statuses.count(200) / len(statuses),
+        'rejected': statuses.count(503),
+        'max_queue_depth': stats['max_queue_depth'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 12])
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent login threads')
+    parser.add_argument('--logins', type=int, default=64, help='Logins per scenario')
+    parser.add_argument('--fast-path', action='store_true', help='Keep the verified-credential cache on')
+    args = parser.parse_args()
+
+    # Hashing workers are spawned and re-import this module, so everything
+    # with side effects stays below the __main__ guard.
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    # Measure bcrypt, not the per-IP login limit or the load shedder
+    os.environ['RATELIMIT_ENABLED'] = 'false'
+    os.environ['SHED_ENABLED'] = 'false'
+    from app import create_app, db, password_hasher
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    try:
+        print(f"{'workers':>7} {'rounds':>6} {'logins/s':>9} {'ok':>5} {'503s':>5} {'max queue':>9}")
+        for rounds in args.rounds:
+            for workers in args.workers:
+                r = run_scenario(app, workers, rounds, args.clients, args.logins, args.fast_path)
+                print(f"{r['workers']:>7} {r['rounds']:>6} {r['logins_per_second']:>9.1f} "
+                      f"{r['p_ok']:>5.0%} {r['rejected']:>5} {r['max_queue_depth']:>9}")
+    finally:
+        password_hasher.shutdown()
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main()
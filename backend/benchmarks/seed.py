@@ -0,0 +1,134 @@
+"""
+Synthetic properties and users for benchmarks.
+
+Generates a deterministic data set (same ``--seed``, same rows) and loads it
+through the bulk importer, so seeding exercises the same write path, search
+index and change-log triggers as a real import. Users share one bcrypt hash
+of ``PASSWORD``, computed once. A database that already holds the requested
+number of rows is left as is, so large sizes are seeded once and reused.
+
+    cd backend
+    python benchmarks/seed.py --size 100k --database /tmp/bench-100k.db
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'benchmark-password'
+ADMIN_EMAIL = 'user0@bench.example.com'
+AMENITIES = ('Pool', 'Gym', 'Parking', 'Sea View', 'Balcony', 'Air Conditioning', 'Security', 'Elevator',
+             'Garden', 'Jacuzzi', 'BBQ Area', 'Furnished')
+KINDS = ('Apartment', 'Penthouse', 'House', 'Villa', 'Studio', 'Loft')
+WORDS = ('bright', 'spacious', 'renovated', 'colonial', 'modern', 'quiet', 'walled city', 'ocean breeze',
+         'terrace', 'private', 'luxury', 'steps from the beach', 'open plan', 'high ceilings', 'rooftop')
+START = datetime(2024, 1, 1)
+SPAN = timedelta(days=730)
+
+
+def parse_size(value):
+    """``1k``, ``100k``, ``1M`` or a plain number of rows."""
+    value = str(value).strip().lower().replace('_', '')
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(value[-1:], 1)
+    try:
+        return int(float(value[:-1] if multiplier > 1 else value) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Unknown size: {value}')
+
+
+def property_records(count, seed=42):
+    """Yields ``(line_number, record)`` pairs as the bulk importer consumes them."""
+    import geo
+    rng = random.Random(seed)
+    places = [(name.split(',')[0], lat, lng) for name, (lat, lng) in geo.DEFAULT_PLACES.items() if ',' in name]
+    for i in range(count):
+        place, lat, lng = places[rng.randrange(len(places))]
+        bedrooms = rng.randint(1, 6)
+        area = round(rng.uniform(35, 120) * bedrooms, 1)
+        created_at = START + SPAN * (i / max(count, 1))
+        yield i + 1, {
+            'title': f'{rng.choice(KINDS)} in {place} #{i}',
+            'description': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 60))).capitalize() + '.',
+            'price': round(rng.lognormvariate(13.2, 0.6), -3),
+            'location': place,
+            'latitude': round(lat + rng.uniform(-0.01, 0.01), 6),
+            'longitude': round(lng + rng.uniform(-0.01, 0.01), 6),
+            'bedrooms': bedrooms,
+            'bathrooms': rng.randint(1, max(1, bedrooms - 1) + 1),
+            'area': area,
+            'is_available': rng.random() < 0.7,
+            'created_at': created_at,
+            'updated_at': created_at,
+            'amenities': rng.sample(AMENITIES, rng.randint(0, 5)),
+            'images': [f'https://images.example.com/{i}/{n}.jpg' for n in range(rng.randint(0, 4))],
+        }
+
+
+def seed_properties(count, seed=42, batch_size=5000):
+    import bulk
+    from app import Property, after_core_writes, db
+    existing = db.session.scalar(db.select(db.func.count()).select_from(Property))
+    if existing >= count:
+        return 0
+    importer = bulk.PropertyImporter(db.session, db.metadata, batch_size=batch_size)
+    records = ((n, r) for n, r in property_records(count, seed) if n > existing)
+    report = importer.run(records)
+    after_core_writes()
+    return report['inserted']
+
+
+def seed_users(count, batch_size=10_000):
+    from app import User, db, password_hasher
+    existing = db.session.scalar(db.select(db.func.count()).select_from(User))
+    if existing >= count:
+        return 0
+    password_hash = password_hasher.hash(PASSWORD)
+    table = User.__table__
+    for start in range(existing, count, batch_size):
+        db.session.execute(table.insert(), [
+            {'name': f'Bench User {i}', 'email': f'user{i}@bench.example.com', 'password_hash': password_hash,
+             'role': 'admin' if i == 0 else 'user', 'token_version': 0}
+            for i in range(start, min(start + batch_size, count))
+        ])
+        db.session.commit()
+    return count - existing
+
+
+def seed(size, users=None, seed=42):
+    """Seeds ``size`` properties and ``users`` (default: ``size``) users; returns the rows added."""
+    from app import db
+    db.create_all()
+    return {
+        'properties': seed_properties(size, seed),
+        'users': seed_users(size if users is None else users),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=parse_size, default='1k', help='1k, 10k, 100k, 1M or a row count')
+    parser.add_argument('--users', type=parse_size, default=None, help='Defaults to --size')
+    parser.add_argument('--database', required=True, help='SQLite file (or database URL) to seed')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ['SQLALCHEMY_DATABASE_URI'] = (
+        args.database if '://' in args.database else f'sqlite:///{os.path.abspath(args.database)}')
+    os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+    os.environ.setdefault('GEOCODER', 'none')
+    from app import create_app
+
+    app = create_app()
+    started = time.perf_counter()
+    with app.app_context():
+        added = seed(args.size, args.users, args.seed)
+    print(f"Added {added['properties']} properties and {added['users']} users "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
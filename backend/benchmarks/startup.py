@@ -0,0 +1,95 @@
+"""
+Start-up cost of the Flask API: import time and time-to-first-request.
+
+Each run is a fresh interpreter, as a new worker process or CLI command
+would be, and records:
+
+    import         ``import app`` (models, blueprints, unbound extensions)
+    create_app     building and configuring the app
+    first_request  the first GET /api/properties, including the database
+                   connection and the first query
+    total          all of the above, from the first line of the child
+
+and which optional heavy modules (requests, Alembic) got imported; neither
+should be until an OAuth route or `flask db` is used. The median of
+``--runs`` runs is reported; ``--output`` writes every run as JSON.
+
+    cd backend
+    python benchmarks/startup.py --runs 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('requests', 'alembic', 'flask_migrate')
+PHASES = ('import', 'create_app', 'first_request', 'total')
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+app = module.create_app()
+created = time.perf_counter()
+response = app.test_client().get('/api/properties')
+served = time.perf_counter()
+json.dump({
+    'status': response.status_code,
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'total': served - started,
+    'heavy_modules': sorted(name for name in %r if name in sys.modules),
+}, sys.stdout)
+""" % (HEAVY_MODULES,)
+
+
+def run_once(env):
+    completed = subprocess.run([sys.executable, '-c', CHILD], cwd=BACKEND, env=env, capture_output=True,
+                               text=True, check=True)
+    return json.loads(completed.stdout)
+
+
+def prepare_database(env):
+    subprocess.run([sys.executable, '-c', 'import app; a = app.create_app()\n'
+                    'with a.app_context(): app.db.create_all()'], cwd=BACKEND, env=env, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=7, help='Fresh interpreters to time')
+    parser.add_argument('--output', help='Write every run as JSON to this file')
+    args = parser.parse_args()
+
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI=f'sqlite:///{db_path}', PASSWORD_HASH_WORKERS='0')
+    try:
+        prepare_database(env)
+        run_once(env)  # Compile and cache bytecode so every timed run starts alike
+        runs = [run_once(env) for _ in range(args.runs)]
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+    print(f"{'phase':<14} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+    for phase in PHASES:
+        values = [run[phase] * 1000 for run in runs]
+        print(f'{phase:<14} {statistics.median(values):>10.1f} {min(values):>8.1f} {max(values):>8.1f}')
+    heavy = sorted({name for run in runs for name in run['heavy_modules']})
+    print(f"Heavy modules imported: {', '.join(heavy) if heavy else 'none'}")
+    if any(run['status'] != 200 for run in runs):
+        print('Warning: the first request did not return 200 in every run')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'runs': runs, 'median': {p: statistics.median(r[p] for r in runs) for p in PHASES}}, f,
+                      indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""
+Benchmark suite for the Flask API: micro-benchmarks and an in-process load test.
+
+Seeds a database with ``seed.py`` (pass ``--database`` to keep it, so 100k or
+1M rows are generated once), then:
+
+    micro  times ``Property.to_dict``, the listing row serializer, JSON
+           encoding of a listing page, the hot listing/search/geo
+           queries and similar-property lookups, reporting the median and
+           mean cost per call
+    load   drives each endpoint from ``--clients`` threads through the test
+           client for ``--duration`` seconds and reports requests/s and
+           p50/p95/p99 latency
+
+Results are written as JSON with ``--output``. ``--compare BASELINE`` checks
+them against a stored run and exits with status 1 when a median, p95 or
+throughput figure is more than ``--threshold`` worse (p99 is reported but
+too noisy in short runs to gate on). The response cache, rate limits and
+load shedding are off unless ``--with-cache`` is given, so the numbers
+reflect the handlers themselves.
+
+    cd backend
+    python benchmarks/suite.py --size 1k --output baseline.json
+    python benchmarks/suite.py --size 1k --compare baseline.json
+    python benchmarks/suite.py --size 100k --database /tmp/bench-100k.db --only load
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_THRESHOLD = 0.15
+# (section, metric, True when higher is better); p99 is informational only
+GATED_METRICS = (
+    ('micro', 'p50_us', False),
+    ('load', 'p50_ms', False),
+    ('load', 'p95_ms', False),
+    ('load', 'rps', True),
+)
+
+HOT_QUERIES = {
+    'default listing': {},
+    'available by price': {'is_available': 'true', 'min_price': '250000', 'max_price': '900000', 'sort': 'price'},
+    'location and bedrooms': {'location': 'Bocagrande', 'min_bedrooms': '3'},
+    'has amenity': {'amenities': 'Pool'},
+}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+# --- Micro-benchmarks ---
+
+def measure(fn, repeat=15, min_sample=0.01):
+    """Per-call seconds of ``fn`` over ``repeat`` samples of at least ``min_sample`` seconds each."""
+    timer = timeit.Timer(fn)
+    # autorange() finds a loop count taking at least 0.2s; scale it down to min_sample
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_sample / elapsed))
+    samples = sorted(t / number for t in timer.repeat(repeat=repeat, number=number))
+    return {
+        'p50_us': statistics.median(samples) * 1e6,
+        'mean_us': statistics.fmean(samples) * 1e6,
+        'min_us': samples[0] * 1e6,
+        'ops_per_sec': 1 / statistics.median(samples),
+    }
+
+
+def micro_benchmarks(app, repeat):
+    import geo
+    import search
+    import similar
+    from werkzeug.datastructures import MultiDict
+    from app import db, Property
+    from listing import FIELDS, ListingQuery, row_serializer, serialize_rows
+
+    results = {}
+    properties = db.session.scalars(db.select(Property).order_by(Property.id).limit(100)).all()
+    for prop in properties:
+        prop.to_dict()  # Load the images and amenities once
+    results['property.to_dict x100'] = measure(lambda: [p.to_dict() for p in properties], repeat)
+
+    query = ListingQuery(Property, MultiDict({'limit': '100'}))
+    rows = db.session.execute(query.statement()).all()
+    serialize = row_serializer(query.fields)
+    results['row_serializer x100'] = measure(lambda: [serialize(r) for r in rows], repeat)
+    results['serialize_rows page of 100'] = measure(
+        lambda: serialize_rows(db.session, Property, rows, FIELDS), repeat)
+    page = serialize_rows(db.session, Property, rows, FIELDS)
+    results['app.json.dumps page of 100'] = measure(lambda: app.json.dumps(page), repeat)
+    results['stdlib json.dumps page of 100'] = measure(lambda: json.dumps(page, default=str), repeat)
+
+    for name, args in HOT_QUERIES.items():
+        statement = ListingQuery(Property, MultiDict(args)).statement()
+        results[f'query: {name}'] = measure(lambda: db.session.execute(statement).all(), repeat)
+    results['query: property by id'] = measure(
+        lambda: db.session.execute(db.select(Property).where(Property.id == 42)).all(), repeat)
+    if db.engine.dialect.name == 'sqlite':
+        search_query = search.SearchQuery(Property, MultiDict({'q': 'penthouse pool'}))
+        results['query: full-text search'] = measure(lambda: search_query.execute(db.session), repeat)
+    near = geo.NearQuery(Property, MultiDict({'lat': '10.3984', 'lng': '-75.5556', 'radius_km': '2'}))
+    results['query: near'] = measure(lambda: near.execute(db.session), repeat)
+    if similar.available():
+        from app import load_similarity_features, similar_index
+        similar_index.build(lambda: load_similarity_features(app))
+        batch = [p.id for p in properties[:64]]
+        results['similar: top 10 for one'] = measure(lambda: similar_index.top_k(batch[:1], 10), repeat)
+        results['similar: top 10 for 64'] = measure(lambda: similar_index.top_k(batch, 10), repeat)
+    db.session.rollback()
+    return results
+
+
+# --- Load test ---
+
+def endpoints(size, admin_token):
+    """``{name: factory}``; each factory returns the test-client call arguments for one request."""
+    from seed import PASSWORD
+    users = max(size, 1)
+    return {
+        'GET /api/properties': lambda rng: ('GET', '/api/properties', {}),
+        'GET /api/properties?filters': lambda rng: (
+            'GET', '/api/properties', {'query_string': {'location': 'Bocagrande', 'min_bedrooms': rng.randint(1, 5)}}),
+        'GET /api/properties/<id>': lambda rng: ('GET', f'/api/properties/{rng.randint(1, size)}', {}),
+        'GET /api/properties/<id>/similar': lambda rng: ('GET', f'/api/properties/{rng.randint(1, size)}/similar', {}),
+        'GET /api/properties/search': lambda rng: (
+            'GET', '/api/properties/search', {'query_string': {'q': rng.choice(['penthouse', 'pool', 'villa'])}}),
+        'GET /api/properties/near': lambda rng: (
+            'GET', '/api/properties/near', {'query_string': {'lat': '10.3984', 'lng': '-75.5556', 'radius_km': '2'}}),
+        'GET /api/admin/stats': lambda rng: (
+            'GET', '/api/admin/stats', {'headers': {'Authorization': f'Bearer {admin_token}'}}),
+        'POST /api/auth/login': lambda rng: (
+            'POST', '/api/auth/login',
+            {'json': {'email': f'user{rng.randrange(users)}@bench.example.com', 'password': PASSWORD}}),
+    }
+
+
+def drive(app, factory, clients, duration, warmup=3):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client_loop(index):
+        rng = random.Random(index)
+        own, failed = [], 0
+        with app.test_client() as client:
+            for _ in range(warmup):
+                method, path, kwargs = factory(rng)
+                client.open(path, method=method, **kwargs)
+            start_barrier.wait()
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                method, path, kwargs = factory(rng)
+                started = time.perf_counter()
+                response = client.open(path, method=method, **kwargs)
+                own.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    failed += 1
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    start_barrier = threading.Barrier(clients + 1)
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def load_test(app, size, clients, duration, only_endpoints=None):
+    from app import db, User
+    from seed import ADMIN_EMAIL
+    with app.app_context():
+        admin_token = db.session.scalar(db.select(User).where(User.email == ADMIN_EMAIL)).create_token()
+    results = {}
+    for name, factory in endpoints(size, admin_token).items():
+        if only_endpoints and not any(part in name for part in only_endpoints):
+            continue
+        results[name] = drive(app, factory, clients, duration)
+        print(f"  {name:<32} {results[name]['rps']:>8.1f} req/s  p50 {results[name]['p50_ms']:>7.2f} ms  "
+              f"p95 {results[name]['p95_ms']:>7.2f} ms  p99 {results[name]['p99_ms']:>7.2f} ms"
+              + (f"  {results[name]['errors']} errors" if results[name]['errors'] else ''))
+    return results
+
+
+# --- Results ---
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Rows ``(section, name, metric, before, after, change, regressed)`` for metrics present in both runs."""
+    rows = []
+    for section, metric, higher_is_better in GATED_METRICS:
+        for name, result in current.get(section, {}).items():
+            before = baseline.get(section, {}).get(name, {}).get(metric)
+            after = result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regressed = change < -threshold if higher_is_better else change > threshold
+            rows.append((section, name, metric, before, after, change, regressed))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    print(f"\n{'benchmark':<44} {'metric':<12} {'baseline':>10} {'current':>10} {'change':>8}")
+    for section, name, metric, before, after, change, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f'{section + ": " + name:<44} {metric:<12} {before:>10.2f} {after:>10.2f} {change:>+8.1%}{flag}')
+    regressions = sum(1 for row in rows if row[-1])
+    print(f'\n{regressions} regression(s) beyond {threshold:.0%}' if regressions else
+          f'\nNo regressions beyond {threshold:.0%}')
+    return regressions
+
+
+def main():
+    from seed import parse_size
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=parse_size, default='1k', help='Rows to seed: 1k, 100k, 1M or a count')
+    parser.add_argument('--database', help='SQLite file to seed and keep (default: a temporary file)')
+    parser.add_argument('--only', choices=('micro', 'load'), help='Run one half of the suite')
+    parser.add_argument('--endpoints', nargs='+', help='Only load-test endpoints containing one of these strings')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent client threads in the load test')
+    parser.add_argument('--duration', type=float, default=3.0, help='Seconds per endpoint in the load test')
+    parser.add_argument('--repeat', type=int, default=15, help='Samples per micro-benchmark')
+    parser.add_argument('--rounds', type=int, default=10, help='bcrypt cost for seeded users and logins')
+    parser.add_argument('--with-cache', action='store_true', help='Keep the response cache and rate limits on')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare with a stored results file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative slowdown flagged as a regression (default 0.15)')
+    args = parser.parse_args()
+
+    # Settings go through the environment so seed.py and the hashing workers
+    # (which re-import this module when spawned) see the same ones.
+    temporary = args.database is None
+    if temporary:
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    else:
+        db_path = os.path.abspath(args.database)
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(args.rounds)
+    os.environ['PASSWORD_VERIFY_CACHE_TTL'] = '0'
+    os.environ.setdefault('GEOCODER', 'none')
+    if not args.with_cache:
+        os.environ['RESPONSE_CACHE_BACKEND'] = 'none'
+        os.environ['RATELIMIT_ENABLED'] = 'false'
+        os.environ['SHED_ENABLED'] = 'false'
+    from app import create_app, password_hasher
+    from seed import seed
+
+    app = create_app()
+
+    results = {'meta': {
+        'size': args.size,
+        'clients': args.clients,
+        'duration': args.duration,
+        'with_cache': args.with_cache,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }}
+    try:
+        with app.app_context():
+            started = time.perf_counter()
+            added = seed(args.size)
+            if any(added.values()):
+                print(f"Seeded {added['properties']} properties and {added['users']} users "
+                      f"in {time.perf_counter() - started:.1f}s")
+            if args.only in (None, 'micro'):
+                print('Micro-benchmarks')
+                results['micro'] = micro_benchmarks(app, args.repeat)
+                for name, r in results['micro'].items():
+                    print(f"  {name:<32} {r['p50_us']:>10.1f} µs  (mean {r['mean_us']:.1f} µs)")
+        if args.only in (None, 'load'):
+            print(f'Load test ({args.clients} clients, {args.duration:g}s per endpoint)')
+            results['load'] = load_test(app, args.size, args.clients, args.duration, args.endpoints)
+    finally:
+        password_hasher.shutdown()
+        if temporary:
+            os.close(db_fd)
+            os.unlink(db_path)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Results written to {args.output}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('size') != args.size:
+            print(f"Warning: baseline was seeded with {baseline.get('meta', {}).get('size')} rows, not {args.size}")
+        if print_comparison(compare(baseline, results, args.threshold), args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Bookings: per-property availability calendars and free-date search.
+
+A booking holds its property from ``check_in_date`` up to, but not
+including, ``check_out_date``: the day a guest leaves is free for the next
+one to arrive. Pending, confirmed and completed bookings hold their dates
+(``BLOCKING_STATUSES``); cancelled ones do not.
+
+Overlap lookups go through an interval index instead of scanning bookings:
+an integer R*Tree (``booking_rtree``) of ``(property, first night, last
+night)`` boxes kept in sync by triggers on SQLite, holding only blocking
+bookings, and on PostgreSQL the GiST index behind an exclusion constraint on
+``(property_id, daterange(check_in_date, check_out_date))``, which also
+refuses overlapping rows outright. Other backends fall back to the
+``(property_id, check_in_date)`` index.
+
+``reserve`` commits a booking only if its property is free for the stay,
+even with concurrent attempts for the same dates: the overlap check and the
+insert run while holding a lock that every other reservation of the
+property needs too. On PostgreSQL that is the property's row lock, so
+reservations of different properties do not wait for each other, with the
+exclusion constraint as a backstop. On SQLite the transaction starts with
+``BEGIN IMMEDIATE``, taking the database write lock before reading, so the
+check sees every booking committed before it. A conflict rolls back and
+raises ``BookingConflict``.
+
+Queries built on the index:
+    AvailabilityQuery  the property listing restricted to properties free
+                       for a whole stay, with the usual filters and paging
+    calendar           the nights a property is booked within a window
+"""
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import DDL, column, event, func, select, table
+from sqlalchemy.exc import IntegrityError
+
+from listing import ListingQuery, ListingQueryError, SUMMARY_FIELDS
+
+STATUSES = ('pending', 'confirmed', 'cancelled', 'completed')
+BLOCKING_STATUSES = ('pending', 'confirmed', 'completed')
+MAX_NIGHTS = 365
+DEFAULT_CALENDAR_DAYS = 90
+MAX_CALENDAR_DAYS = 366
+# SQLite's julianday() of a date, truncated, minus date.toordinal()
+JULIAN_DAY_OFFSET = 1721424
+
+RTREE_TABLE = 'booking_rtree'
+EXCLUSION_CONSTRAINT = 'booking_no_overlap'
+_BLOCKING = ', '.join(f"'{status}'" for status in BLOCKING_STATUSES)
+_DAY = 'CAST(julianday({}) AS INTEGER)'
+# Boxes span nights, [check-in day, check-out day - 1], so back-to-back stays do not overlap
+_RTREE_INSERT = (f'INSERT INTO {RTREE_TABLE}(id, min_property, max_property, min_day, max_day) '
+                 f'SELECT new.id, new.property_id, new.property_id, {_DAY.format("new.check_in_date")}, '
+                 f'{_DAY.format("new.check_out_date")} - 1 WHERE new.status IN ({_BLOCKING});')
+SQLITE_STATEMENTS = (
+    # rtree_i32 stores exact integer coordinates, so no rounding margin is needed
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} '
+    f'USING rtree_i32(id, min_property, max_property, min_day, max_day)',
+    f'CREATE TRIGGER IF NOT EXISTS booking_rtree_ai AFTER INSERT ON booking BEGIN {_RTREE_INSERT} END',
+    f'CREATE TRIGGER IF NOT EXISTS booking_rtree_au '
+    f'AFTER UPDATE OF property_id, check_in_date, check_out_date, status ON booking BEGIN '
+    f'DELETE FROM {RTREE_TABLE} WHERE id = old.id; {_RTREE_INSERT} END',
+    f'CREATE TRIGGER IF NOT EXISTS booking_rtree_ad AFTER DELETE ON booking BEGIN '
+    f'DELETE FROM {RTREE_TABLE} WHERE id = old.id; END',
+    # SQLite leaves foreign keys unenforced, so do the ON DELETE CASCADE here
+    'CREATE TRIGGER IF NOT EXISTS booking_property_ad AFTER DELETE ON property BEGIN '
+    'DELETE FROM booking WHERE property_id = old.id; END',
+)
+SQLITE_DROP_STATEMENTS = (
+    'DROP TRIGGER IF EXISTS booking_property_ad',
+    'DROP TRIGGER IF EXISTS booking_rtree_ad',
+    'DROP TRIGGER IF EXISTS booking_rtree_au',
+    'DROP TRIGGER IF EXISTS booking_rtree_ai',
+    f'DROP TABLE IF EXISTS {RTREE_TABLE}',
+)
+# btree_gist provides the GiST operator class for the integer equality
+POSTGRES_STATEMENTS = (
+    'CREATE EXTENSION IF NOT EXISTS btree_gist',
+    f'ALTER TABLE booking ADD CONSTRAINT {EXCLUSION_CONSTRAINT} EXCLUDE USING gist '
+    f'(property_id WITH =, daterange(check_in_date, check_out_date) WITH &&) WHERE (status IN ({_BLOCKING}))',
+)
+
+rtree = table(RTREE_TABLE, column('id'), column('min_property'), column('max_property'), column('min_day'),
+              column('max_day'))
+
+
+class BookingConflict(Exception):
+    """Raised when a stay overlaps another booking of the same property."""
+
+
+def register(booking_table):
+    """Creates the interval index together with the booking table."""
+    for statement in SQLITE_STATEMENTS:
+        event.listen(booking_table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    for statement in SQLITE_DROP_STATEMENTS:
+        event.listen(booking_table, 'before_drop', DDL(statement).execute_if(dialect='sqlite'))
+    for statement in POSTGRES_STATEMENTS:
+        event.listen(booking_table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+
+# --- Parsing ---
+
+def today():
+    return datetime.now(timezone.utc).date()
+
+
+def parse_date(value, name):
+    if isinstance(value, date):
+        return value
+    if not value:
+        raise ListingQueryError(f'{name} is required as YYYY-MM-DD')
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise ListingQueryError(f'Invalid date for {name}: {value}')
+
+
+def parse_stay(check_in, check_out, earliest=None):
+    """``(check_in, check_out)`` as dates, raising ListingQueryError unless a valid stay."""
+    check_in = parse_date(check_in, 'check_in')
+    check_out = parse_date(check_out, 'check_out')
+    if check_out <= check_in:
+        raise ListingQueryError('check_out must be after check_in')
+    if (check_out - check_in).days > MAX_NIGHTS:
+        raise ListingQueryError(f'A stay can be at most {MAX_NIGHTS} nights')
+    if earliest is not None and check_in < earliest:
+        raise ListingQueryError('check_in must not be in the past')
+    return check_in, check_out
+
+
+def parse_window(args):
+    """The ``start``/``end`` calendar window, defaulting to the next DEFAULT_CALENDAR_DAYS days."""
+    start = parse_date(args.get('start'), 'start') if args.get('start') else today()
+    end = (parse_date(args.get('end'), 'end') if args.get('end')
+           else start + timedelta(days=DEFAULT_CALENDAR_DAYS))
+    if end <= start:
+        raise ListingQueryError('end must be after start')
+    if (end - start).days > MAX_CALENDAR_DAYS:
+        raise ListingQueryError(f'A calendar window can span at most {MAX_CALENDAR_DAYS} days')
+    return start, end
+
+
+# --- Overlap conditions ---
+
+def day_number(value):
+    """The R*Tree coordinate of a date, matching ``CAST(julianday(date) AS INTEGER)``."""
+    return value.toordinal() + JULIAN_DAY_OFFSET
+
+
+def _rtree_nights(start, end):
+    return [rtree.c.min_day <= day_number(end) - 1, rtree.c.max_day >= day_number(start)]
+
+
+def _exact_overlap(booking_table, start, end, dialect):
+    c = booking_table.c
+    if dialect == 'postgresql':
+        # Matches the exclusion constraint's expression, so its GiST index serves it
+        overlap = func.daterange(c.check_in_date, c.check_out_date).op('&&')(func.daterange(start, end))
+    else:
+        overlap = (c.check_in_date < end) & (c.check_out_date > start)
+    return [overlap, c.status.in_(BLOCKING_STATUSES)]
+
+
+def booked_property_ids(booking_table, start, end, dialect):
+    """SELECT of the properties with a blocking booking overlapping ``[start, end)``."""
+    if dialect == 'sqlite':
+        return select(rtree.c.min_property).where(*_rtree_nights(start, end))
+    return select(booking_table.c.property_id).where(*_exact_overlap(booking_table, start, end, dialect))
+
+
+def overlapping(booking_table, property_id, start, end, dialect):
+    """WHERE clauses selecting blocking bookings of one property that overlap ``[start, end)``."""
+    c = booking_table.c
+    if dialect == 'sqlite':
+        candidates = select(rtree.c.id).where(
+            rtree.c.min_property <= property_id, rtree.c.max_property >= property_id, *_rtree_nights(start, end))
+        return [c.id.in_(candidates)]
+    return [c.property_id == property_id, *_exact_overlap(booking_table, start, end, dialect)]
+
+
+# --- Reservations ---
+
+def _is_overlap_violation(error):
+    return EXCLUSION_CONSTRAINT in str(getattr(error, 'orig', error))
+
+
+def _begin_immediate(session):
+    """
+    Opens SQLite's transaction holding the write lock. A deferred transaction
+    that read first and writes later fails at once, without waiting out
+    busy_timeout, whenever another writer committed in between.
+    """
+    connection = session.connection()
+    if not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def reserve(session, booking, property_model):
+    """
+    Commits ``booking`` (new, or an existing one moved to a blocking status)
+    if its property is free for the stay; raises ``BookingConflict``, or
+    LookupError for an unknown property, after rolling back otherwise.
+    """
+    booking_table = type(booking).__table__
+    dialect = session.get_bind().dialect.name
+    try:
+        if dialect == 'sqlite':
+            _begin_immediate(session)
+        locked = session.execute(
+            select(property_model.id).where(property_model.id == booking.property_id).with_for_update()
+        ).scalar()
+        if locked is None:
+            raise LookupError('Property not found')
+        conflicts = select(booking_table.c.id).where(*overlapping(
+            booking_table, booking.property_id, booking.check_in_date, booking.check_out_date, dialect))
+        if booking.id is not None:
+            conflicts = conflicts.where(booking_table.c.id != booking.id)
+        if session.execute(conflicts.limit(1)).first() is not None:
+            raise BookingConflict('The property is already booked for some of these dates')
+        session.add(booking)
+        session.commit()
+    except IntegrityError as e:
+        session.rollback()
+        if _is_overlap_violation(e):
+            raise BookingConflict('The property is already booked for some of these dates')
+        raise
+    except Exception:
+        session.rollback()
+        raise
+    return booking
+
+
+def calendar(session, booking_table, property_id, start, end):
+    """Blocking stays of a property overlapping ``[start, end)``, in date order."""
+    c = booking_table.c
+    dialect = session.get_bind().dialect.name
+    rows = session.execute(
+        select(c.check_in_date, c.check_out_date, c.status)
+        .where(*overlapping(booking_table, property_id, start, end, dialect))
+        .order_by(c.check_in_date, c.id)
+    )
+    return [
+        {'check_in_date': row.check_in_date.isoformat(), 'check_out_date': row.check_out_date.isoformat(),
+         'status': row.status}
+        for row in rows
+    ]
+
+
+class AvailabilityQuery(ListingQuery):
+    """
+    The property listing (same arguments, sorting and cursor) restricted to
+    available properties with no blocking booking between ``check_in`` and
+    ``check_out`` (required, YYYY-MM-DD).
+    """
+
+    def __init__(self, model, args, default_fields=SUMMARY_FIELDS, *, booking_table, dialect):
+        super().__init__(model, args, default_fields)
+        self.check_in, self.check_out = parse_stay(args.get('check_in'), args.get('check_out'))
+        booked = booked_property_ids(booking_table, self.check_in, self.check_out, dialect)
+        self.filters += [model.is_available, model.id.not_in(booked)]
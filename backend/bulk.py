@@ -0,0 +1,441 @@
+"""
+Streaming bulk import and export of property catalogues.
+
+Imports read NDJSON or CSV one record at a time, validate each record against
+the ``property`` table definition and write valid rows in large batches: one
+transaction and a handful of executemany statements per batch, instead of one
+ORM flush and commit per listing. Invalid records are reported with their line
+number and skipped; they never abort the rest of the batch.
+
+Exports page through the table by primary key and yield encoded rows as
+they are read, in ~64 KB chunks, so memory use does not grow with the
+catalogue.
+
+Both work on the Core tables from ``metadata`` (property, property_image,
+amenity, property_amenity) rather than on ORM objects, as does
+``copy_legacy_lists``, which moves lists still held in the comma-separated
+columns of databases migrated before those tables existed. The ORM session
+hooks therefore never see these writes: the importer geocodes records
+itself, with the same rules as ``geo.watch_locations``, and the caller has to
+catch the response cache, the similar-properties index and the stats up
+afterwards.
+"""
+import csv
+import io
+import json
+import re
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, column, delete, inspect, insert, or_, select, table, update
+from sqlalchemy.exc import DBAPIError
+
+from jsonio import CHUNK_SIZE, iter_json_array, iter_ndjson
+from listing import FIELDS, parse_bool, row_serializer
+from media import digest_from_url
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ('ndjson', 'csv')
+# Exports can also be one streamed JSON array
+EXPORT_FORMATS = FORMATS + ('json',)
+# CSV cells hold lists joined with '|' so URLs containing commas survive
+CSV_LIST_SEPARATOR = '|'
+LIST_FIELDS = ('images', 'amenities')
+# What open_text() decodes invalid bytes to
+_UNDECODABLE = re.compile('[\udc80-\udcff]')
+
+
+class RowError(ValueError):
+    """A single import record failed validation."""
+
+
+def detect_format(filename=None, content_type=None, explicit=None, formats=FORMATS):
+    if explicit:
+        if explicit not in formats:
+            raise ValueError(f'Unsupported format: {explicit}')
+        return explicit
+    if (filename or '').lower().endswith('.csv') or 'csv' in (content_type or ''):
+        return 'csv'
+    return 'ndjson'
+
+
+def open_text(binary_stream):
+    """
+    A text stream over uploaded bytes. Bytes that are not UTF-8 decode to
+    lone surrogates, so ``iter_records`` can reject just the lines holding them.
+    """
+    return io.TextIOWrapper(binary_stream, encoding='utf-8', errors='surrogateescape', newline='')
+
+
+def iter_records(text_stream, fmt):
+    """
+    Yields ``(line_number, record)``; unparsable lines, and lines that are
+    not UTF-8, yield a RowError instead of a dict. A stream opened with
+    strict decoding instead ends at the first undecodable chunk, with a
+    RowError.
+    """
+    records = _iter_csv_records(text_stream) if fmt == 'csv' else _iter_ndjson_records(text_stream)
+    line_number = 0
+    try:
+        for line_number, record in records:
+            yield line_number, record
+    except UnicodeDecodeError as e:
+        yield line_number + 1, RowError(f'Invalid UTF-8, import stopped here: {e.reason}')
+
+
+def _iter_csv_records(text_stream):
+    reader = csv.DictReader(text_stream)
+    for record in reader:
+        if any(_UNDECODABLE.search(value) for value in record.values() if isinstance(value, str)):
+            yield reader.line_num, RowError('Invalid UTF-8')
+            continue
+        yield reader.line_num, record
+
+
+def _iter_ndjson_records(text_stream):
+    for line_number, line in enumerate(text_stream, start=1):
+        if not line.strip():
+            continue
+        if _UNDECODABLE.search(line):
+            yield line_number, RowError('Invalid UTF-8')
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, RowError(f'Invalid JSON: {e}')
+            continue
+        if not isinstance(record, dict):
+            yield line_number, RowError('Each line must be a JSON object')
+            continue
+        yield line_number, record
+
+
+def _split_list(value):
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        value = value.split(CSV_LIST_SEPARATOR)
+    if not isinstance(value, list):
+        raise RowError('must be a list')
+    return list(dict.fromkeys(str(item).strip() for item in value if str(item).strip()))
+
+
+class PropertyImporter:
+    """
+    Validates and upserts property records in batches. With a ``geocoder``,
+    records that set a location but no coordinates get theirs from it.
+    """
+
+    def __init__(self, session, metadata, batch_size=DEFAULT_BATCH_SIZE, geocoder=None):
+        self.session = session
+        self.batch_size = batch_size
+        self.geocoder = geocoder
+        self.property = metadata.tables['property']
+        self.image = metadata.tables['property_image']
+        self.amenity = metadata.tables['amenity']
+        self.link = metadata.tables['property_amenity']
+        self.amenity_ids = {}
+        self.inserted = 0
+        self.updated = 0
+        self.errors = []
+        self.failed = 0
+
+    # --- Validation ---
+
+    def validate(self, record):
+        """Returns ``(columns, images, amenities)`` for a raw record."""
+        values = {}
+        for column in self.property.columns:
+            name = column.name
+            raw = record.get(name)
+            if raw is None or raw == '':
+                if name in ('created_at', 'updated_at', 'id') or column.nullable or column.default is not None:
+                    continue
+                raise RowError(f'Missing field: {name}')
+            try:
+                python_type = column.type.python_type
+                if python_type is bool:
+                    values[name] = raw if isinstance(raw, bool) else parse_bool(str(raw), name)
+                elif python_type is datetime:
+                    values[name] = datetime.fromisoformat(raw) if isinstance(raw, str) else raw
+                elif python_type in (int, float):
+                    values[name] = python_type(raw)
+                else:
+                    values[name] = str(raw)
+            except (TypeError, ValueError) as e:
+                raise RowError(f'Invalid value for {name}: {e}')
+        # None (field absent) leaves an existing property's list untouched
+        lists = []
+        for field in LIST_FIELDS:
+            try:
+                lists.append(_split_list(record[field]) if field in record else None)
+            except RowError as e:
+                raise RowError(f'{field} {e}')
+        return (values, *lists)
+
+    # --- Writing ---
+
+    def run(self, records):
+        """Consumes ``(line_number, record)`` pairs and writes them in batches."""
+        batch = []
+        for line_number, record in records:
+            if isinstance(record, RowError):
+                self._fail(line_number, record)
+                continue
+            try:
+                batch.append((line_number, *self.validate(record)))
+            except RowError as e:
+                self._fail(line_number, e)
+                continue
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+        return self.report()
+
+    def report(self):
+        return {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+    def _fail(self, line_number, error):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': str(error)})
+
+    def _flush(self, batch):
+        try:
+            self._write(batch)
+            self.session.commit()
+        except DBAPIError:
+            # Something in the batch violates a constraint; redo it row by row
+            # so only the offending rows are rejected.
+            self._rollback()
+            for row in batch:
+                try:
+                    self._write([row])
+                    self.session.commit()
+                except DBAPIError as e:
+                    self._rollback()
+                    self._fail(row[0], e.orig)
+
+    def _rollback(self):
+        self.session.rollback()
+        # Amenities created inside the failed transaction no longer exist
+        self.amenity_ids.clear()
+
+    def _geocode(self, values, stored_location):
+        """Fills coordinates for a new row, or an updated one whose location changed, unless given."""
+        if (self.geocoder is None or 'location' not in values or values['location'] == stored_location
+                or 'latitude' in values or 'longitude' in values):
+            return
+        # An unknown new location clears coordinates that belonged to the old one
+        values['latitude'], values['longitude'] = self.geocoder(values['location']) or (None, None)
+
+    def _write(self, batch):
+        explicit_ids = [values['id'] for _, values, _, _ in batch if 'id' in values]
+        # Stored location of each existing id
+        existing = {}
+        if explicit_ids:
+            existing = dict(self.session.execute(
+                select(self.property.c.id, self.property.c.location).where(self.property.c.id.in_(explicit_ids))
+            ).all())
+        for _, values, _, _ in batch:
+            self._geocode(values, existing.get(values.get('id')))
+
+        # executemany needs one key set per statement, so group rows by the
+        # fields they carry; missing fields then fall back to column defaults
+        # on insert and keep their stored value on update.
+        inserts, updates = defaultdict(list), defaultdict(list)
+        for index, (_, values, _, _) in enumerate(batch):
+            target = updates if values.get('id') in existing else inserts
+            target[frozenset(values)].append(index)
+
+        row_ids = [None] * len(batch)
+        for indexes in inserts.values():
+            for index, row_id in zip(indexes, self._insert_properties([batch[i][1] for i in indexes])):
+                row_ids[index] = row_id
+
+        now = datetime.now(timezone.utc)
+        for keys, indexes in updates.items():
+            columns = sorted(keys - {'id', 'updated_at'})
+            stmt = (self.property.update()
+                    .where(self.property.c.id == bindparam('b_id'))
+                    .values({**{c: bindparam(f'b_{c}') for c in columns}, 'updated_at': now}))
+            params = []
+            for index in indexes:
+                values = batch[index][1]
+                params.append({'b_id': values['id'], **{f'b_{c}': values[c] for c in columns}})
+                row_ids[index] = values['id']
+            self.session.execute(stmt, params)
+
+        self._replace_related(batch, row_ids)
+        self.inserted += sum(len(indexes) for indexes in inserts.values())
+        self.updated += sum(len(indexes) for indexes in updates.values())
+
+    def _insert_properties(self, rows):
+        """Inserts rows with one executemany and returns their ids in the same order."""
+        if 'id' in rows[0]:
+            self.session.execute(insert(self.property), rows)
+            return [row['id'] for row in rows]
+        if self.session.get_bind().dialect.name != 'sqlite':
+            # insertmanyvalues batches RETURNING into multi-row statements here
+            result = self.session.execute(
+                insert(self.property).returning(self.property.c.id, sort_by_parameter_order=True), rows)
+            return [row.id for row in result]
+        # SQLite would run RETURNING once per row. Plain executemany instead:
+        # the transaction holds the write lock from the insert on and new rowids
+        # are max(rowid) + 1, so the rows just written are the highest ids.
+        self.session.execute(insert(self.property), rows)
+        return sorted(self.session.scalars(
+            select(self.property.c.id).order_by(self.property.c.id.desc()).limit(len(rows))))
+
+    def _replace_related(self, batch, row_ids):
+        """Rewrites images/amenities for rows that supplied them; absent lists are kept."""
+        image_rows = [(pid, images) for (_, _, images, _), pid in zip(batch, row_ids) if images is not None]
+        amenity_rows = [(pid, names) for (_, _, _, names), pid in zip(batch, row_ids) if names is not None]
+
+        if image_rows:
+            self.session.execute(delete(self.image).where(self.image.c.property_id.in_([p for p, _ in image_rows])))
+            images = [
+                {'property_id': property_id, 'position': position, 'url': url, 'asset_digest': digest_from_url(url)}
+                for property_id, urls in image_rows
+                for position, url in enumerate(urls)
+            ]
+            if images:
+                self.session.execute(insert(self.image), images)
+
+        if amenity_rows:
+            self.session.execute(delete(self.link).where(self.link.c.property_id.in_([p for p, _ in amenity_rows])))
+            self._resolve_amenities({name for _, names in amenity_rows for name in names})
+            links = [
+                {'property_id': property_id, 'amenity_id': self.amenity_ids[name]}
+                for property_id, names in amenity_rows
+                for name in names
+            ]
+            if links:
+                self.session.execute(insert(self.link), links)
+
+    def _resolve_amenities(self, names):
+        missing = names - self.amenity_ids.keys()
+        if not missing:
+            return
+        for row in self.session.execute(select(self.amenity.c.id, self.amenity.c.name)
+                                        .where(self.amenity.c.name.in_(missing))):
+            self.amenity_ids[row.name] = row.id
+        new_names = sorted(missing - self.amenity_ids.keys())
+        if new_names:
+            self.session.execute(insert(self.amenity), [{'name': name} for name in new_names])
+            for row in self.session.execute(select(self.amenity.c.id, self.amenity.c.name)
+                                            .where(self.amenity.c.name.in_(new_names))):
+                self.amenity_ids[row.name] = row.id
+
+
+# --- Lists left in the pre-normalization columns ---
+
+legacy_property = table('property', column('id'), column('images'), column('amenities'))
+
+
+def has_legacy_lists(connection):
+    """Whether ``property`` still has the comma-separated images/amenities columns."""
+    columns = {c['name'] for c in inspect(connection).get_columns('property')}
+    return {'images', 'amenities'} <= columns
+
+
+def _split_legacy(value):
+    if not value:
+        return []
+    return list(dict.fromkeys(item.strip() for item in value.split(',') if item.strip()))
+
+
+def copy_legacy_lists(session, metadata, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Copies the old ``images``/``amenities`` columns into their tables, one
+    committed batch at a time, clearing the columns of each copied row in the
+    same transaction; stopping and rerunning carries on where it left off.
+    Lists written through the app since then win over the old values.
+    ``updated_at`` is left alone. Returns the number of properties copied.
+    """
+    if not has_legacy_lists(session.connection()):
+        return 0
+    importer = PropertyImporter(session, metadata)
+    pending = or_(legacy_property.c.images.isnot(None), legacy_property.c.amenities.isnot(None))
+    copied = last_id = 0
+    while True:
+        rows = session.execute(
+            select(legacy_property.c.id, legacy_property.c.images, legacy_property.c.amenities)
+            .where(legacy_property.c.id > last_id, pending)
+            .order_by(legacy_property.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return copied
+        ids = [row.id for row in rows]
+        has_images = set(session.scalars(select(importer.image.c.property_id)
+                                         .where(importer.image.c.property_id.in_(ids))))
+        has_amenities = set(session.scalars(select(importer.link.c.property_id)
+                                            .where(importer.link.c.property_id.in_(ids))))
+        batch = [(None, None, None if row.id in has_images else _split_legacy(row.images),
+                  None if row.id in has_amenities else _split_legacy(row.amenities)) for row in rows]
+        importer._replace_related(batch, ids)
+        session.execute(update(legacy_property).where(legacy_property.c.id.in_(ids))
+                        .values(images=None, amenities=None))
+        session.commit()
+        copied += len(rows)
+        last_id = ids[-1]
+
+
+# --- Export ---
+
+def iter_property_rows(session, model, batch_size=DEFAULT_BATCH_SIZE):
+    """Yields serialized properties in id order, one keyset page at a time."""
+    columns = [getattr(model, f) for f in FIELDS if f not in LIST_FIELDS]
+    serialize = row_serializer(FIELDS)
+    last_id = 0
+    while True:
+        rows = session.execute(
+            select(*columns).where(model.id > last_id).order_by(model.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        ids = [row.id for row in rows]
+        related = {field: model.related_values(session, field, ids) for field in LIST_FIELDS}
+        for row in rows:
+            item = serialize(row)
+            for field in LIST_FIELDS:
+                item[field] = related[field][row.id]
+            yield item
+        last_id = ids[-1]
+
+
+def _dumps_bytes(item):
+    return json.dumps(item, ensure_ascii=False).encode('utf-8')
+
+
+def iter_export(items, fmt, dumps_bytes=_dumps_bytes):
+    """Encodes serialized properties as NDJSON, a JSON array or CSV, in byte chunks."""
+    if fmt == 'ndjson':
+        return iter_ndjson(items, dumps_bytes)
+    if fmt == 'json':
+        return iter_json_array(items, dumps_bytes)
+    return _iter_csv(items)
+
+
+def _iter_csv(items):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    for item in items:
+        for field in LIST_FIELDS:
+            item[field] = CSV_LIST_SEPARATOR.join(item[field])
+        writer.writerow(item)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
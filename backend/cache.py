@@ -0,0 +1,214 @@
+"""
+Response cache for the public property read endpoints.
+
+Serialized responses are stored under a key built from the request URL
+(scheme, host and path, since ``Link`` headers carry them) and its sorted
+query string, prefixed with a *generation* number. Invalidation just bumps
+the generation, which makes every older entry unreachable at once (they age
+out through LRU eviction or TTL). That keeps invalidation O(1) and
+works the same for the in-process and the shared backend. The backend also
+keeps the wall-clock time of the last bump, which the replica router reads
+to keep requests off lagging replicas right after a write in any process.
+
+Only the identity body is stored: compression runs in an ``after_request``
+hook, after the cache, so Accept-Encoding needs no place in the key.
+Responses that set a cookie or vary on ``Authorization`` or ``Cookie`` are
+passed through and never stored.
+
+Backends:
+    MemoryCache  in-process LRU with a TTL; each worker process has its own
+    RedisCache   shared across processes; takes any client exposing
+                 get/set(ex=)/incr, so tests can pass a local stand-in
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, make_response, request
+from sqlalchemy import event
+
+
+class MemoryCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._bumped_at = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def generation(self):
+        return self._generation
+
+    def bump_generation(self):
+        with self._lock:
+            self._generation += 1
+            self._bumped_at = time.time()
+            # Old generations can never be read again, so free them now
+            self._entries.clear()
+
+    def bumped_at(self):
+        return self._bumped_at
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    """Cache backend stored in Redis (or anything speaking the same commands)."""
+
+    def __init__(self, client, ttl=300, prefix='kintech:responses'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis  # Optional dependency, only needed for the shared backend
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        raw = self.client.get(f'{self.prefix}:{key}')
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self.client.set(f'{self.prefix}:{key}', json.dumps(value), ex=self.ttl)
+
+    def generation(self):
+        raw = self.client.get(f'{self.prefix}:generation')
+        return int(raw) if raw is not None else 0
+
+    def bump_generation(self):
+        self.client.incr(f'{self.prefix}:generation')
+        self.client.set(f'{self.prefix}:bumped_at', time.time(), ex=self.ttl)
+
+    def bumped_at(self):
+        raw = self.client.get(f'{self.prefix}:bumped_at')
+        return float(raw) if raw is not None else None
+
+
+def make_backend(config):
+    """Builds the backend selected by RESPONSE_CACHE_BACKEND ('memory', 'redis' or 'none')."""
+    kind = config.get('RESPONSE_CACHE_BACKEND', 'memory')
+    ttl = int(config.get('RESPONSE_CACHE_TTL', 300))
+    if kind == 'none':
+        return None
+    if kind == 'redis':
+        return RedisCache.from_url(config['RESPONSE_CACHE_URL'], ttl=ttl)
+    if kind == 'memory':
+        return MemoryCache(maxsize=int(config.get('RESPONSE_CACHE_MAXSIZE', 1024)), ttl=ttl)
+    raise ValueError(f'Unknown RESPONSE_CACHE_BACKEND: {kind}')
+
+
+def compute_etag(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+# Headers produced by the views that must be replayed on a cache hit
+REPLAYED_HEADERS = ('Link', 'X-Next-Cursor', 'X-Next-Offset', 'X-Truncated')
+# A response varying on any of these belongs to one client
+PRIVATE_VARY = ('*', 'Authorization', 'Cookie')
+
+
+class ResponseCache:
+    """Caches successful JSON GET responses and answers conditional requests."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    def key_for(self, generation):
+        args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        return f'{generation}:{request.base_url}?{args}'
+
+    def invalidate(self):
+        if self.backend is not None:
+            self.backend.bump_generation()
+
+    def last_invalidated(self):
+        """Wall-clock time of the last invalidation, in any process sharing the backend; None if unknown."""
+        return self.backend.bumped_at() if self.backend is not None else None
+
+    def cached(self, view):
+        """Decorator for read-only views returning JSON."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if self.backend is None:
+                return self._conditional(view(*args, **kwargs))
+
+            key = self.key_for(self.backend.generation())
+            entry = self.backend.get(key)
+            if entry is not None:
+                response = Response(entry['body'], mimetype='application/json', headers=entry['headers'])
+                response.set_etag(entry['etag'])
+                response.headers['X-Cache'] = 'HIT'
+                return self._conditional(response, etag=entry['etag'])
+
+            response = self._conditional(view(*args, **kwargs))
+            if response.status_code == 200 and self._shareable(response):
+                self.backend.set(key, {
+                    'body': response.get_data(as_text=True),
+                    'etag': response.get_etag()[0],
+                    'headers': {h: response.headers[h] for h in REPLAYED_HEADERS if h in response.headers},
+                })
+                response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+
+    @staticmethod
+    def _shareable(response):
+        return 'Set-Cookie' not in response.headers and not any(h in response.vary for h in PRIVATE_VARY)
+
+    @staticmethod
+    def _conditional(rv, etag=None):
+        response = rv if isinstance(rv, Response) else make_response(rv)
+        if response.status_code != 200:
+            return response
+        if etag is None:
+            response.set_etag(compute_etag(response.get_data()))
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+
+def watch_session(session, models, response_cache):
+    """
+    Invalidates ``response_cache`` whenever a transaction that touched rows of
+    ``models`` (a class or tuple of classes) commits; rolled-back changes
+    leave the cache alone.
+    """
+    @event.listens_for(session, 'after_flush')
+    def _record_changes(sess, flush_context):
+        if any(isinstance(obj, models) for obj in (*sess.new, *sess.dirty, *sess.deleted)):
+            sess.info['response_cache_dirty'] = True
+
+    @event.listens_for(session, 'after_commit')
+    def _invalidate(sess):
+        if sess.info.pop('response_cache_dirty', False):
+            response_cache.invalidate()
+
+    @event.listens_for(session, 'after_rollback')
+    def _discard(sess):
+        sess.info.pop('response_cache_dirty', None)
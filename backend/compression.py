@@ -0,0 +1,139 @@
+"""
+Content-Encoding negotiation for API responses.
+
+JSON, NDJSON, CSV and text responses of at least ``COMPRESS_MIN_SIZE`` bytes
+are compressed with brotli when the client accepts it and the ``brotli``
+package is installed, otherwise with gzip. Streamed responses (exports) are
+compressed incrementally as their chunks are produced.
+
+Bodies carrying a strong ETag (the cached property reads) are compressed
+once per ETag and encoding and then served from a small LRU, so repeated
+requests for the same page skip the compressor. Compressed responses carry a
+weak ETag, as their bytes differ from the identity encoding, and every
+response that could be compressed gets ``Vary: Accept-Encoding``.
+"""
+import gzip
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv')
+# Statuses whose body is empty or must not be re-encoded
+SKIPPED_STATUSES = (204, 206, 304)
+
+
+def encodings():
+    """Encodings this process can produce, best first."""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encodings):
+    """The best encoding acceptable to the client, or None for identity."""
+    best, best_quality = None, 0
+    for encoding in encodings():
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _is_compressible(mimetype):
+    return mimetype in COMPRESSIBLE_MIMETYPES or (mimetype or '').startswith('text/')
+
+
+class Compressor:
+    """Compresses response bodies, remembering the result for strong ETags."""
+
+    def __init__(self, min_size=1024, level=6, brotli_quality=4, cache_size=256):
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.cache_size = cache_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        # mtime=0 keeps the output identical for identical bodies
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def compress_cached(self, data, encoding, etag):
+        if etag is None or self.cache_size <= 0:
+            return self.compress(data, encoding)
+        key = (etag, encoding)
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                return body
+        body = self.compress(data, encoding)
+        with self._lock:
+            self._entries[key] = body
+            while len(self._entries) > self.cache_size:
+                self._entries.popitem(last=False)
+        return body
+
+    def iter_compress(self, chunks, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            compress, finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            compress, finish = compressor.compress, compressor.flush
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk)
+            if data:
+                yield data
+        yield finish()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def apply(self, response):
+        """Compresses ``response`` in place if it qualifies and the client accepts it."""
+        if (response.direct_passthrough or response.status_code in SKIPPED_STATUSES
+                or response.status_code < 200 or 'Content-Encoding' in response.headers
+                or not _is_compressible(response.mimetype)
+                or 'no-transform' in response.headers.get('Cache-Control', '')):
+            return response
+        streamed = response.is_streamed
+        if not streamed and response.calculate_content_length() < self.min_size:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        if streamed:
+            response.response = self.iter_compress(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(self.compress_cached(response.get_data(), encoding, etag if not weak else None))
+        response.headers['Content-Encoding'] = encoding
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def init_app(app, compressor):
+    """Compresses eligible responses after each request unless ``COMPRESS_ENABLED`` is off."""
+    app.extensions['compressor'] = compressor
+
+    @app.after_request
+    def _compress(response):
+        if not app.config.get('COMPRESS_ENABLED', True):
+            return response
+        return compressor.apply(response)
@@ -0,0 +1,108 @@
+"""
+Environment-driven database configuration.
+
+``SQLALCHEMY_DATABASE_URI`` (or ``DATABASE_URL``, as set by most PostgreSQL
+hosts) selects the database; ``postgres://`` and driverless
+``postgresql://`` URLs are rewritten to ``postgresql+psycopg2://``, the
+driver the ``postgres`` extra installs (SQLAlchemy 2.1 otherwise defaults
+to psycopg 3). ``DB_REPLICA_URIS`` lists read
+replicas the same way, comma-separated. Pool settings come from
+``DB_POOL_*`` variables and apply to every backend with a real connection
+pool.
+
+SQLite connections get their pragmas on connect: WAL journaling so readers
+never wait for a writer, ``synchronous=NORMAL`` (durable at checkpoints, and
+safe in WAL mode), a memory-mapped read path, a larger page cache and a busy
+timeout so concurrent writers queue instead of failing with
+``database is locked``.
+"""
+import os
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+DEFAULT_URI = 'sqlite:///realestate.db'
+
+# Applied in order on every new SQLite connection; override with SQLITE_<NAME>
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': '5000',
+    'cache_size': '-20000',     # negative means KiB, so ~20 MB
+    'mmap_size': '268435456',   # 256 MB
+    'temp_store': 'MEMORY',
+}
+
+
+def _env_bool(name, default, env):
+    value = env.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _normalize_uri(uri):
+    for scheme in ('postgres://', 'postgresql://'):
+        if uri.startswith(scheme):
+            return 'postgresql+psycopg2://' + uri[len(scheme):]
+    return uri
+
+
+def database_uri(env=os.environ):
+    return _normalize_uri(env.get('SQLALCHEMY_DATABASE_URI') or env.get('DATABASE_URL') or DEFAULT_URI)
+
+
+def replica_uris(env=os.environ):
+    """Comma-separated ``DB_REPLICA_URIS``; empty means every query uses the primary."""
+    return [_normalize_uri(uri.strip()) for uri in env.get('DB_REPLICA_URIS', '').split(',') if uri.strip()]
+
+
+def is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(uri, env=os.environ):
+    """``SQLALCHEMY_ENGINE_OPTIONS`` for ``uri``."""
+    url = make_url(uri)
+    if is_memory_sqlite(url):
+        # A single shared connection; pool sizing does not apply
+        return {}
+    options = {
+        'pool_size': int(env.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(env.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(env.get('DB_POOL_TIMEOUT', 30)),
+    }
+    if url.get_backend_name() != 'sqlite':
+        # Network databases drop idle connections; check and recycle them
+        options['pool_pre_ping'] = _env_bool('DB_POOL_PRE_PING', True, env)
+        options['pool_recycle'] = int(env.get('DB_POOL_RECYCLE', 1800))
+        if url.get_backend_name() == 'postgresql':
+            options['connect_args'] = {'connect_timeout': int(env.get('DB_CONNECT_TIMEOUT', 10))}
+    return options
+
+
+def sqlite_pragmas(env=os.environ):
+    return {name: env.get(f'SQLITE_{name.upper()}', value) for name, value in SQLITE_PRAGMAS.items()}
+
+
+def install_sqlite_pragmas(engine, pragmas):
+    """Runs ``pragmas`` on each new connection of a SQLite ``engine``; no-op for other backends."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def create_engine(uri, pragmas):
+    """An engine outside Flask-SQLAlchemy (e.g. a replica) with the same options; SQLite paths are used as given."""
+    engine = sqlalchemy.create_engine(uri, **engine_options(uri))
+    install_sqlite_pragmas(engine, pragmas)
+    return engine
@@ -0,0 +1,460 @@
+"""
+Coordinates, geocoding and spatial queries for properties.
+
+Properties carry ``latitude``/``longitude`` columns. When a property is
+created or its ``location`` changes without explicit coordinates, they are
+filled in by a geocoder: any callable ``geocode(location) -> (lat, lng) or
+None``. The default one is an offline ``Gazetteer`` of known places, looked
+up from the most specific part of the location to the least, so
+"Getsemaní, Cartagena" resolves to the neighbourhood and "Somewhere,
+Cartagena" still lands on the city.
+
+Spatial lookups go through an index instead of scanning the table: an R*Tree
+virtual table (``property_rtree``) kept in sync by triggers on SQLite, and a
+GiST index on ``point(longitude, latitude)`` on PostgreSQL. Other backends
+fall back to plain range conditions on the columns.
+
+Three queries build on it:
+    NearQuery         properties within ``radius_km`` of a point, nearest first
+    BoundingBoxQuery  properties inside a map viewport
+    ClusterQuery      viewport counts grouped into a grid sized for a zoom
+                      level, so a map can show thousands of listings as a
+                      few dozen markers
+"""
+import csv
+import math
+import unicodedata
+
+from sqlalchemy import DDL, Integer, bindparam, cast, column, event, func, inspect, select, table
+
+from listing import (
+    ListingQueryError, SUMMARY_FIELDS, column_fields, parse_fields, parse_filters, parse_limit, serialize_rows,
+)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+DEFAULT_RADIUS_KM = 5.0
+MAX_RADIUS_KM = 100.0
+MAX_PINS = 500
+MAX_ZOOM = 20
+# Grid cells per side of a 256px map tile, i.e. clusters roughly 64px apart
+CELLS_PER_TILE = 4
+# A viewport too large for its zoom level would produce more groups than a map can draw
+MAX_CLUSTER_CELLS = 10000
+
+RTREE_TABLE = 'property_rtree'
+_POINT = 'new.latitude IS NOT NULL AND new.longitude IS NOT NULL'
+_RTREE_INSERT = (f'INSERT INTO {RTREE_TABLE}(id, min_lat, max_lat, min_lng, max_lng) '
+                 f'SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude WHERE {_POINT};')
+SQLITE_STATEMENTS = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} USING rtree(id, min_lat, max_lat, min_lng, max_lng)',
+    f'CREATE TRIGGER IF NOT EXISTS property_rtree_ai AFTER INSERT ON property BEGIN {_RTREE_INSERT} END',
+    f'CREATE TRIGGER IF NOT EXISTS property_rtree_au AFTER UPDATE OF latitude, longitude ON property BEGIN '
+    f'DELETE FROM {RTREE_TABLE} WHERE id = old.id; {_RTREE_INSERT} END',
+    f'CREATE TRIGGER IF NOT EXISTS property_rtree_ad AFTER DELETE ON property BEGIN '
+    f'DELETE FROM {RTREE_TABLE} WHERE id = old.id; END',
+)
+SQLITE_DROP_STATEMENTS = (
+    'DROP TRIGGER IF EXISTS property_rtree_ad',
+    'DROP TRIGGER IF EXISTS property_rtree_au',
+    'DROP TRIGGER IF EXISTS property_rtree_ai',
+    f'DROP TABLE IF EXISTS {RTREE_TABLE}',
+)
+# Built-in geometric types, so no PostGIS is needed
+POSTGRES_INDEX = 'CREATE INDEX IF NOT EXISTS ix_property_point ON property USING gist (point(longitude, latitude))'
+
+rtree = table(RTREE_TABLE, column('id'), column('min_lat'), column('max_lat'), column('min_lng'), column('max_lng'))
+
+# Places the bundled gazetteer knows, as "<place>, <city>" or "<city>".
+# GEOCODER_GAZETTEER_PATH adds to or overrides these.
+DEFAULT_PLACES = {
+    'Cartagena': (10.3910, -75.4794),
+    'Cartagena de Indias': (10.3910, -75.4794),
+    'Bocagrande, Cartagena': (10.3984, -75.5556),
+    'Castillogrande, Cartagena': (10.3917, -75.5520),
+    'El Laguito, Cartagena': (10.3953, -75.5620),
+    'Centro Histórico, Cartagena': (10.4236, -75.5503),
+    'Ciudad Amurallada, Cartagena': (10.4236, -75.5503),
+    'San Diego, Cartagena': (10.4275, -75.5470),
+    'La Matuna, Cartagena': (10.4225, -75.5455),
+    'Getsemaní, Cartagena': (10.4190, -75.5460),
+    'Manga, Cartagena': (10.4105, -75.5360),
+    'Crespo, Cartagena': (10.4440, -75.5160),
+    'Marbella, Cartagena': (10.4370, -75.5330),
+    'Bogotá': (4.7110, -74.0721),
+    'Medellín': (6.2442, -75.5812),
+    'Cali': (3.4516, -76.5320),
+    'Barranquilla': (10.9685, -74.7813),
+    'Santa Marta': (11.2408, -74.1990),
+}
+
+
+def register(property_table):
+    """Creates the spatial index together with the property table."""
+    for statement in SQLITE_STATEMENTS:
+        event.listen(property_table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    for statement in SQLITE_DROP_STATEMENTS:
+        event.listen(property_table, 'before_drop', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(property_table, 'after_create', DDL(POSTGRES_INDEX).execute_if(dialect='postgresql'))
+
+
+# --- Geocoding ---
+
+def normalize_place(name):
+    """Lowercase, accents stripped, parts separated by ', '."""
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    text = ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+    parts = (' '.join(part.split()) for part in text.split(','))
+    return ', '.join(part for part in parts if part)
+
+
+class Gazetteer:
+    """Offline geocoder over a table of place names."""
+
+    def __init__(self, places=None):
+        self.places = {}
+        self.update(DEFAULT_PLACES if places is None else places)
+
+    def update(self, places):
+        for name, (latitude, longitude) in places.items():
+            self.places[normalize_place(name)] = (float(latitude), float(longitude))
+
+    def load_csv(self, path):
+        """Adds places from a CSV file with ``name,latitude,longitude`` columns."""
+        with open(path, newline='', encoding='utf-8') as f:
+            self.update({row['name']: (row['latitude'], row['longitude']) for row in csv.DictReader(f)})
+        return self
+
+    def __call__(self, location):
+        parts = normalize_place(location).split(', ')
+        # Most specific first: "a, b, c", then "b, c", then "c"
+        for start in range(len(parts)):
+            point = self.places.get(', '.join(parts[start:]))
+            if point is not None:
+                return point
+        return None
+
+
+def make_geocoder(config):
+    """Builds the geocoder selected by GEOCODER ('gazetteer' or 'none')."""
+    kind = config.get('GEOCODER', 'gazetteer')
+    if kind == 'none':
+        return None
+    if kind == 'gazetteer':
+        gazetteer = Gazetteer()
+        if config.get('GEOCODER_GAZETTEER_PATH'):
+            gazetteer.load_csv(config['GEOCODER_GAZETTEER_PATH'])
+        return gazetteer
+    raise ValueError(f'Unknown GEOCODER: {kind}')
+
+
+def watch_locations(session, model, get_geocoder):
+    """
+    Geocodes ``model`` rows whose location is new or changed, unless
+    coordinates were given. ``get_geocoder()`` returns the geocoder to use at
+    flush time, or None to leave coordinates alone.
+    """
+    @event.listens_for(session, 'before_flush')
+    def _geocode(sess, flush_context, instances):
+        geocoder = get_geocoder()
+        if geocoder is None:
+            return
+        for obj in (*sess.new, *sess.dirty):
+            if not isinstance(obj, model):
+                continue
+            attrs = inspect(obj).attrs
+            if obj in sess.new:
+                if obj.latitude is not None or obj.longitude is not None:
+                    continue
+            elif (not attrs.location.history.has_changes()
+                  or attrs.latitude.history.has_changes() or attrs.longitude.history.has_changes()):
+                continue
+            # An unknown new location clears coordinates that belonged to the old one
+            obj.latitude, obj.longitude = geocoder(obj.location) or (None, None)
+
+
+def geocode_missing(session, model, geocoder, overwrite=False, batch_size=500):
+    """
+    Fills coordinates from ``location`` for rows without them (every row with
+    ``overwrite``). ``updated_at`` is left alone: the listing did not change.
+    Returns ``(geocoded, unresolved)`` counts.
+    """
+    geocoded = unresolved = 0
+    last_id = 0
+    while True:
+        stmt = select(model.id, model.location).where(model.id > last_id).order_by(model.id).limit(batch_size)
+        if not overwrite:
+            stmt = stmt.where(model.latitude.is_(None) | model.longitude.is_(None))
+        rows = session.execute(stmt).all()
+        if not rows:
+            return geocoded, unresolved
+        params = []
+        for row in rows:
+            point = geocoder(row.location)
+            if point is None:
+                unresolved += 1
+                continue
+            params.append({'b_id': row.id, 'b_latitude': point[0], 'b_longitude': point[1]})
+        if params:
+            property_table = model.__table__
+            session.execute(
+                property_table.update()
+                .where(property_table.c.id == bindparam('b_id'))
+                .values(latitude=bindparam('b_latitude'), longitude=bindparam('b_longitude'),
+                        updated_at=property_table.c.updated_at),
+                params,
+            )
+            geocoded += len(params)
+        session.commit()
+        last_id = rows[-1].id
+
+
+# --- Distance and parsing ---
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def check_coordinates(latitude, longitude):
+    """Returns the pair as floats, raising ListingQueryError when out of range."""
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise ListingQueryError('latitude and longitude must be numbers')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ListingQueryError('latitude must be within [-90, 90] and longitude within [-180, 180]')
+    return latitude, longitude
+
+
+def point_from(data, default=(None, None)):
+    """
+    ``(latitude, longitude)`` from a property payload: ``default`` when
+    neither key is present, ``(None, None)`` when both are null (so the
+    geocoder fills them in), otherwise both validated. A point is only ever
+    replaced whole; one key without the other raises ListingQueryError.
+    """
+    given = [key for key in ('latitude', 'longitude') if key in data]
+    if not given:
+        return default
+    if len(given) == 1:
+        raise ListingQueryError('latitude and longitude must be given together')
+    latitude, longitude = data['latitude'], data['longitude']
+    if latitude is None and longitude is None:
+        return None, None
+    return check_coordinates(latitude, longitude)
+
+
+def parse_radius(value):
+    if value is None or value == '':
+        return DEFAULT_RADIUS_KM
+    try:
+        radius = float(value)
+    except ValueError:
+        raise ListingQueryError(f'Invalid radius_km: {value}')
+    if not 0 < radius <= MAX_RADIUS_KM:
+        raise ListingQueryError(f'radius_km must be greater than 0 and at most {MAX_RADIUS_KM:g}')
+    return radius
+
+
+def parse_bbox(value):
+    """``west,south,east,north`` in degrees (the GeoJSON order)."""
+    if not value:
+        raise ListingQueryError('bbox is required as west,south,east,north')
+    try:
+        west, south, east, north = (float(v) for v in value.split(','))
+    except ValueError:
+        raise ListingQueryError(f'Invalid bbox: {value}')
+    check_coordinates(south, west)
+    check_coordinates(north, east)
+    if south > north:
+        raise ListingQueryError('bbox south must not be greater than north')
+    if west > east:
+        raise ListingQueryError('bbox must not cross the antimeridian')
+    return west, south, east, north
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    """The bbox enclosing a circle, clamped to valid coordinates."""
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = max(latitude - dlat, -90.0), min(latitude + dlat, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+    if cos_lat < 1e-6:
+        return -180.0, south, 180.0, north
+    dlng = dlat / cos_lat
+    return max(longitude - dlng, -180.0), south, min(longitude + dlng, 180.0), north
+
+
+def within_bbox(model, bbox, dialect):
+    """WHERE clauses selecting rows inside ``bbox`` through the dialect's spatial index."""
+    west, south, east, north = bbox
+    exact = [model.latitude.between(south, north), model.longitude.between(west, east)]
+    if dialect == 'sqlite':
+        # R*Tree boxes are stored as rounded 32-bit floats, so look up by
+        # overlap and let the exact conditions trim the edges
+        candidates = select(rtree.c.id).where(
+            rtree.c.max_lat >= south, rtree.c.min_lat <= north,
+            rtree.c.max_lng >= west, rtree.c.min_lng <= east,
+        )
+        return [model.id.in_(candidates), *exact]
+    if dialect == 'postgresql':
+        point = func.point(model.longitude, model.latitude)
+        return [point.op('<@')(func.box(func.point(west, south), func.point(east, north)))]
+    return exact
+
+
+def _selected_columns(model, fields):
+    return [getattr(model, f) for f in dict.fromkeys(('id',) + column_fields(fields) + ('latitude', 'longitude'))]
+
+
+# --- Queries ---
+
+class NearQuery:
+    """
+    Properties within ``radius_km`` (default 5, max 100) of ``lat``/``lng``,
+    nearest first, each with a ``distance_km``. Also accepts ``limit``,
+    ``fields`` and the listing filters.
+    """
+
+    def __init__(self, model, args, default_fields=SUMMARY_FIELDS):
+        self.model = model
+        self.latitude, self.longitude = check_coordinates(args.get('lat'), args.get('lng'))
+        self.radius_km = parse_radius(args.get('radius_km'))
+        self.limit = parse_limit(args.get('limit'))
+        self.fields = parse_fields(args.get('fields'), default_fields)
+        self.filters = parse_filters(model, args)
+
+    def statement(self, dialect):
+        model = self.model
+        # Equirectangular distance in degrees: plain arithmetic every backend
+        # can evaluate, and accurate enough to rank and filter at city scale
+        scale = math.cos(math.radians(self.latitude))
+        dlat = model.latitude - self.latitude
+        dlng = (model.longitude - self.longitude) * scale
+        distance_sq = dlat * dlat + dlng * dlng
+        bbox = radius_bbox(self.latitude, self.longitude, self.radius_km)
+        return (
+            select(*_selected_columns(model, self.fields))
+            .where(*within_bbox(model, bbox, dialect), distance_sq <= (self.radius_km / KM_PER_DEGREE) ** 2,
+                   *self.filters)
+            .order_by(distance_sq, model.id)
+            .limit(self.limit)
+        )
+
+    def execute(self, session):
+        rows = session.execute(self.statement(session.get_bind().dialect.name)).all()
+        items = serialize_rows(session, self.model, rows, self.fields)
+        for item, row in zip(items, rows):
+            item['distance_km'] = round(haversine_km(self.latitude, self.longitude, row.latitude, row.longitude), 3)
+        return items
+
+
+class BoundingBoxQuery:
+    """
+    Properties inside ``bbox``, in id order, up to ``limit`` (default 100,
+    max 500) for drawing individual pins. Also accepts ``fields`` and the
+    listing filters.
+    """
+
+    def __init__(self, model, args, default_fields=SUMMARY_FIELDS):
+        self.model = model
+        self.bbox = parse_bbox(args.get('bbox'))
+        self.limit = self._parse_limit(args.get('limit'))
+        self.fields = parse_fields(args.get('fields'), default_fields)
+        self.filters = parse_filters(model, args)
+
+    @staticmethod
+    def _parse_limit(value):
+        if value is None or value == '':
+            return 100
+        try:
+            limit = int(value)
+        except ValueError:
+            raise ListingQueryError(f'Invalid limit: {value}')
+        if not 1 <= limit <= MAX_PINS:
+            raise ListingQueryError(f'limit must be between 1 and {MAX_PINS}')
+        return limit
+
+    def statement(self, dialect):
+        return (
+            select(*_selected_columns(self.model, self.fields))
+            .where(*within_bbox(self.model, self.bbox, dialect), *self.filters)
+            .order_by(self.model.id)
+            .limit(self.limit + 1)
+        )
+
+    def execute(self, session):
+        """Returns ``(items, truncated)``."""
+        rows = session.execute(self.statement(session.get_bind().dialect.name)).all()
+        truncated = len(rows) > self.limit
+        return serialize_rows(session, self.model, rows[:self.limit], self.fields), truncated
+
+
+class ClusterQuery:
+    """
+    Groups properties inside ``bbox`` into grid cells sized for ``zoom``
+    (0-20, web map zoom levels). Each cluster has its centroid, ``count``,
+    the ``bbox`` of its members (zooming to it splits the cluster) and, for a
+    single property, its ``id``. Also accepts the listing filters.
+    """
+
+    def __init__(self, model, args):
+        self.model = model
+        self.bbox = parse_bbox(args.get('bbox'))
+        self.zoom = self._parse_zoom(args.get('zoom'))
+        self.cell = 360.0 / (2 ** self.zoom * CELLS_PER_TILE)
+        west, south, east, north = self.bbox
+        if math.ceil((east - west) / self.cell) * math.ceil((north - south) / self.cell) > MAX_CLUSTER_CELLS:
+            raise ListingQueryError('bbox is too large for this zoom level')
+        self.filters = parse_filters(model, args)
+
+    @staticmethod
+    def _parse_zoom(value):
+        try:
+            zoom = int(value)
+        except (TypeError, ValueError):
+            raise ListingQueryError(f'zoom must be an integer between 0 and {MAX_ZOOM}')
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ListingQueryError(f'zoom must be an integer between 0 and {MAX_ZOOM}')
+        return zoom
+
+    def _cell_index(self, offset_column, dialect):
+        # Offsets are non-negative, so SQLite's truncating cast is a floor
+        value = offset_column / self.cell
+        return cast(value, Integer) if dialect == 'sqlite' else func.floor(value)
+
+    def statement(self, dialect):
+        model = self.model
+        cell_x = self._cell_index(model.longitude + 180, dialect)
+        cell_y = self._cell_index(model.latitude + 90, dialect)
+        return (
+            select(
+                func.count().label('count'),
+                func.avg(model.latitude).label('latitude'),
+                func.avg(model.longitude).label('longitude'),
+                func.min(model.longitude).label('west'),
+                func.min(model.latitude).label('south'),
+                func.max(model.longitude).label('east'),
+                func.max(model.latitude).label('north'),
+                func.min(model.id).label('id'),
+            )
+            .where(*within_bbox(model, self.bbox, dialect), *self.filters)
+            .group_by(cell_x, cell_y)
+            .order_by(cell_y, cell_x)
+        )
+
+    def execute(self, session):
+        clusters = []
+        for row in session.execute(self.statement(session.get_bind().dialect.name)):
+            cluster = {
+                # ~10 cm; more digits are float noise from averaging
+                'latitude': round(row.latitude, 6),
+                'longitude': round(row.longitude, 6),
+                'count': row.count,
+                'bbox': [row.west, row.south, row.east, row.north],
+            }
+            if row.count == 1:
+                cluster['id'] = row.id
+            clusters.append(cluster)
+        return clusters
@@ -0,0 +1,419 @@
+"""
+Durable background jobs stored in the application database.
+
+Handlers are registered on a ``JobQueue`` with ``@job_queue.task(...)`` and
+enqueued with ``job_queue.enqueue(db.session, name, payload)``. Enqueuing is
+one INSERT on the request's own connection, without a commit, so a handler
+hands off work in microseconds. The job becomes visible to workers only
+when the request's transaction commits: a request that rolls back leaves no
+job behind.
+
+``flask worker`` runs ``Worker``, which claims due jobs with a single
+``UPDATE ... RETURNING`` (plus ``FOR UPDATE SKIP LOCKED`` on PostgreSQL), so
+any number of workers can share the table. Jobs run on a thread pool, or on
+a process pool for CPU-bound handlers. Each queue can have a concurrency
+limit; it counts running jobs across all workers when jobs are claimed,
+so two workers claiming at the same instant may briefly exceed it.
+
+Other features:
+    retries       a failed job is retried after an exponential backoff
+                  with jitter, up to ``max_attempts``, then marked failed
+    idempotency   enqueuing with an ``idempotency_key`` already in the
+                  table is a no-op; keys are freed when finished jobs are
+                  pruned
+    scheduling    ``delay``/``run_at`` defer a job; tasks registered with
+                  ``every=`` seconds are enqueued once per period, with
+                  idempotency keys so several workers never double-schedule
+    leases        a claimed job is leased to its worker and the lease is
+                  renewed while it runs; jobs of a worker that died are
+                  requeued once their lease expires
+"""
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+DEFAULT_QUEUE = 'default'
+MODES = ('thread', 'process')
+MAX_ERROR_LENGTH = 4000
+
+logger = logging.getLogger(__name__)
+
+
+def _utcnow():
+    # Naive UTC, as stored by SQLite and compared by the claim query
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def parse_queue_limits(value):
+    """``"media=2,sync=1"`` -> ``{'media': 2, 'sync': 1}``."""
+    limits = {}
+    for item in (value or '').split(','):
+        if item.strip():
+            name, _, limit = item.partition('=')
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+class Task:
+    def __init__(self, fn, name, queue, max_attempts, backoff, max_backoff, every, on_failure):
+        self.fn = fn
+        self.name = name
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.every = every
+        self.on_failure = on_failure
+
+    def retry_delay(self, attempts):
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        # Jitter spreads retries of jobs that failed together
+        return delay * random.uniform(0.5, 1.0)
+
+
+class JobQueue:
+    """Task registry plus the queue operations on ``table``."""
+
+    def __init__(self, table, lease_seconds=300, retention_days=7):
+        self.table = table
+        self.lease_seconds = lease_seconds
+        self.retention_days = retention_days
+        self.tasks = {}
+
+    def init_app(self, app):
+        app.extensions['jobs'] = self
+
+    def task(self, name=None, queue=DEFAULT_QUEUE, max_attempts=5, backoff=10, max_backoff=3600, every=None,
+             on_failure=None):
+        """
+        Registers a handler called as ``fn(**payload)`` inside an app context.
+        ``on_failure(payload, error)`` runs once the last attempt has failed.
+        """
+        def decorator(fn):
+            task_name = name or f'{fn.__module__}.{fn.__name__}'
+            self.tasks[task_name] = Task(fn, task_name, queue, max_attempts, backoff, max_backoff, every, on_failure)
+            return fn
+        return decorator
+
+    def queues(self):
+        return sorted({task.queue for task in self.tasks.values()})
+
+    # --- Producing ---
+
+    def enqueue(self, executor, name, payload=None, delay=None, run_at=None, idempotency_key=None):
+        """
+        Adds a job through ``executor`` (a session or connection) without
+        committing. Returns False when ``idempotency_key`` was already used.
+        """
+        task = self.tasks.get(name)
+        if task is None:
+            raise KeyError(f'Unknown task: {name}')
+        now = _utcnow()
+        if run_at is None:
+            run_at = now + timedelta(seconds=delay) if delay else now
+        values = {
+            'queue': task.queue,
+            'name': name,
+            'payload': json.dumps(payload or {}, separators=(',', ':')),
+            'status': 'queued',
+            'attempts': 0,
+            'max_attempts': task.max_attempts,
+            'run_at': run_at,
+            'idempotency_key': idempotency_key,
+            'created_at': now,
+        }
+        if idempotency_key is None:
+            executor.execute(insert(self.table).values(values))
+            return True
+        dialect = _dialect(executor)
+        if dialect in ('sqlite', 'postgresql'):
+            dialect_insert = importlib.import_module(f'sqlalchemy.dialects.{dialect}').insert
+            stmt = dialect_insert(self.table).values(values).on_conflict_do_nothing(index_elements=['idempotency_key'])
+            return executor.execute(stmt).rowcount == 1
+        try:
+            with executor.begin_nested():
+                executor.execute(insert(self.table).values(values))
+            return True
+        except IntegrityError:
+            return False
+
+    def due_periods(self, now=None):
+        """``{task name: current period number}`` for every ``every=`` task."""
+        timestamp = (now or _utcnow()).replace(tzinfo=timezone.utc).timestamp()
+        return {task.name: int(timestamp // task.every) for task in self.tasks.values() if task.every}
+
+    def schedule_periodic(self, connection, periods):
+        """Enqueues the run of each task for its period, unless one was already enqueued."""
+        for name, period in periods.items():
+            every = self.tasks[name].every
+            run_at = datetime.fromtimestamp(period * every, timezone.utc).replace(tzinfo=None)
+            self.enqueue(connection, name, run_at=run_at, idempotency_key=f'{name}@{period}')
+
+    # --- Consuming ---
+
+    def running_counts(self, connection, now):
+        t = self.table
+        rows = connection.execute(
+            select(t.c.queue, func.count()).where(t.c.status == 'running', t.c.locked_until > now).group_by(t.c.queue)
+        )
+        return dict(rows.tuples().all())
+
+    def claim(self, connection, queue, limit, worker_id, now=None):
+        """Leases up to ``limit`` due jobs of ``queue`` to ``worker_id``."""
+        now = now or _utcnow()
+        t = self.table
+        due = (select(t.c.id)
+               .where(t.c.queue == queue, t.c.status == 'queued', t.c.run_at <= now)
+               .order_by(t.c.run_at, t.c.id)
+               .limit(limit))
+        if connection.dialect.name == 'postgresql':
+            due = due.with_for_update(skip_locked=True)
+        stmt = (update(t)
+                .where(t.c.id.in_(due))
+                .values(status='running', attempts=t.c.attempts + 1, locked_by=worker_id,
+                        locked_until=now + timedelta(seconds=self.lease_seconds), started_at=now)
+                .returning(t.c.id, t.c.name, t.c.payload, t.c.attempts, t.c.max_attempts))
+        return connection.execute(stmt).all()
+
+    def renew(self, connection, ids, worker_id, now=None):
+        if ids:
+            t = self.table
+            connection.execute(
+                update(t).where(t.c.id.in_(ids), t.c.locked_by == worker_id)
+                .values(locked_until=(now or _utcnow()) + timedelta(seconds=self.lease_seconds))
+            )
+
+    def complete(self, connection, job_id, now=None):
+        connection.execute(
+            update(self.table).where(self.table.c.id == job_id)
+            .values(status='done', finished_at=now or _utcnow(), locked_by=None, locked_until=None)
+        )
+
+    def fail(self, connection, job, error, now=None):
+        """Schedules a retry, or marks the job failed; returns True if it will be retried."""
+        now = now or _utcnow()
+        task = self.tasks.get(job.name)
+        retry = task is not None and job.attempts < job.max_attempts
+        values = {'last_error': error[-MAX_ERROR_LENGTH:], 'locked_by': None, 'locked_until': None}
+        if retry:
+            values.update(status='queued', run_at=now + timedelta(seconds=task.retry_delay(job.attempts)))
+        else:
+            values.update(status='failed', finished_at=now)
+        connection.execute(update(self.table).where(self.table.c.id == job.id).values(values))
+        return retry
+
+    def requeue_expired(self, connection, now=None):
+        """Returns jobs whose worker stopped renewing their lease to the queue."""
+        now = now or _utcnow()
+        t = self.table
+        expired = and_(t.c.status == 'running', t.c.locked_until < now)
+        connection.execute(
+            update(t).where(expired, t.c.attempts < t.c.max_attempts)
+            .values(status='queued', run_at=now, locked_by=None, locked_until=None, last_error='Lease expired')
+        )
+        connection.execute(
+            update(t).where(expired)
+            .values(status='failed', finished_at=now, locked_by=None, locked_until=None, last_error='Lease expired')
+        )
+
+    def prune(self, connection, now=None):
+        """Deletes finished jobs older than the retention period; failed jobs are kept."""
+        cutoff = (now or _utcnow()) - timedelta(days=self.retention_days)
+        t = self.table
+        connection.execute(delete(t).where(t.c.status == 'done', t.c.finished_at < cutoff))
+
+    def counts(self, connection):
+        t = self.table
+        rows = connection.execute(select(t.c.queue, t.c.status, func.count()).group_by(t.c.queue, t.c.status))
+        counts = {}
+        for queue, status, count in rows:
+            counts.setdefault(queue, {})[status] = count
+        return counts
+
+
+def _dialect(executor):
+    bind = executor.get_bind() if hasattr(executor, 'get_bind') else executor
+    return bind.dialect.name
+
+
+def _run_task(app, job_queue, name, payload):
+    task = job_queue.tasks[name]
+    with app.app_context():
+        task.fn(**payload)
+
+
+def _run_in_process(app_import, name, payload):
+    # Runs in a spawned worker process: import the app there and look the task up
+    module_name, _, attribute = app_import.partition(':')
+    app = getattr(importlib.import_module(module_name), attribute or 'app')
+    _run_task(app, app.extensions['jobs'], name, payload)
+
+
+class Worker:
+    """
+    Polls the job table and runs due jobs on a pool of ``concurrency``
+    threads or processes. ``queue_limits`` caps running jobs per queue;
+    ``app_import`` (``"module:attribute"``) is how process-mode children
+    find the Flask app.
+    """
+
+    def __init__(self, app, job_queue, engine, queues=None, concurrency=4, mode='thread', queue_limits=None,
+                 poll_interval=1.0, app_import=None):
+        if mode not in MODES:
+            raise ValueError(f'Unknown worker mode: {mode}')
+        self.app = app
+        self.job_queue = job_queue
+        self.engine = engine
+        self.queues = list(queues or job_queue.queues())
+        self.concurrency = concurrency
+        self.mode = mode
+        self.queue_limits = dict(queue_limits or {})
+        self.poll_interval = poll_interval
+        self.app_import = app_import or f'{app.import_name}:app'
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{id(self):x}'
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._executor = None
+        self._periods = {}
+        self._last_maintenance = 0.0
+        self._last_prune = 0.0
+
+    def _pool(self):
+        if self._executor is None:
+            if self.mode == 'process':
+                # Spawned, not forked: children must not inherit open database connections
+                self._executor = ProcessPoolExecutor(max_workers=self.concurrency,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job')
+        return self._executor
+
+    def run_once(self):
+        """One polling cycle; returns the number of jobs started."""
+        now = _utcnow()
+        self._maintain()
+        # Only write when a periodic task entered a new period since the last cycle
+        periods = {name: period for name, period in self.job_queue.due_periods(now).items()
+                   if self._periods.get(name) != period}
+        if periods:
+            with self.engine.begin() as connection:
+                self.job_queue.schedule_periodic(connection, periods)
+            self._periods.update(periods)
+        with self.engine.connect() as connection:
+            running = self.job_queue.running_counts(connection, now)
+
+        started = 0
+        for queue in self.queues:
+            with self._lock:
+                free = self.concurrency - len(self._running)
+            if queue in self.queue_limits:
+                free = min(free, self.queue_limits[queue] - running.get(queue, 0))
+            if free <= 0:
+                continue
+            with self.engine.begin() as connection:
+                jobs = self.job_queue.claim(connection, queue, free, self.worker_id, now)
+            for job in jobs:
+                self._submit(job)
+            started += len(jobs)
+        return started
+
+    def _submit(self, job):
+        payload = json.loads(job.payload)
+        if job.name not in self.job_queue.tasks:
+            future = None
+        elif self.mode == 'process':
+            future = self._pool().submit(_run_in_process, self.app_import, job.name, payload)
+        else:
+            future = self._pool().submit(_run_task, self.app, self.job_queue, job.name, payload)
+        if future is None:
+            self._finish(job, payload, f'Unknown task: {job.name}')
+            return
+        with self._lock:
+            self._running[job.id] = job
+        future.add_done_callback(lambda f: self._done(job, payload, f))
+
+    def _done(self, job, payload, future):
+        error = future.exception()
+        message = None
+        if isinstance(error, BrokenProcessPool):
+            # A child died (e.g. killed for memory); later jobs get a fresh pool
+            self.shutdown(wait=False)
+        if error is not None:
+            message = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+        try:
+            self._finish(job, payload, message)
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+            self._wake.set()
+
+    def _finish(self, job, payload, error):
+        with self.engine.begin() as connection:
+            if error is None:
+                self.job_queue.complete(connection, job.id)
+                return
+            retried = self.job_queue.fail(connection, job, error)
+        logger.warning('Job %s (%s) attempt %s failed%s: %s', job.id, job.name, job.attempts,
+                       '' if retried else ', giving up', error.strip().splitlines()[-1])
+        task = self.job_queue.tasks.get(job.name)
+        if not retried and task is not None and task.on_failure is not None:
+            with self.app.app_context():
+                task.on_failure(payload, error)
+
+    def _maintain(self):
+        # Leases are renewed well before they expire; other workers' expired
+        # leases are reclaimed on the same schedule
+        now = time.monotonic()
+        if now - self._last_maintenance >= self.job_queue.lease_seconds / 3:
+            with self._lock:
+                ids = list(self._running)
+            with self.engine.begin() as connection:
+                self.job_queue.renew(connection, ids, self.worker_id)
+                self.job_queue.requeue_expired(connection)
+            self._last_maintenance = now
+        if now - self._last_prune >= 3600:
+            with self.engine.begin() as connection:
+                self.job_queue.prune(connection)
+            self._last_prune = now
+
+    def run(self):
+        """Polls until ``stop()``; waits between cycles only when there was nothing to start."""
+        logger.info('Worker %s consuming %s (%s x %s)', self.worker_id, ', '.join(self.queues),
+                    self.concurrency, self.mode)
+        try:
+            while not self._stop.is_set():
+                if self.run_once() == 0:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+        finally:
+            self.shutdown()
+
+    def start(self):
+        """Runs the worker on a daemon thread, e.g. inside the development server."""
+        thread = threading.Thread(target=self.run, name='job-worker', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,238 @@
+"""
+Keyset-paginated, filtered listing queries for the Property model.
+
+The listing endpoints select only the requested columns straight from SQL
+instead of hydrating full ORM objects, and page with an opaque cursor over
+``(sort column, id)`` so deep pages cost the same as the first one.
+
+``images`` and ``amenities`` live in their own tables; they are fetched for a
+whole page at once through ``model.related_values`` rather than per row.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_, select
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+DEFAULT_SORT = '-created_at'
+SORTABLE_FIELDS = ('created_at', 'updated_at', 'price', 'bedrooms', 'bathrooms', 'area')
+# JSON types a cursor may carry for each sort column; timestamps travel as ISO strings
+CURSOR_TYPES = {
+    'created_at': (str,), 'updated_at': (str,), 'price': (int, float), 'area': (int, float),
+    'bedrooms': (int,), 'bathrooms': (int,),
+}
+RANGE_FILTERS = {'price': float, 'bedrooms': int, 'bathrooms': int, 'area': float}
+FIELDS = (
+    'id', 'title', 'description', 'price', 'location', 'latitude', 'longitude', 'bedrooms', 'bathrooms',
+    'area', 'images', 'amenities', 'is_available', 'created_at', 'updated_at',
+)
+# Everything except the long description text, for card-style listing pages
+SUMMARY_FIELDS = tuple(f for f in FIELDS if f != 'description')
+# Fields stored in related tables rather than as property columns
+RELATED_FIELDS = ('images', 'amenities')
+
+TRUE_VALUES = {'1', 'true', 'yes'}
+FALSE_VALUES = {'0', 'false', 'no'}
+
+
+class ListingQueryError(ValueError):
+    """Raised when listing query parameters are malformed."""
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+# Column values that need converting before they are JSON-serializable,
+# mirroring what Property.to_dict() does for a full object.
+FIELD_SERIALIZERS = {
+    'created_at': _isoformat,
+    'updated_at': _isoformat,
+}
+
+
+def column_fields(fields):
+    return tuple(f for f in fields if f not in RELATED_FIELDS)
+
+
+def row_serializer(fields):
+    """
+    Returns a function turning a SQLAlchemy Row into a dict of the column
+    ``fields``; field lookups and converters are resolved once, not per row.
+    """
+    columns = [(field, FIELD_SERIALIZERS.get(field)) for field in column_fields(fields)]
+
+    def serialize(row):
+        mapping = row._mapping
+        return {field: convert(mapping[field]) if convert else mapping[field] for field, convert in columns}
+    return serialize
+
+
+def serialize_row(row, fields):
+    """Turns a SQLAlchemy Row into a dict holding the column ``fields``."""
+    return row_serializer(fields)(row)
+
+
+def serialize_rows(session, model, rows, fields):
+    """Serializes a page of rows, loading related fields with one query each."""
+    serialize = row_serializer(fields)
+    items = [serialize(row) for row in rows]
+    ids = [row._mapping['id'] for row in rows]
+    for field in fields:
+        if field in RELATED_FIELDS and ids:
+            values = model.related_values(session, field, ids)
+            for item, row_id in zip(items, ids):
+                item[field] = values[row_id]
+    return items
+
+
+def parse_bool(value, name):
+    lowered = value.strip().lower()
+    if lowered in TRUE_VALUES:
+        return True
+    if lowered in FALSE_VALUES:
+        return False
+    raise ListingQueryError(f'Invalid boolean for {name}: {value}')
+
+
+def encode_cursor(sort_value, row_id):
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _is_a(value, types):
+    # bool is an int subclass, but true/false is never a valid sort value or id
+    return isinstance(value, types) and not isinstance(value, bool)
+
+
+def decode_cursor(cursor, sort_field):
+    """
+    Returns the ``(sort value, id)`` pair of a cursor made by encode_cursor,
+    raising ListingQueryError unless the value has the sort column's type.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not (_is_a(sort_value, CURSOR_TYPES[sort_field]) and _is_a(row_id, int)):
+            raise TypeError(sort_value, row_id)
+        if sort_field in ('created_at', 'updated_at'):
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, row_id
+    except (ValueError, TypeError):
+        raise ListingQueryError('Invalid cursor')
+
+
+def parse_limit(value):
+    if value is None or value == '':
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ListingQueryError(f'Invalid limit: {value}')
+    if limit < 1:
+        raise ListingQueryError('limit must be positive')
+    return min(limit, MAX_LIMIT)
+
+
+def parse_sort(value):
+    descending = value.startswith('-')
+    field = value[1:] if descending else value
+    if field not in SORTABLE_FIELDS:
+        raise ListingQueryError(f'Cannot sort by: {field}')
+    return field, descending
+
+
+def parse_fields(value, default_fields):
+    if not value:
+        return tuple(default_fields)
+    fields = tuple(f.strip() for f in value.split(',') if f.strip())
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        raise ListingQueryError(f'Unknown fields: {", ".join(unknown)}')
+    return fields
+
+
+def parse_filters(model, args):
+    """Builds WHERE clauses for the structured filters shared by listing and search."""
+    filters = []
+    for name, cast in RANGE_FILTERS.items():
+        column = getattr(model, name)
+        for prefix, build in (('min_', column.__ge__), ('max_', column.__le__)):
+            raw = args.get(prefix + name)
+            if raw is None or raw == '':
+                continue
+            try:
+                filters.append(build(cast(raw)))
+            except ValueError:
+                raise ListingQueryError(f'Invalid value for {prefix}{name}: {raw}')
+    if args.get('location'):
+        filters.append(model.location == args['location'])
+    if args.get('is_available'):
+        filters.append(model.is_available == parse_bool(args['is_available'], 'is_available'))
+    # amenities=pool,gym keeps properties that have every listed amenity
+    for name in (args.get('amenities') or '').split(','):
+        if name.strip():
+            filters.append(model.has_amenity(name.strip()))
+    return filters
+
+
+class ListingQuery:
+    """
+    Parses listing request arguments and builds the matching SELECT.
+
+    Supported arguments:
+        limit            page size (default 20, max 100)
+        cursor           opaque cursor returned by the previous page
+        sort             one of SORTABLE_FIELDS, prefixed with '-' for descending
+        fields           comma-separated subset of FIELDS
+        min_<f>, max_<f> range filters for price, bedrooms, bathrooms and area
+        location         exact location match
+        is_available     true/false
+        amenities        comma-separated amenity names, all required
+    """
+
+    def __init__(self, model, args, default_fields=FIELDS):
+        self.model = model
+        self.limit = parse_limit(args.get('limit'))
+        self.sort_field, self.descending = parse_sort(args.get('sort') or DEFAULT_SORT)
+        self.fields = parse_fields(args.get('fields'), default_fields)
+        self.cursor = decode_cursor(args['cursor'], self.sort_field) if args.get('cursor') else None
+        self.filters = parse_filters(model, args)
+
+    def _keyset_condition(self):
+        sort_value, row_id = self.cursor
+        sort_column = getattr(self.model, self.sort_field)
+        if self.descending:
+            return or_(sort_column < sort_value, and_(sort_column == sort_value, self.model.id < row_id))
+        return or_(sort_column > sort_value, and_(sort_column == sort_value, self.model.id > row_id))
+
+    def statement(self):
+        # id and the sort column are always selected so the next cursor can be built
+        selected = list(dict.fromkeys(column_fields(self.fields) + ('id', self.sort_field)))
+        stmt = select(*(getattr(self.model, f) for f in selected))
+        conditions = list(self.filters)
+        if self.cursor is not None:
+            conditions.append(self._keyset_condition())
+        if conditions:
+            stmt = stmt.where(*conditions)
+        sort_column = getattr(self.model, self.sort_field)
+        if self.descending:
+            stmt = stmt.order_by(sort_column.desc(), self.model.id.desc())
+        else:
+            stmt = stmt.order_by(sort_column.asc(), self.model.id.asc())
+        # Fetch one extra row to learn whether another page exists
+        return stmt.limit(self.limit + 1)
+
+    def execute(self, session):
+        """Runs the query and returns ``(items, next_cursor)``."""
+        rows = session.execute(self.statement()).all()
+        next_cursor = None
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            last = rows[-1]._mapping
+            next_cursor = encode_cursor(last[self.sort_field], last['id'])
+        return serialize_rows(session, self.model, rows, self.fields), next_cursor
@@ -0,0 +1,175 @@
+"""
+Content-addressed image storage and background variant generation.
+
+Uploads are checked by their leading bytes rather than the file name, then
+streamed to a temporary file while being hashed and moved to
+``<root>/<hash[:2]>/<hash>.<ext>``. Identical uploads therefore land on the
+same path and are stored once, and a file can never overwrite a different
+one. Responsive variants (WebP plus AVIF, or JPEG where the Pillow build has
+no AVIF encoder) and a tiny blurred placeholder are produced by a
+background job after the request has returned.
+"""
+import base64
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+# Same breakpoints as the static assets produced by image-converter.js
+VARIANT_WIDTHS = (640, 768, 1024, 1366, 1920)
+VARIANT_QUALITY = {'webp': 82, 'avif': 60, 'jpeg': 82}
+PLACEHOLDER_WIDTH = 16
+CONTENT_TYPES = {
+    'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg',
+    'gif': 'image/gif', 'webp': 'image/webp', 'avif': 'image/avif',
+    'svg': 'image/svg+xml',
+}
+
+# Leading bytes of each accepted upload format
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+SNIFF_SIZE = 12
+
+# Matches the original or a variant path/URL and captures the content hash
+DIGEST_RE = re.compile(r'(?:^|/)([0-9a-f]{64})(?:-\d+w)?\.[a-z0-9]+$')
+# A servable media path: <hash[:2]>/<hash>[-<width>w].<ext>
+MEDIA_PATH_RE = re.compile(r'^([0-9a-f]{2})/(\1[0-9a-f]{62})(?:-(\d+)w)?\.([a-z0-9]+)$')
+# Content-hash URLs never change meaning, so clients may cache them forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Variant formats in order of preference when the client accepts several
+FORMAT_PREFERENCE = ('avif', 'webp', 'jpeg')
+
+
+def original_path(digest, ext):
+    return f'{digest[:2]}/{digest}.{ext}'
+
+
+def variant_path(digest, width, fmt):
+    return f'{digest[:2]}/{digest}-{width}w.{fmt}'
+
+
+def digest_from_url(url):
+    match = DIGEST_RE.search(url or '')
+    return match.group(1) if match else None
+
+
+def sniff(head):
+    """The image format ``head`` (an upload's first SNIFF_SIZE bytes) starts, or None."""
+    for signature, ext in SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def store_stream(stream, root, ext):
+    """
+    Streams ``stream`` to disk under its SHA-256 and returns
+    ``(digest, relative_path, size, created)``. ``created`` is False when an
+    identical file was already stored.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    os.makedirs(root, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=root, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        digest = hasher.hexdigest()
+        relative = original_path(digest, ext)
+        final_path = os.path.join(root, relative)
+        if os.path.exists(final_path):
+            os.unlink(temp_path)
+            return digest, relative, size, False
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        # Atomic: a concurrent identical upload just replaces the same bytes
+        os.replace(temp_path, final_path)
+        return digest, relative, size, True
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def resolve(root, relative, accept_mimetypes):
+    """
+    Picks the file to serve for a media path.
+
+    Variant requests are negotiated against ``Accept``: the same width in the
+    most efficient format the client explicitly lists (AVIF, then WebP, then
+    JPEG) is returned when it exists, otherwise the requested file. Wildcards
+    do not count, since older browsers send ``*/*`` without decoding AVIF.
+    Every stored format is already compressed, so there is no
+    ``Content-Encoding`` to negotiate. Returns ``(relative_path,
+    content_type)`` or None when the path is not a content-addressed media
+    file.
+    """
+    match = MEDIA_PATH_RE.match(relative)
+    if not match:
+        return None
+    digest, width, ext = match.group(2), match.group(3), match.group(4)
+
+    if width is not None:
+        explicit = {value for value, quality in accept_mimetypes if quality > 0}
+        for fmt in FORMAT_PREFERENCE:
+            candidate = variant_path(digest, width, fmt)
+            if CONTENT_TYPES[fmt] in explicit and os.path.isfile(os.path.join(root, candidate)):
+                relative, ext = candidate, fmt
+                break
+
+    if not os.path.isfile(os.path.join(root, relative)):
+        return None
+    return relative, CONTENT_TYPES.get(ext, 'application/octet-stream')
+
+
+def secondary_format():
+    from PIL import features
+    return 'avif' if features.check('avif') else 'jpeg'
+
+
+def generate_variants(root, digest, relative):
+    """
+    Writes the size variants for one stored original and returns the
+    metadata to persist: dimensions, variant list and placeholder data URI.
+    """
+    from PIL import Image, ImageFilter, ImageOps
+
+    with Image.open(os.path.join(root, relative)) as source:
+        image = ImageOps.exif_transpose(source)
+        width, height = image.size
+        has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        formats = ['webp', secondary_format()]
+        if has_alpha and 'jpeg' in formats:
+            formats.remove('jpeg')
+
+        # Never upscale; always emit at least one variant at the original width
+        widths = [w for w in VARIANT_WIDTHS if w < width] + [min(width, VARIANT_WIDTHS[-1])]
+        variants = []
+        for target_width in sorted(set(widths)):
+            resized = image.resize((target_width, max(1, round(height * target_width / width))), Image.LANCZOS)
+            for fmt in formats:
+                path = variant_path(digest, target_width, fmt)
+                resized.save(os.path.join(root, path), format=fmt.upper(), quality=VARIANT_QUALITY[fmt])
+                variants.append({'width': target_width, 'format': fmt, 'path': path})
+
+        tiny = image.convert('RGB').resize(
+            (PLACEHOLDER_WIDTH, max(1, round(height * PLACEHOLDER_WIDTH / width))), Image.BILINEAR
+        ).filter(ImageFilter.GaussianBlur(1))
+        buffer = io.BytesIO()
+        tiny.save(buffer, format='JPEG', quality=40)
+        placeholder = 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    return {'width': width, 'height': height, 'variants': variants, 'placeholder': placeholder}
+
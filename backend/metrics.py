@@ -0,0 +1,263 @@
+"""
+Request and database instrumentation exposed in the Prometheus text format.
+
+``RequestMetrics.init_app`` adds request hooks recording, per route
+template (``/api/properties/<int:property_id>``, never the raw path, so
+label cardinality stays bounded):
+
+    http_requests_total{route,method,status}         counter
+    http_request_duration_seconds{route,method}      histogram
+    http_response_size_bytes{route,method}           histogram (bytes sent)
+    http_requests_in_flight                          gauge
+    db_queries_per_request{route}                    histogram
+    db_query_duration_seconds_total{route}           counter
+    db_repeated_statements_total{route}              counter (N+1 warnings)
+
+Queries are counted with engine cursor events into the state of the
+request running on the current thread or task (a context variable), so
+queries issued outside requests (CLI commands, job workers) cost one
+lookup and are ignored. A request that runs the same statement at least
+``n_plus_one_threshold`` times is logged as a likely N+1 query.
+
+Each response also gets a ``Server-Timing`` header with the time spent in
+the app and in the database. Metrics live in process memory: with several
+worker processes every scrape sees the process that answered it. When
+metrics are disabled nothing is registered, so requests pay nothing.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StatementCounter
+from contextvars import ContextVar
+
+from flask import request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Family:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Family):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f'{self.name}{_labels(self.labelnames, k)} {_number(v)}' for k, v in values]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(_Family):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        with self._lock:
+            values = [(k, list(v)) for k, v in self._values.items()]
+        lines = self.header()
+        for labels, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(state[-2])}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {state[-1]}')
+        return lines
+
+
+class Registry:
+    """Metric families plus gauges read from a callback at scrape time."""
+
+    def __init__(self):
+        self.families = []
+        self.callbacks = []
+
+    def add(self, family):
+        self.families.append(family)
+        return family
+
+    def counter(self, name, help, labelnames=()):
+        return self.add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, fn, kind='gauge'):
+        """Reports ``fn()`` (a number) as ``name`` on every scrape."""
+        self.callbacks.append((name, help, fn, kind))
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+        for name, help, fn, kind in self.callbacks:
+            try:
+                value = fn()
+            except Exception:
+                logger.exception('Metric callback %s failed', name)
+                continue
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name} {_number(value)}']
+        return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'query_time', 'statements')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.statements = StatementCounter()
+
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self, registry=None, n_plus_one_threshold=10, server_timing=True):
+        self.registry = registry or Registry()
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.server_timing = server_timing
+        r = self.registry
+        self.requests = r.counter('http_requests_total', 'HTTP requests answered.', ('route', 'method', 'status'))
+        self.duration = r.histogram('http_request_duration_seconds', 'Time to produce a response.',
+                                    ('route', 'method'))
+        self.size = r.histogram('http_response_size_bytes', 'Response body size as sent.', ('route', 'method'),
+                                SIZE_BUCKETS)
+        self.in_flight = r.gauge('http_requests_in_flight', 'Requests being handled.')
+        self.queries = r.histogram('db_queries_per_request', 'Database statements run per request.', ('route',),
+                                   QUERY_BUCKETS)
+        self.query_time = r.counter('db_query_duration_seconds_total', 'Time spent in database statements.',
+                                    ('route',))
+        self.repeated = r.counter('db_repeated_statements_total',
+                                  'Requests that ran one statement n_plus_one_threshold times or more.', ('route',))
+
+    def init_app(self, app, engines=()):
+        # Registered before other hooks: the request clock starts first and,
+        # as after_request hooks run in reverse, sizes are taken last (compressed)
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+        for engine in engines:
+            self.watch_engine(engine)
+        app.extensions['metrics'] = self
+
+    def watch_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor)
+
+    @staticmethod
+    def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+        stats = _current.get()
+        if stats is None:
+            return
+        started = conn.info.get('metrics_started')
+        if not started:
+            return
+        stats.query_time += time.perf_counter() - started.pop()
+        stats.queries += 1
+        stats.statements[statement] += 1
+
+    def _before(self):
+        _current.set(RequestStats())
+        self.in_flight.inc()
+
+    def _after(self, response):
+        stats = _current.get()
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.started
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        method = request.method
+        self.requests.inc((route, method, str(response.status_code)))
+        self.duration.observe((route, method), elapsed)
+        if response.content_length is not None:
+            self.size.observe((route, method), response.content_length)
+        self.queries.observe((route,), stats.queries)
+        if stats.queries:
+            self.query_time.inc((route,), stats.query_time)
+            statement, count = stats.statements.most_common(1)[0]
+            if count >= self.n_plus_one_threshold:
+                self.repeated.inc((route,))
+                logger.warning('Possible N+1 query: %s %s ran this statement %s times: %s',
+                               method, route, count, ' '.join(statement.split())[:300])
+        if self.server_timing:
+            timing = f'app;dur={elapsed * 1000:.1f}, db;dur={stats.query_time * 1000:.1f};desc="{stats.queries} queries"'
+            existing = response.headers.get('Server-Timing')
+            response.headers['Server-Timing'] = f'{existing}, {timing}' if existing else timing
+        return response
+
+    def _teardown(self, exc):
+        if _current.get() is not None:
+            _current.set(None)
+            self.in_flight.dec()
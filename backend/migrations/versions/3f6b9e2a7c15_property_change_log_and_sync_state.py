@@ -0,0 +1,102 @@
+"""Property change log, sync checkpoints and id links for the Node sync
+
+Revision ID: 3f6b9e2a7c15
+Revises: a71f3c2d9e04
+Create Date: 2026-10-17 20:31:44.120587
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6b9e2a7c15'
+down_revision = 'a71f3c2d9e04'
+branch_labels = None
+depends_on = None
+
+
+LOG = "INSERT INTO property_change(property_id, op) VALUES"
+SQLITE_TRIGGERS = (
+    ('property_change_ai', f"AFTER INSERT ON property BEGIN {LOG} (new.id, 'upsert'); END"),
+    ('property_change_au', f"AFTER UPDATE ON property BEGIN {LOG} (new.id, 'upsert'); END"),
+    ('property_change_ad', f"AFTER DELETE ON property BEGIN {LOG} (old.id, 'delete'); END"),
+    ('property_image_change_ai', f"AFTER INSERT ON property_image BEGIN {LOG} (new.property_id, 'upsert'); END"),
+    ('property_image_change_ad', f"AFTER DELETE ON property_image BEGIN {LOG} (old.property_id, 'upsert'); END"),
+    ('property_amenity_change_ai', f"AFTER INSERT ON property_amenity BEGIN {LOG} (new.property_id, 'upsert'); END"),
+    ('property_amenity_change_ad', f"AFTER DELETE ON property_amenity BEGIN {LOG} (old.property_id, 'upsert'); END"),
+)
+POSTGRES_FUNCTION = """
+CREATE OR REPLACE FUNCTION log_property_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'property' THEN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO property_change(property_id, op, changed_at) VALUES (OLD.id, 'delete', now() AT TIME ZONE 'utc');
+        ELSE
+            INSERT INTO property_change(property_id, op, changed_at) VALUES (NEW.id, 'upsert', now() AT TIME ZONE 'utc');
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO property_change(property_id, op, changed_at) VALUES (OLD.property_id, 'upsert', now() AT TIME ZONE 'utc');
+    ELSE
+        INSERT INTO property_change(property_id, op, changed_at) VALUES (NEW.property_id, 'upsert', now() AT TIME ZONE 'utc');
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql
+"""
+POSTGRES_TRIGGERS = (
+    ('property', 'INSERT OR UPDATE OR DELETE'),
+    ('property_image', 'INSERT OR DELETE'),
+    ('property_amenity', 'INSERT OR DELETE'),
+)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    op.create_table('property_change',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('property_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(length=10), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+    op.create_table('sync_checkpoint',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('property_sync_link',
+    sa.Column('remote', sa.String(length=50), nullable=False),
+    sa.Column('property_id', sa.Integer(), nullable=False),
+    sa.Column('remote_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('remote', 'property_id'),
+    sa.UniqueConstraint('remote', 'remote_id')
+    )
+
+    if dialect == 'sqlite':
+        for name, body in SQLITE_TRIGGERS:
+            op.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+    elif dialect == 'postgresql':
+        op.execute(POSTGRES_FUNCTION)
+        for table_name, events in POSTGRES_TRIGGERS:
+            op.execute(f'CREATE TRIGGER {table_name}_change_log AFTER {events} ON {table_name} '
+                       'FOR EACH ROW EXECUTE FUNCTION log_property_change()')
+
+    # Every existing listing counts as changed, so the first sync sends it all
+    op.execute("INSERT INTO property_change(property_id, op) SELECT id, 'upsert' FROM property ORDER BY id")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for name, _ in reversed(SQLITE_TRIGGERS):
+            op.execute(f'DROP TRIGGER IF EXISTS {name}')
+    elif dialect == 'postgresql':
+        for table_name, _ in POSTGRES_TRIGGERS:
+            op.execute(f'DROP TRIGGER IF EXISTS {table_name}_change_log ON {table_name}')
+        op.execute('DROP FUNCTION IF EXISTS log_property_change()')
+
+    op.drop_table('property_sync_link')
+    op.drop_table('sync_checkpoint')
+    op.drop_table('property_change')
@@ -0,0 +1,91 @@
+"""Property table and composite indexes for listing queries
+
+Revision ID: 4b7e2d9a1c3f
+Revises: c5981d3fa772
+Create Date: 2026-10-17 10:12:40.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e2d9a1c3f'
+down_revision = 'c5981d3fa772'
+branch_labels = None
+depends_on = None
+
+
+PROPERTY_INDEXES = (
+    ('ix_property_available_price', ['is_available', 'price']),
+    ('ix_property_location_bedrooms', ['location', 'bedrooms']),
+    ('ix_property_created_at_id', ['created_at', 'id']),
+)
+# Records the tables (and indexes) this revision created, so a downgrade
+# removes only those and never a table that db.create_all() made
+CREATED = sa.table('migration_created', sa.column('revision'), sa.column('object_name'))
+
+
+def _record_created(names):
+    if not names:
+        return
+    if not sa.inspect(op.get_bind()).has_table('migration_created'):
+        op.create_table('migration_created',
+        sa.Column('revision', sa.String(length=32), nullable=False),
+        sa.Column('object_name', sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint('revision', 'object_name')
+        )
+    op.bulk_insert(CREATED, [{'revision': revision, 'object_name': name} for name in names])
+
+
+def _created_here():
+    bind = op.get_bind()
+    if not sa.inspect(bind).has_table('migration_created'):
+        return set()
+    return set(bind.execute(sa.select(CREATED.c.object_name).where(CREATED.c.revision == revision)).scalars())
+
+
+def upgrade():
+    # Databases bootstrapped with db.create_all() already have the table
+    inspector = sa.inspect(op.get_bind())
+    created = []
+    if not inspector.has_table('property'):
+        created.append('property')
+        op.create_table('property',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=255), nullable=False),
+        sa.Column('description', sa.Text(), nullable=False),
+        sa.Column('price', sa.Float(), nullable=False),
+        sa.Column('location', sa.String(length=255), nullable=False),
+        sa.Column('bedrooms', sa.Integer(), nullable=False),
+        sa.Column('bathrooms', sa.Integer(), nullable=False),
+        sa.Column('area', sa.Float(), nullable=False),
+        sa.Column('images', sa.Text(), nullable=True),
+        sa.Column('amenities', sa.Text(), nullable=True),
+        sa.Column('is_available', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+    existing = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('property')}
+    for name, columns in PROPERTY_INDEXES:
+        if name not in existing:
+            op.create_index(name, 'property', columns, unique=False)
+            created.append(name)
+    _record_created(created)
+
+
+def downgrade():
+    created = _created_here()
+    if 'property' in created:
+        op.drop_table('property')
+    else:
+        for name, _ in reversed(PROPERTY_INDEXES):
+            if name in created:
+                op.drop_index(name, table_name='property')
+    if created:
+        bind = op.get_bind()
+        bind.execute(sa.delete(CREATED).where(CREATED.c.revision == revision))
+        if bind.execute(sa.select(sa.func.count()).select_from(CREATED)).scalar() == 0:
+            op.drop_table('migration_created')
@@ -0,0 +1,39 @@
+"""Content-addressed media assets and their link from property images
+
+Revision ID: 5c8e1f47b2d6
+Revises: e2a8c41d7b59
+Create Date: 2026-10-17 16:22:37.550914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c8e1f47b2d6'
+down_revision = 'e2a8c41d7b59'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('media_asset',
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('path', sa.String(length=255), nullable=False),
+    sa.Column('content_type', sa.String(length=50), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('variants', sa.Text(), nullable=True),
+    sa.Column('placeholder', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('digest')
+    )
+    op.add_column('property_image', sa.Column('asset_digest', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('property_image') as batch_op:
+        batch_op.drop_column('asset_digest')
+    op.drop_table('media_asset')
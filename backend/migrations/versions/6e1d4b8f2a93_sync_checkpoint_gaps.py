@@ -0,0 +1,26 @@
+"""Remember the change log ids a sync checkpoint has stepped over
+
+Revision ID: 6e1d4b8f2a93
+Revises: 8a4d6c2e9f13
+Create Date: 2026-10-18 14:06:52.381940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e1d4b8f2a93'
+down_revision = '8a4d6c2e9f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sync_checkpoint') as batch_op:
+        batch_op.add_column(sa.Column('gaps', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('sync_checkpoint') as batch_op:
+        batch_op.drop_column('gaps')
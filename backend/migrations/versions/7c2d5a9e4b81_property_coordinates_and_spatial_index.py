@@ -0,0 +1,61 @@
+"""Property coordinates and a spatial index over them
+
+Revision ID: 7c2d5a9e4b81
+Revises: 3f6b9e2a7c15
+Create Date: 2026-10-17 22:05:37.448193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2d5a9e4b81'
+down_revision = '3f6b9e2a7c15'
+branch_labels = None
+depends_on = None
+
+
+RTREE_INSERT = ('INSERT INTO property_rtree(id, min_lat, max_lat, min_lng, max_lng) '
+                'SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude '
+                'WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;')
+SQLITE_TRIGGERS = (
+    ('property_rtree_ai', f'AFTER INSERT ON property BEGIN {RTREE_INSERT} END'),
+    ('property_rtree_au', 'AFTER UPDATE OF latitude, longitude ON property BEGIN '
+                          f'DELETE FROM property_rtree WHERE id = old.id; {RTREE_INSERT} END'),
+    ('property_rtree_ad', 'AFTER DELETE ON property BEGIN DELETE FROM property_rtree WHERE id = old.id; END'),
+)
+
+
+def upgrade():
+    with op.batch_alter_table('property') as batch_op:
+        batch_op.add_column(sa.Column('latitude', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('longitude', sa.Float(), nullable=True))
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute('CREATE VIRTUAL TABLE IF NOT EXISTS property_rtree USING rtree(id, min_lat, max_lat, min_lng, max_lng)')
+        for name, body in SQLITE_TRIGGERS:
+            op.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+    elif dialect == 'postgresql':
+        op.execute('CREATE INDEX IF NOT EXISTS ix_property_point ON property USING gist (point(longitude, latitude))')
+    # Existing listings get coordinates from `flask geocode-properties`
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for name, _ in reversed(SQLITE_TRIGGERS):
+            op.execute(f'DROP TRIGGER IF EXISTS {name}')
+        op.execute('DROP TABLE IF EXISTS property_rtree')
+    elif dialect == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_property_point')
+
+    if dialect == 'sqlite':
+        # A batch rebuild of property would drop its search and change-log triggers
+        op.execute('ALTER TABLE property DROP COLUMN longitude')
+        op.execute('ALTER TABLE property DROP COLUMN latitude')
+        return
+    with op.batch_alter_table('property') as batch_op:
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
@@ -0,0 +1,95 @@
+"""Drop the comma-separated property images and amenities columns
+
+Revision ID: 8a4d6c2e9f13
+Revises: f3b9d2a6c8e4
+Create Date: 2026-10-18 11:40:17.902356
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4d6c2e9f13'
+down_revision = 'f3b9d2a6c8e4'
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 500
+
+property_table = sa.table('property', sa.column('id'), sa.column('images'), sa.column('amenities'))
+image_table = sa.table('property_image', sa.column('property_id'), sa.column('position'), sa.column('url'))
+amenity_table = sa.table('amenity', sa.column('id'), sa.column('name'))
+link_table = sa.table('property_amenity', sa.column('property_id'), sa.column('amenity_id'))
+
+
+def _split(value):
+    if not value:
+        return []
+    return list(dict.fromkeys(item.strip() for item in value.split(',') if item.strip()))
+
+
+def _copy_leftovers(bind):
+    """
+    Copies what `flask normalize-properties` has not, the same way: lists the
+    app has written since e2a8c41d7b59 win over the old columns. Run the
+    command first on a large table so this finds nothing and the upgrade
+    only drops columns.
+    """
+    pending = sa.or_(property_table.c.images.isnot(None), property_table.c.amenities.isnot(None))
+    amenity_ids = dict(bind.execute(sa.select(amenity_table.c.name, amenity_table.c.id)).all())
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(property_table.c.id, property_table.c.images, property_table.c.amenities)
+            .where(property_table.c.id > last_id, pending)
+            .order_by(property_table.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        ids = [row.id for row in rows]
+        has_images = set(bind.scalars(sa.select(image_table.c.property_id).where(image_table.c.property_id.in_(ids))))
+        has_amenities = set(bind.scalars(sa.select(link_table.c.property_id).where(link_table.c.property_id.in_(ids))))
+
+        images, links = [], []
+        for row in rows:
+            if row.id not in has_images:
+                images.extend({'property_id': row.id, 'position': i, 'url': url}
+                              for i, url in enumerate(_split(row.images)))
+            if row.id in has_amenities:
+                continue
+            for name in _split(row.amenities):
+                if name not in amenity_ids:
+                    bind.execute(sa.insert(amenity_table).values(name=name))
+                    amenity_ids[name] = bind.scalar(sa.select(amenity_table.c.id).where(amenity_table.c.name == name))
+                links.append({'property_id': row.id, 'amenity_id': amenity_ids[name]})
+        if images:
+            bind.execute(sa.insert(image_table), images)
+        if links:
+            bind.execute(sa.insert(link_table), links)
+
+
+def upgrade():
+    bind = op.get_bind()
+    columns = {column['name'] for column in sa.inspect(bind).get_columns('property')}
+    if not {'images', 'amenities'} <= columns:
+        return  # a database created from the models never had them
+
+    _copy_leftovers(bind)
+
+    if bind.dialect.name == 'sqlite':
+        # A batch rebuild of property would drop its search and change-log triggers
+        op.execute('ALTER TABLE property DROP COLUMN images')
+        op.execute('ALTER TABLE property DROP COLUMN amenities')
+        return
+    op.drop_column('property', 'images')
+    op.drop_column('property', 'amenities')
+
+
+def downgrade():
+    # Empty; e2a8c41d7b59's downgrade fills them from the tables
+    op.add_column('property', sa.Column('images', sa.Text(), nullable=True))
+    op.add_column('property', sa.Column('amenities', sa.Text(), nullable=True))
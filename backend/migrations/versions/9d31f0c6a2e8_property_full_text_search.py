@@ -0,0 +1,53 @@
+"""Full-text search index over property text columns
+
+Revision ID: 9d31f0c6a2e8
+Revises: 4b7e2d9a1c3f
+Create Date: 2026-10-17 11:40:05.912377
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9d31f0c6a2e8'
+down_revision = '4b7e2d9a1c3f'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = 'title, description, location, amenities'
+NEW_COLUMNS = 'new.title, new.description, new.location, new.amenities'
+
+
+def upgrade():
+    # FTS5 is SQLite-only; other backends keep the plain table
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS property_fts USING fts5("
+        f"{COLUMNS}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS property_fts_ai AFTER INSERT ON property BEGIN "
+        f"INSERT INTO property_fts(rowid, {COLUMNS}) VALUES (new.id, {NEW_COLUMNS}); END"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS property_fts_ad AFTER DELETE ON property BEGIN "
+        "DELETE FROM property_fts WHERE rowid = old.id; END"
+    )
+    op.execute(
+        f"CREATE TRIGGER IF NOT EXISTS property_fts_au AFTER UPDATE OF {COLUMNS} ON property BEGIN "
+        f"UPDATE property_fts SET ({COLUMNS}) = ({NEW_COLUMNS}) WHERE rowid = new.id; END"
+    )
+    # Backfill existing listings
+    op.execute('DELETE FROM property_fts')
+    op.execute(f'INSERT INTO property_fts(rowid, {COLUMNS}) SELECT id, {COLUMNS} FROM property')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TRIGGER IF EXISTS property_fts_au')
+    op.execute('DROP TRIGGER IF EXISTS property_fts_ad')
+    op.execute('DROP TRIGGER IF EXISTS property_fts_ai')
+    op.execute('DROP TABLE IF EXISTS property_fts')
@@ -0,0 +1,26 @@
+"""Add a token version to users for access token revocation
+
+Revision ID: a71f3c2d9e04
+Revises: 5c8e1f47b2d6
+Create Date: 2026-10-17 19:12:08.316402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a71f3c2d9e04'
+down_revision = '5c8e1f47b2d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('token_version')
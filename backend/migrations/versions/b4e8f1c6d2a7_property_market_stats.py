@@ -0,0 +1,40 @@
+"""Per-group market statistics for the admin dashboard
+
+Revision ID: b4e8f1c6d2a7
+Revises: 7c2d5a9e4b81
+Create Date: 2026-10-17 23:18:52.604117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e8f1c6d2a7'
+down_revision = '7c2d5a9e4b81'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('property_stats',
+    sa.Column('location', sa.String(length=255), nullable=False),
+    sa.Column('bedrooms', sa.Integer(), nullable=False),
+    sa.Column('property_count', sa.Integer(), nullable=False),
+    sa.Column('available_count', sa.Integer(), nullable=False),
+    sa.Column('price_sum', sa.Float(), nullable=False),
+    sa.Column('price_min', sa.Float(), nullable=True),
+    sa.Column('price_max', sa.Float(), nullable=True),
+    sa.Column('ppa_sum', sa.Float(), nullable=False),
+    sa.Column('ppa_count', sa.Integer(), nullable=False),
+    sa.Column('price_sketch', sa.Text(), nullable=False),
+    sa.Column('ppa_sketch', sa.Text(), nullable=False),
+    sa.PrimaryKeyConstraint('location', 'bedrooms')
+    )
+    # The sketches are built in Python, so the app fills the table: the first
+    # property write rebuilds it while empty, and /api/admin/stats computes
+    # from scratch until then
+
+
+def downgrade():
+    op.drop_table('property_stats')
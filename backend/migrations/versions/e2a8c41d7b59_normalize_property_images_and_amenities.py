@@ -0,0 +1,120 @@
+"""Normalize property images and amenities into their own tables
+
+Revision ID: e2a8c41d7b59
+Revises: 9d31f0c6a2e8
+Create Date: 2026-10-17 14:05:51.204733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a8c41d7b59'
+down_revision = '9d31f0c6a2e8'
+branch_labels = None
+depends_on = None
+
+
+AMENITY_TEXT = (
+    "(SELECT group_concat(a.name, ' ') FROM property_amenity pa "
+    "JOIN amenity a ON a.id = pa.amenity_id WHERE pa.property_id = {})"
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    is_sqlite = bind.dialect.name == 'sqlite'
+
+    op.create_table('amenity',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('property_image',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('property_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('url', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['property_id'], ['property.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_property_image_property_position', 'property_image', ['property_id', 'position'], unique=False)
+    op.create_table('property_amenity',
+    sa.Column('property_id', sa.Integer(), nullable=False),
+    sa.Column('amenity_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['amenity_id'], ['amenity.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['property_id'], ['property.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('property_id', 'amenity_id')
+    )
+    op.create_index('ix_property_amenity_amenity_property', 'property_amenity', ['amenity_id', 'property_id'], unique=False)
+
+    # Existing listings are copied over by `flask normalize-properties`, one
+    # committed batch at a time, while the app already reads the new tables.
+    # The old images/amenities columns stay until 8a4d6c2e9f13 drops them.
+
+    if is_sqlite:
+        # The old FTS triggers read the amenities column, which is no longer written
+        op.execute('DROP TRIGGER IF EXISTS property_fts_ai')
+        op.execute('DROP TRIGGER IF EXISTS property_fts_au')
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS property_fts_au AFTER UPDATE OF title, description, location ON property BEGIN "
+            "UPDATE property_fts SET (title, description, location) = (new.title, new.description, new.location) "
+            "WHERE rowid = new.id; END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS property_amenity_fts_ai AFTER INSERT ON property_amenity BEGIN "
+            f"UPDATE property_fts SET amenities = {AMENITY_TEXT.format('new.property_id')} "
+            "WHERE rowid = new.property_id; END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS property_amenity_fts_ad AFTER DELETE ON property_amenity BEGIN "
+            f"UPDATE property_fts SET amenities = {AMENITY_TEXT.format('old.property_id')} "
+            "WHERE rowid = old.property_id; END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS property_fts_ai AFTER INSERT ON property BEGIN "
+            "INSERT INTO property_fts(rowid, title, description, location) "
+            "VALUES (new.id, new.title, new.description, new.location); END"
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    is_sqlite = bind.dialect.name == 'sqlite'
+
+    # The old columns are still there (8a4d6c2e9f13 puts them back); listings
+    # not copied over yet keep what they hold
+    if is_sqlite:
+        images = ("(SELECT group_concat(url, ',') FROM "
+                  "(SELECT url FROM property_image WHERE property_id = property.id ORDER BY position))")
+        amenities = "group_concat(a.name, ',')"
+    else:
+        images = "(SELECT string_agg(url, ',' ORDER BY position) FROM property_image WHERE property_id = property.id)"
+        amenities = "string_agg(a.name, ',')"
+    op.execute(
+        f"UPDATE property SET images = coalesce({images}, images), "
+        f"amenities = coalesce((SELECT {amenities} FROM property_amenity pa "
+        "JOIN amenity a ON a.id = pa.amenity_id WHERE pa.property_id = property.id), amenities)"
+    )
+
+    if is_sqlite:
+        for trigger in ('property_amenity_fts_ad', 'property_amenity_fts_ai', 'property_fts_au', 'property_fts_ai'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS property_fts_ai AFTER INSERT ON property BEGIN "
+            "INSERT INTO property_fts(rowid, title, description, location, amenities) "
+            "VALUES (new.id, new.title, new.description, new.location, new.amenities); END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS property_fts_au AFTER UPDATE OF title, description, location, amenities "
+            "ON property BEGIN UPDATE property_fts SET (title, description, location, amenities) = "
+            "(new.title, new.description, new.location, new.amenities) WHERE rowid = new.id; END"
+        )
+
+    op.drop_index('ix_property_amenity_amenity_property', table_name='property_amenity')
+    op.drop_table('property_amenity')
+    op.drop_index('ix_property_image_property_position', table_name='property_image')
+    op.drop_table('property_image')
+    op.drop_table('amenity')
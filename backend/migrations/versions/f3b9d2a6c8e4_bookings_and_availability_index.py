@@ -0,0 +1,74 @@
+"""Bookings and an interval index over booked nights
+
+Revision ID: f3b9d2a6c8e4
+Revises: d6f2a8c3e1b5
+Create Date: 2026-10-18 09:12:44.530217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b9d2a6c8e4'
+down_revision = 'd6f2a8c3e1b5'
+branch_labels = None
+depends_on = None
+
+
+BLOCKING = "'pending', 'confirmed', 'completed'"
+RTREE_INSERT = ('INSERT INTO booking_rtree(id, min_property, max_property, min_day, max_day) '
+                'SELECT new.id, new.property_id, new.property_id, CAST(julianday(new.check_in_date) AS INTEGER), '
+                f'CAST(julianday(new.check_out_date) AS INTEGER) - 1 WHERE new.status IN ({BLOCKING});')
+SQLITE_TRIGGERS = (
+    ('booking_rtree_ai', f'AFTER INSERT ON booking BEGIN {RTREE_INSERT} END'),
+    ('booking_rtree_au', 'AFTER UPDATE OF property_id, check_in_date, check_out_date, status ON booking BEGIN '
+                         f'DELETE FROM booking_rtree WHERE id = old.id; {RTREE_INSERT} END'),
+    ('booking_rtree_ad', 'AFTER DELETE ON booking BEGIN DELETE FROM booking_rtree WHERE id = old.id; END'),
+    ('booking_property_ad', 'AFTER DELETE ON property BEGIN DELETE FROM booking WHERE property_id = old.id; END'),
+)
+
+
+def upgrade():
+    op.create_table('booking',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('property_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('guest_name', sa.String(length=100), nullable=False),
+    sa.Column('guest_email', sa.String(length=100), nullable=False),
+    sa.Column('guest_phone', sa.String(length=50), nullable=True),
+    sa.Column('check_in_date', sa.Date(), nullable=False),
+    sa.Column('check_out_date', sa.Date(), nullable=False),
+    sa.Column('guests_count', sa.Integer(), nullable=False),
+    sa.Column('total_price', sa.Float(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('special_requests', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.CheckConstraint('check_out_date > check_in_date', name='ck_booking_dates'),
+    sa.ForeignKeyConstraint(['property_id'], ['property.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_booking_property_check_in', 'booking', ['property_id', 'check_in_date'], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute('CREATE VIRTUAL TABLE IF NOT EXISTS booking_rtree '
+                   'USING rtree_i32(id, min_property, max_property, min_day, max_day)')
+        for name, body in SQLITE_TRIGGERS:
+            op.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+    elif dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        op.execute('ALTER TABLE booking ADD CONSTRAINT booking_no_overlap EXCLUDE USING gist '
+                   '(property_id WITH =, daterange(check_in_date, check_out_date) WITH &&) '
+                   f'WHERE (status IN ({BLOCKING}))')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for name, _ in reversed(SQLITE_TRIGGERS):
+            op.execute(f'DROP TRIGGER IF EXISTS {name}')
+        op.execute('DROP TABLE IF EXISTS booking_rtree')
+    op.drop_index('ix_booking_property_check_in', table_name='booking')
+    op.drop_table('booking')
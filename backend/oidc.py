@@ -0,0 +1,418 @@
+"""
+Google sign-in (OpenID Connect) that a slow identity provider cannot stall.
+
+Every outbound call goes through one ``HTTPClient`` per process: a pooled
+``requests`` session, so the TLS connection to the provider is kept alive
+and reused between sign-ins, with strict connect and read timeouts and a
+``CircuitBreaker``. After ``failure_threshold`` consecutive timeouts,
+connection errors or 5xx/429 answers the breaker opens and calls fail at once
+with ``ProviderUnavailable`` for ``reset_seconds``; then a single trial call
+decides whether it closes again. A request thread waits on the provider for
+at most the timeouts, and not at all while it is known to be down.
+
+The discovery document and the signing keys (JWKS) are cached for the
+``Cache-Control: max-age`` the provider sends (``ttl`` when it sends none)
+and refreshed by a background thread once ``REFRESH_AT`` of that lifetime
+has passed, so sign-ins keep using the cached copy meanwhile; a copy is
+still served up to ``max_stale`` seconds after it expired if refreshing
+fails. An ID token signed with a key not in the cache reloads the keys
+inline, at most once per ``retry_seconds``, which picks up key rotation.
+
+The callback then makes one outbound call, the authorization code exchange,
+and verifies the ID token it returns locally (signature, issuer, audience,
+expiry and nonce) instead of asking the provider's userinfo endpoint.
+
+``requests`` is imported on first use: most processes never serve a
+sign-in. RS256 signatures need the ``cryptography`` package (the ``oauth``
+extra).
+"""
+import hmac
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlencode
+
+import jwt
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_DISCOVERY_URL = 'https://accounts.google.com/.well-known/openid-configuration'
+SCOPE = 'openid email profile'
+ALGORITHMS = ('RS256',)
+REQUIRED_CLAIMS = ('iss', 'sub', 'aud', 'exp', 'iat')
+# Fraction of a cached document's lifetime after which it is refreshed in the background
+REFRESH_AT = 0.75
+# Lower bound on how long a document is kept, whatever max-age says
+MIN_TTL = 60
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class ProviderError(Exception):
+    """The identity provider timed out, failed or sent something unusable."""
+
+
+class ProviderUnavailable(ProviderError):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+
+class SignInRejected(Exception):
+    """The sign-in response did not check out: bad state, code or ID token."""
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of calls to one service. ``before_call``
+    raises ``ProviderUnavailable`` while open, and once ``reset_seconds``
+    have passed lets exactly one trial call through (half-open): its
+    success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self.rejected = 0
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        return 'half_open' if self._trial else 'open'
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if not self._trial and self._clock() - self._opened_at >= self.reset_seconds:
+                self._trial = True
+                return
+            self.rejected += 1
+        raise ProviderUnavailable('The identity provider is unavailable; not calling it for now')
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial:
+                    logger.warning('Identity provider failing; circuit opened for %ss', self.reset_seconds)
+                self._opened_at = self._clock()
+                self._trial = False
+
+    def release_trial(self):
+        """Ends a trial call that neither succeeded nor failed, so another may start."""
+        with self._lock:
+            self._trial = False
+
+
+class HTTPClient:
+    """A keep-alive connection pool with fixed timeouts, guarded by a circuit breaker."""
+
+    def __init__(self, connect_timeout=3.05, read_timeout=5, pool_size=10, breaker=None):
+        self.connect_timeout = connect_timeout
+        # Bounds each wait for data from the server, not the whole response
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    # No retries: a retry would double the time a request thread waits
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.headers['Accept'] = 'application/json'
+                    self._session = session
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        """
+        The response, for any status below 500 other than 429; raises
+        ProviderError on timeouts, connection errors and the rest, and
+        ProviderUnavailable while the breaker is open.
+        """
+        import requests
+        self.breaker.before_call()
+        recorded = False
+        try:
+            try:
+                response = self.session.request(method, url, timeout=(self.connect_timeout, self.read_timeout),
+                                                **kwargs)
+            except requests.RequestException as e:
+                recorded = True
+                self.breaker.record_failure()
+                raise ProviderError(f'{method} {url} failed: {e}') from e
+            recorded = True
+            if response.status_code >= 500 or response.status_code == 429:
+                self.breaker.record_failure()
+                raise ProviderError(f'{method} {url} answered {response.status_code}')
+            self.breaker.record_success()
+            return response
+        finally:
+            if not recorded:
+                # Anything else (a bug, an interrupt) says nothing about the
+                # provider, but must not leave a half-open breaker stuck on
+                # a trial that never reports back
+                self.breaker.release_trial()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def after_fork(self):
+        """Forgets the parent's pooled connections without closing their sockets."""
+        self._session = None
+        self._lock = threading.Lock()
+
+
+def max_age(response, default):
+    match = _MAX_AGE_RE.search(response.headers.get('Cache-Control', ''))
+    return max(int(match.group(1)) if match else default, MIN_TTL)
+
+
+class CachedDocument:
+    """
+    A value produced by ``load()``, which returns ``(value, lifetime)``; see
+    the module docstring for when it is refreshed. Loads never overlap, and
+    callers that find it missing or expired share one load.
+    """
+
+    def __init__(self, load, name, max_stale=3600, retry_seconds=60):
+        self._load = load
+        self.name = name
+        self.max_stale = max_stale
+        self.retry_seconds = retry_seconds
+        self._entry = None  # (value, fetched, expires)
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self._last_attempt = float('-inf')
+        self._last_forced = float('-inf')
+        self.loads = 0
+
+    def get(self):
+        entry, now = self._entry, time.monotonic()
+        if entry is None or now >= entry[2] + self.max_stale:
+            return self.reload()
+        value, fetched, expires = entry
+        if now >= fetched + (expires - fetched) * REFRESH_AT:
+            self._refresh_in_background(now)
+        return value
+
+    def reload(self, min_interval=0.0):
+        """
+        Loads the value inline and returns it, unless a load that finished
+        less than ``min_interval`` seconds ago, or after this call started
+        waiting, already did.
+        """
+        requested = time.monotonic()
+        with self._load_lock:
+            entry = self._entry
+            if entry is not None and entry[1] >= requested - min_interval:
+                return entry[0]
+            value, lifetime = self._load()
+            fetched = time.monotonic()
+            self._entry = (value, fetched, fetched + lifetime)
+            self.loads += 1
+            return value
+
+    def force_reload(self):
+        """
+        Reloads the value inline, at most once per ``retry_seconds``; calls
+        in between wait for a load in progress and return the value as is.
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = now - self._last_forced >= self.retry_seconds
+            if due:
+                self._last_forced = now
+        return self.reload() if due else self.reload(min_interval=self.retry_seconds)
+
+    def prefetch(self):
+        """Starts loading the value in the background if it was never loaded."""
+        if self._entry is None:
+            self._refresh_in_background(time.monotonic())
+
+    def _refresh_in_background(self, now):
+        with self._lock:
+            if self._refreshing or now - self._last_attempt < self.retry_seconds:
+                return
+            self._refreshing = True
+            self._last_attempt = now
+        threading.Thread(target=self._refresh, name=f'{self.name}-refresh', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.reload()
+        except Exception:
+            logger.warning('Refreshing the %s failed; keeping the cached copy', self.name, exc_info=True)
+        finally:
+            self._refreshing = False
+
+    def clear(self):
+        self._entry = None
+
+
+def _issuers(issuer):
+    # Google's ID tokens may name the issuer with or without the scheme
+    return {issuer, issuer[len('https://'):]} if issuer.startswith('https://') else {issuer}
+
+
+class Provider:
+    """
+    An OpenID Connect provider found through its discovery document, used
+    for the authorization code flow. Created unconfigured at import time;
+    ``configure`` applies the app's settings and starts with empty caches.
+    """
+
+    def __init__(self, discovery_url=GOOGLE_DISCOVERY_URL):
+        self.discovery_url = discovery_url
+        self.client_id = None
+        self.client_secret = None
+        self.connect_timeout = 3.05
+        self.read_timeout = 5
+        self.pool_size = 10
+        self.failure_threshold = 5
+        self.reset_seconds = 30
+        self.ttl = 3600
+        self.leeway = 60
+        self._setup()
+
+    def configure(self, discovery_url=None, client_id=None, client_secret=None, connect_timeout=None,
+                  read_timeout=None, pool_size=None, failure_threshold=None, reset_seconds=None, ttl=None,
+                  leeway=None):
+        """Applies new settings; the connection pool, breaker and caches start afresh."""
+        for name, value in (('discovery_url', discovery_url), ('client_id', client_id),
+                            ('client_secret', client_secret), ('connect_timeout', connect_timeout),
+                            ('read_timeout', read_timeout), ('pool_size', pool_size),
+                            ('failure_threshold', failure_threshold), ('reset_seconds', reset_seconds),
+                            ('ttl', ttl), ('leeway', leeway)):
+            if value is not None:
+                setattr(self, name, value)
+        self.http.close()
+        self._setup()
+
+    def _setup(self):
+        self.breaker = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+        self.http = HTTPClient(self.connect_timeout, self.read_timeout, self.pool_size, self.breaker)
+        self.metadata = CachedDocument(self._load_metadata, 'OpenID discovery document', max_stale=self.ttl)
+        self.jwks = CachedDocument(self._load_jwks, 'OpenID signing keys', max_stale=self.ttl)
+
+    def after_fork(self):
+        """Drops connections and locks inherited from the parent; the caches are rebuilt on use."""
+        self.http.after_fork()
+        self._setup()
+
+    # --- Provider documents ---
+
+    def _get_json(self, url, what):
+        response = self.http.request('GET', url)
+        if response.status_code != 200:
+            raise ProviderError(f'Fetching the {what} answered {response.status_code}')
+        try:
+            return response.json(), response
+        except ValueError:
+            raise ProviderError(f'The {what} is not JSON')
+
+    def _load_metadata(self):
+        document, response = self._get_json(self.discovery_url, 'discovery document')
+        missing = [key for key in ('issuer', 'authorization_endpoint', 'token_endpoint', 'jwks_uri')
+                   if not document.get(key)]
+        if missing:
+            raise ProviderError(f"The discovery document lacks {', '.join(missing)}")
+        return document, max_age(response, self.ttl)
+
+    def _load_jwks(self):
+        document, response = self._get_json(self.metadata.get()['jwks_uri'], 'signing keys')
+        keys = {}
+        for data in document.get('keys', ()):
+            if data.get('use', 'sig') != 'sig' or not data.get('kid'):
+                continue
+            try:
+                keys[data['kid']] = jwt.PyJWK(data)
+            except jwt.PyJWTError:
+                # A key type or algorithm this process cannot verify
+                continue
+        if not keys:
+            raise ProviderError('The provider published no usable signing keys')
+        return keys, max_age(response, self.ttl)
+
+    # --- Authorization code flow ---
+
+    def authorization_url(self, redirect_uri, state, nonce, scope=SCOPE):
+        endpoint = self.metadata.get()['authorization_endpoint']
+        query = urlencode({'response_type': 'code', 'client_id': self.client_id, 'redirect_uri': redirect_uri,
+                           'scope': scope, 'state': state, 'nonce': nonce})
+        # Have the signing keys cached by the time the user comes back
+        self.jwks.prefetch()
+        return f"{endpoint}{'&' if '?' in endpoint else '?'}{query}"
+
+    def exchange_code(self, code, redirect_uri):
+        """The token response for an authorization code."""
+        if not code:
+            raise SignInRejected('The callback has no authorization code')
+        response = self.http.request('POST', self.metadata.get()['token_endpoint'], data={
+            'grant_type': 'authorization_code', 'code': code, 'redirect_uri': redirect_uri,
+            'client_id': self.client_id, 'client_secret': self.client_secret,
+        })
+        try:
+            tokens = response.json()
+        except ValueError:
+            raise ProviderError(f'The token endpoint answered {response.status_code} without JSON')
+        if response.status_code != 200:
+            raise SignInRejected(f"The token endpoint refused the code: {tokens.get('error', response.status_code)}")
+        return tokens
+
+    def _signing_key(self, kid):
+        keys = self.jwks.get()
+        if kid not in keys:
+            # Possibly a key the provider rotated in since the last load
+            keys = self.jwks.force_reload()
+        if kid not in keys:
+            raise SignInRejected(f'The ID token is signed with an unknown key {kid!r}')
+        return keys[kid]
+
+    def verify_id_token(self, id_token, nonce):
+        """The claims of an ID token, checked locally against the cached signing keys."""
+        if not id_token:
+            raise SignInRejected('The token response has no ID token')
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except jwt.PyJWTError as e:
+            raise SignInRejected(f'Malformed ID token: {e}')
+        if header.get('alg') not in ALGORITHMS:
+            raise SignInRejected(f"Unexpected ID token algorithm {header.get('alg')!r}")
+        key = self._signing_key(header.get('kid'))
+        try:
+            claims = jwt.decode(id_token, key.key, algorithms=[header['alg']], audience=self.client_id,
+                                leeway=self.leeway, options={'require': list(REQUIRED_CLAIMS)})
+        except jwt.PyJWTError as e:
+            raise SignInRejected(f'Invalid ID token: {e}')
+        if claims['iss'] not in _issuers(self.metadata.get()['issuer']):
+            raise SignInRejected('The ID token is from another issuer')
+        if isinstance(claims['aud'], list) and len(claims['aud']) > 1 and claims.get('azp') != self.client_id:
+            raise SignInRejected('The ID token was issued to another client')
+        if not nonce or not hmac.compare_digest(str(claims.get('nonce', '')), nonce):
+            raise SignInRejected('The ID token nonce does not match the sign-in')
+        if not claims.get('email') or claims.get('email_verified') not in (True, 'true'):
+            raise SignInRejected('The account has no verified email address')
+        return claims
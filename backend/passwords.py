@@ -0,0 +1,237 @@
+"""
+Bcrypt hashing on a bounded process pool.
+
+Each bcrypt call costs tens to hundreds of milliseconds of pure CPU. Running
+them on a separate pool of processes keeps that work off the web workers,
+caps how many run at once, and lets a login burst be turned away early
+(``PasswordHasherBusy``) instead of queueing without bound.
+
+Successful verifications are remembered for a short time, keyed by an HMAC
+of the stored hash and the password under a per-process random key, so a
+client logging in again within the TTL skips bcrypt entirely. Failed attempts
+are never cached and always pay the full cost. Changing the password changes
+the stored hash, which invalidates the entry.
+
+The pool uses the ``spawn`` start method and is created on first use, so it
+is safe to construct before a preforking server forks its workers
+(``after_fork`` forgets a pool the parent already started). Spawned
+workers re-import the ``__main__`` module, so scripts that hash passwords must
+keep their side effects under ``if __name__ == '__main__'``. With
+``workers=0`` hashing runs inline, which is what tests and the CLI use.
+"""
+import hashlib
+import hmac
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+# bcrypt only looks at the first 72 bytes; older bcrypt releases truncated
+# silently and newer ones raise, so truncate explicitly to keep existing
+# hashes verifiable.
+MAX_PASSWORD_BYTES = 72
+_COST_RE = re.compile(r'^\$2[abxy]?\$(\d{2})\$')
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Raised when the hashing queue is full or stalled; callers should answer 503."""
+
+
+def _encode(password):
+    return password.encode('utf-8')[:MAX_PASSWORD_BYTES]
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def check_password(password, password_hash):
+    try:
+        return bcrypt.checkpw(_encode(password), password_hash.encode('utf-8'))
+    except ValueError:
+        # Malformed stored hash
+        return False
+
+
+def hash_cost(password_hash):
+    match = _COST_RE.match(password_hash or '')
+    return int(match.group(1)) if match else None
+
+
+class PasswordHasher:
+    """Runs bcrypt on a process pool with a bounded queue and basic metrics."""
+
+    def __init__(self, rounds=12, workers=0, max_pending=None, timeout=10.0,
+                 verified_ttl=60, verified_maxsize=4096):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending if max_pending is not None else max(1, workers) * 8
+        self.timeout = timeout
+        self.verified_ttl = verified_ttl
+        self.verified_maxsize = verified_maxsize
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._verified = OrderedDict()
+        self._verified_key = os.urandom(32)
+        self.completed = 0
+        self.rejected = 0
+        self.fast_path_hits = 0
+        self.busy_seconds = 0.0
+        self.max_pending_seen = 0
+
+    def configure(self, rounds=None, workers=None, max_pending=None, timeout=None, verified_ttl=None):
+        """Applies new settings; an existing pool is replaced on next use."""
+        if rounds is not None:
+            self.rounds = rounds
+        if workers is not None and workers != self.workers:
+            self.shutdown()
+            self.workers = workers
+        if max_pending is not None:
+            self.max_pending = max_pending
+        elif workers is not None:
+            self.max_pending = max(1, self.workers) * 8
+        if timeout is not None:
+            self.timeout = timeout
+        if verified_ttl is not None:
+            self.verified_ttl = verified_ttl
+            self.clear_verified()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordHasherBusy('Too many password operations in flight')
+            self._pending += 1
+            self.max_pending_seen = max(self.max_pending_seen, self._pending)
+        started = time.perf_counter()
+        if self.workers <= 0:
+            try:
+                return fn(*args)
+            finally:
+                self._release(started)
+
+        pool = self._pool()
+        try:
+            future = pool.submit(fn, *args)
+        except RuntimeError:
+            # Broken, or shut down by a thread that found it broken (BrokenProcessPool is a RuntimeError)
+            self._release(started)
+            self._discard(pool)
+            raise PasswordHasherBusy('Password worker pool restarted')
+        except BaseException:
+            self._release(started)
+            raise
+        # The slot is freed when the work is, not when the caller stops waiting
+        future.add_done_callback(lambda _: self._release(started))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Dropped if still queued; a call already running keeps its slot until it ends
+            future.cancel()
+            raise PasswordHasherBusy('Password operation timed out')
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool next time
+            self._discard(pool)
+            raise PasswordHasherBusy('Password worker pool restarted')
+
+    def _release(self, started):
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+            self.busy_seconds += time.perf_counter() - started
+
+    def _discard(self, pool):
+        with self._lock:
+            if self._executor is pool:
+                self._executor = None
+        # Outside the lock: cancelling queued calls runs their _release callbacks
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.rounds)
+
+    def check(self, password, password_hash):
+        if not password_hash or password is None:
+            return False
+        key = self._verified_digest(password, password_hash)
+        if self._recently_verified(key):
+            return True
+        ok = self._run(check_password, password, password_hash)
+        if ok and self.verified_ttl > 0:
+            with self._lock:
+                self._verified[key] = time.monotonic() + self.verified_ttl
+                self._verified.move_to_end(key)
+                while len(self._verified) > self.verified_maxsize:
+                    self._verified.popitem(last=False)
+        return ok
+
+    def _verified_digest(self, password, password_hash):
+        message = password_hash.encode('utf-8') + b'\0' + _encode(password)
+        return hmac.new(self._verified_key, message, hashlib.sha256).digest()
+
+    def _recently_verified(self, key):
+        if self.verified_ttl <= 0:
+            return False
+        with self._lock:
+            expires = self._verified.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._verified[key]
+                return False
+            self._verified.move_to_end(key)
+            self.fast_path_hits += 1
+            return True
+
+    def clear_verified(self):
+        with self._lock:
+            self._verified.clear()
+
+    def needs_rehash(self, password_hash):
+        return hash_cost(password_hash) != self.rounds
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'rounds': self.rounds,
+                'queue_depth': self._pending,
+                'max_queue_depth': self.max_pending_seen,
+                'queue_limit': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'fast_path_hits': self.fast_path_hits,
+                'avg_latency_ms': (self.busy_seconds / self.completed * 1000) if self.completed else 0.0,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def after_fork(self):
+        """
+        Drops state inherited by a forked child: a pool started in the parent
+        belongs to it, and a lock held by another parent thread would never
+        be released. The child starts its own pool on first use.
+        """
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
@@ -0,0 +1,372 @@
+"""
+Per-client rate limiting and adaptive load shedding.
+
+Rate limits are token buckets of ``count`` tokens refilled over ``period``
+seconds, stored as a single timestamp per key (GCRA: the "theoretical
+arrival time" of the next request). A hit is one read-modify-write of that
+timestamp, so buckets cost no background refill and almost no memory.
+Buckets are keyed by client IP, by user id (falling back to the IP for
+anonymous requests) or by route, where every client shares one bucket.
+
+Allowed responses carry ``RateLimit-Limit``, ``RateLimit-Remaining``,
+``RateLimit-Reset`` and ``RateLimit-Policy`` headers; rejected ones are a
+429 with ``Retry-After``.
+
+Backends:
+    MemoryBuckets  in-process; each worker process enforces its own share
+    RedisBuckets   shared across processes; takes any client exposing
+                   redis-py's register_script, so tests can pass a local
+                   stand-in
+
+``LoadShedder`` answers 503 before a request is handled when the process
+is overloaded: when more requests are in flight than an adaptive limit
+allows, or when a request already waited longer than ``max_queue_ms`` in
+front of the app (from the proxy's ``X-Request-Start`` header). The limit
+backs off multiplicatively while p99 latency exceeds its target and
+recovers additively once it is back under, so latency stays bounded
+instead of climbing with the backlog.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from functools import lru_cache, wraps
+
+from flask import current_app, g, jsonify, make_response, request
+
+logger = logging.getLogger(__name__)
+
+UNITS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+KEYS = ('ip', 'user', 'route')
+
+
+class Limit(namedtuple('Limit', 'count period')):
+    """``count`` requests per ``period`` seconds, with bursts of up to ``count``."""
+
+    @classmethod
+    def parse(cls, value):
+        """``"10/minute"``, ``"100/hour"`` or ``"5/30s"``; empty or ``"none"`` -> None."""
+        value = (value or '').strip().lower()
+        if value in ('', 'none', '0'):
+            return None
+        count, _, per = value.partition('/')
+        per = per.strip() or 'second'
+        if per.endswith('s') and per[:-1].isdigit():
+            period = int(per[:-1])
+        else:
+            period = UNITS.get(per.rstrip('s'))
+        if not count.strip().isdigit() or not period or int(count) <= 0:
+            raise ValueError(f'Invalid rate limit: {value!r}')
+        return cls(int(count), period)
+
+    @property
+    def interval(self):
+        return self.period / self.count
+
+    def __str__(self):
+        return f'{self.count};w={self.period}'
+
+
+@lru_cache(maxsize=64)
+def _parse_cached(value):
+    return Limit.parse(value)
+
+
+def _coerce(value):
+    return value if isinstance(value, Limit) or value is None else _parse_cached(value)
+
+
+Decision = namedtuple('Decision', 'allowed limit remaining reset retry_after')
+
+
+def decide(limit, backlog):
+    """
+    The outcome of one hit on a bucket whose next free slot is ``backlog``
+    seconds away (0 for a full bucket).
+    """
+    after = backlog + limit.interval
+    if after <= limit.period + 1e-9:
+        remaining = int((limit.period - after) / limit.interval + 1e-9)
+        return Decision(True, limit, remaining, after, 0.0)
+    return Decision(False, limit, 0, backlog, after - limit.period)
+
+
+class MemoryBuckets:
+    """Thread-safe buckets in an LRU of at most ``maxsize`` keys."""
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit):
+        now = time.monotonic()
+        with self._lock:
+            backlog = max(self._tats.get(key, now) - now, 0.0)
+            decision = decide(limit, backlog)
+            if decision.allowed:
+                self._tats[key] = now + backlog + limit.interval
+                self._tats.move_to_end(key)
+                # An evicted key only loses its backlog, i.e. gets a full bucket
+                while len(self._tats) > self.maxsize:
+                    self._tats.popitem(last=False)
+        return decision
+
+    def __len__(self):
+        return len(self._tats)
+
+
+# Atomic GCRA step on the Redis server, timed by the server's clock so app
+# servers with skewed clocks agree. Returns whether the hit was allowed and
+# the backlog before it; floats are returned as strings to survive the
+# Lua -> Redis integer conversion.
+GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+local backlog = math.max(tat - now, 0)
+if backlog + interval > period + 1e-9 then
+    return {0, tostring(backlog)}
+end
+redis.call('SET', KEYS[1], tostring(now + backlog + interval), 'PX', math.ceil((backlog + interval) * 1000))
+return {1, tostring(backlog)}
+"""
+
+
+class RedisBuckets:
+    """Buckets stored in Redis (or anything running the same Lua script)."""
+
+    def __init__(self, client, prefix='kintech:ratelimit'):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(GCRA_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis  # Optional dependency, only needed for the shared backend
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def hit(self, key, limit):
+        _, backlog = self._script(keys=[f'{self.prefix}:{key}'], args=[limit.interval, limit.period])
+        return decide(limit, float(backlog))
+
+
+def make_backend(config):
+    """Builds the backend selected by RATELIMIT_BACKEND ('memory' or 'redis')."""
+    kind = config.get('RATELIMIT_BACKEND', 'memory')
+    if kind == 'redis':
+        return RedisBuckets.from_url(config['RATELIMIT_URL'])
+    if kind == 'memory':
+        return MemoryBuckets(maxsize=int(config.get('RATELIMIT_MAXSIZE', 100_000)))
+    raise ValueError(f'Unknown RATELIMIT_BACKEND: {kind}')
+
+
+class RateLimiter:
+    """
+    ``@rate_limiter.limit(...)`` view decorator. ``identify_user`` returns the
+    authenticated user's id for the current request, or None.
+    """
+
+    def __init__(self, backend=None, identify_user=None, enabled=True):
+        self.backend = backend
+        self.identify_user = identify_user
+        self.enabled = enabled
+
+    def key_for(self, key, scope):
+        if key == 'route':
+            return scope
+        if key == 'user' and self.identify_user is not None:
+            user_id = self.identify_user()
+            if user_id is not None:
+                return f'{scope}:user:{user_id}'
+        return f'{scope}:ip:{request.remote_addr}'
+
+    def check(self, limit, key, scope):
+        try:
+            return self.backend.hit(self.key_for(key, scope), limit)
+        except Exception:
+            # A shared backend outage must not take the API down with it
+            logger.exception('Rate limit backend failed; allowing request')
+            return None
+
+    def limit(self, value, key='ip', scope=None):
+        """
+        Limits the decorated view to ``value`` (see ``Limit.parse``) per
+        ``key``; views sharing a ``scope`` share their buckets. ``value`` may
+        also be a function returning the limit, called on each request, so
+        limits can come from the config of the app serving it.
+        """
+        if key not in KEYS:
+            raise ValueError(f'Unknown rate limit key: {key}')
+        if not callable(value):
+            limit = _coerce(value)
+            value = lambda: limit
+
+        def decorator(view):
+            bucket_scope = scope or view.__name__
+
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or self.backend is None:
+                    return view(*args, **kwargs)
+                limit = _coerce(value())
+                if limit is None:
+                    return view(*args, **kwargs)
+                decision = self.check(limit, key, bucket_scope)
+                if decision is None:
+                    return view(*args, **kwargs)
+                if not decision.allowed:
+                    response = jsonify({'error': 'Too many requests, please slow down'})
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(math.ceil(decision.retry_after))
+                else:
+                    response = make_response(view(*args, **kwargs))
+                set_headers(response, decision)
+                return response
+            return wrapper
+        return decorator
+
+
+def set_headers(response, decision):
+    response.headers['RateLimit-Limit'] = str(decision.limit.count)
+    response.headers['RateLimit-Remaining'] = str(decision.remaining)
+    response.headers['RateLimit-Reset'] = str(math.ceil(decision.reset))
+    response.headers['RateLimit-Policy'] = str(decision.limit)
+
+
+def request_queue_ms(header, now=None):
+    """
+    Milliseconds since the proxy received the request, from ``X-Request-Start``
+    (``t=`` followed by seconds, milliseconds or microseconds since the epoch).
+    """
+    if not header:
+        return None
+    value = header.strip()
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+    # Tell the unit apart by magnitude
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max(((now or time.time()) - started) * 1000, 0.0)
+
+
+class LoadShedder:
+    """
+    Rejects requests with 503 while the process is overloaded. The in-flight
+    limit moves between ``min_in_flight`` and ``max_in_flight`` every
+    ``window`` seconds depending on the window's p99 latency.
+    """
+
+    def __init__(self, max_in_flight=64, target_p99_ms=1000, max_queue_ms=0, window=1.0, min_in_flight=1,
+                 backoff=0.9, max_samples=4096):
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min(min_in_flight, max_in_flight)
+        self.target_p99_ms = target_p99_ms
+        self.max_queue_ms = max_queue_ms
+        self.window = window
+        self.backoff = backoff
+        self.in_flight_limit = max_in_flight
+        self.in_flight = 0
+        self.shed = 0
+        self.last_p99_ms = None
+        self._samples = deque(maxlen=max_samples)
+        self._window_started = time.monotonic()
+        self._lock = threading.Lock()
+        self.exempt = set()
+
+    def configure(self, max_in_flight=None, target_p99_ms=None, max_queue_ms=None):
+        """Applies new settings; the adaptive limit restarts from ``max_in_flight``."""
+        with self._lock:
+            if max_in_flight is not None:
+                self.max_in_flight = self.in_flight_limit = max_in_flight
+                self.min_in_flight = min(self.min_in_flight, max_in_flight)
+            if target_p99_ms is not None:
+                self.target_p99_ms = target_p99_ms
+            if max_queue_ms is not None:
+                self.max_queue_ms = max_queue_ms
+
+    def init_app(self, app):
+        app.before_request(self._before)
+        app.teardown_request(self._teardown)
+        app.extensions['load_shedder'] = self
+
+    def exempt_view(self, view):
+        """Decorator for views that must answer under load (health checks, metrics)."""
+        self.exempt.add(view)
+        return view
+
+    def _reject(self, reason):
+        self.shed += 1
+        response = jsonify({'error': 'Server is busy, please retry'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        logger.info('Shedding %s %s: %s', request.method, request.path, reason)
+        return response
+
+    def _before(self):
+        if current_app.view_functions.get(request.endpoint) in self.exempt:
+            return None
+        if self.max_queue_ms:
+            queued = request_queue_ms(request.headers.get('X-Request-Start'))
+            if queued is not None and queued > self.max_queue_ms:
+                return self._reject(f'queued {queued:.0f} ms')
+        with self._lock:
+            if self.in_flight >= self.in_flight_limit:
+                in_flight = self.in_flight
+                rejected = True
+            else:
+                self.in_flight += 1
+                rejected = False
+        if rejected:
+            return self._reject(f'{in_flight} requests in flight')
+        g.load_shedder_started = time.perf_counter()
+        return None
+
+    def _teardown(self, exc):
+        started = g.pop('load_shedder_started', None)
+        if started is None:
+            return
+        self.record(time.perf_counter() - started)
+
+    def record(self, elapsed):
+        """Ends one admitted request that took ``elapsed`` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            self._samples.append(elapsed)
+            if now - self._window_started >= self.window:
+                self._adjust()
+                self._window_started = now
+
+    def _adjust(self):
+        samples = sorted(self._samples)
+        self._samples.clear()
+        p99_ms = samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+        self.last_p99_ms = p99_ms
+        if p99_ms > self.target_p99_ms:
+            limit = max(self.min_in_flight, int(self.in_flight_limit * self.backoff))
+        else:
+            limit = min(self.max_in_flight, self.in_flight_limit + 1)
+        if limit != self.in_flight_limit:
+            logger.info('Load shedder in-flight limit %s -> %s (p99 %.0f ms)', self.in_flight_limit, limit, p99_ms)
+        self.in_flight_limit = limit
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self.in_flight,
+                'in_flight_limit': self.in_flight_limit,
+                'max_in_flight': self.max_in_flight,
+                'last_p99_ms': self.last_p99_ms,
+                'target_p99_ms': self.target_p99_ms,
+                'shed': self.shed,
+            }
@@ -0,0 +1,169 @@
+"""
+Read replica routing for the Flask-SQLAlchemy session.
+
+Views decorated with ``read_replica`` run their queries on a replica engine;
+everything else, including any flush, stays on the primary. A replica is
+chosen once per request, round-robin or by fewest checked-out connections,
+and is checked by taking a connection from its pool. A replica that cannot
+be reached is skipped for ``retry_seconds`` and the request falls back to the
+next replica or to the primary.
+
+Read-your-writes: a request that commits changes sets a short-lived cookie,
+and requests carrying it read from the primary until it expires, so an admin
+never sees a listing from before their own edit because of replication lag.
+Every process also reads from the primary for the same window after a write
+anywhere: its own commits through ``last_write``, and those of other
+processes through ``last_shared_write`` (the response cache's invalidation
+time, shared with the Redis backend). A response cached under the
+generation a write has just started is therefore never built from a replica
+that has not caught up with it.
+
+Locally, replicas can be plain copies of the SQLite database file listed in
+``DB_REPLICA_URIS``.
+"""
+import itertools
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+
+STRATEGIES = ('round_robin', 'least_busy')
+STICKY_COOKIE = 'db_primary_until'
+EXTENSION_KEY = 'replica_router'
+
+
+class ReplicaRouter:
+    """Chooses the engine for read-only requests."""
+
+    def __init__(self, replicas, strategy='round_robin', sticky_seconds=5, retry_seconds=30,
+                 last_shared_write=None):
+        if strategy not in STRATEGIES:
+            raise ValueError(f'Unknown replica strategy: {strategy}')
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self.sticky_seconds = sticky_seconds
+        self.retry_seconds = retry_seconds
+        self.last_write = float('-inf')
+        # Callable returning the time.time() of the last write seen by any process, or None
+        self.last_shared_write = last_shared_write
+        self._counter = itertools.count()
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self._lock:
+            healthy = [e for e in self.replicas if self._down_until.get(e, 0) <= now]
+        if self.strategy == 'least_busy':
+            # Pools without a checkout count (e.g. SingletonThreadPool) rank as idle
+            return sorted(healthy, key=lambda e: getattr(e.pool, 'checkedout', lambda: 0)())
+        if not healthy:
+            return []
+        start = next(self._counter) % len(healthy)
+        return healthy[start:] + healthy[:start]
+
+    def mark_down(self, engine):
+        with self._lock:
+            self._down_until[engine] = time.monotonic() + self.retry_seconds
+
+    def choose(self):
+        """Returns a reachable replica engine, or None to use the primary."""
+        for engine in self._candidates():
+            try:
+                engine.connect().close()
+            except DBAPIError:
+                current_app.logger.warning('Replica %s unavailable, skipping for %ss',
+                                           engine.url.render_as_string(), self.retry_seconds)
+                self.mark_down(engine)
+                continue
+            return engine
+        return None
+
+    def engine_for_request(self):
+        if not self.replicas or not has_request_context() or not g.get('db_read_only'):
+            return None
+        if 'db_replica' not in g:
+            g.db_replica = None if _sticky(request) or self.recently_written() else self.choose()
+        return None if g.get('db_wrote') else g.db_replica
+
+    def recently_written(self):
+        if time.monotonic() - self.last_write < self.sticky_seconds:
+            return True
+        shared = self.last_shared_write() if self.last_shared_write else None
+        return shared is not None and time.time() - shared < self.sticky_seconds
+
+
+def _sticky(req):
+    try:
+        return float(req.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class RoutingSession(Session):
+    """Session that sends reads from ``read_replica`` views to a replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context():
+            router = current_app.extensions.get(EXTENSION_KEY)
+            engine = router.engine_for_request() if router else None
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(fn):
+    """Marks a view as read-only so its queries may use a replica."""
+    @wraps(fn)
+    def decorator(*args, **kwargs):
+        g.db_read_only = True
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            g.db_read_only = False
+    return decorator
+
+
+def watch_session(session):
+    """Registers the session hooks that implement read-your-writes stickiness."""
+    @event.listens_for(session, 'after_flush')
+    def _record_write(sess, flush_context):
+        if sess.new or sess.dirty or sess.deleted:
+            sess.info['replica_wrote'] = True
+
+    @event.listens_for(session, 'do_orm_execute')
+    def _record_statement_write(orm_execute_state):
+        # Core/bulk DML run through session.execute() never flushes
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            orm_execute_state.session.info['replica_wrote'] = True
+
+    @event.listens_for(session, 'after_commit')
+    def _committed(sess):
+        if sess.info.pop('replica_wrote', False):
+            # The session is shared by every app; the router is the committing app's
+            router = current_app.extensions.get(EXTENSION_KEY) if has_app_context() else None
+            if router is not None:
+                router.last_write = time.monotonic()
+            if has_request_context():
+                g.db_wrote = True
+
+    @event.listens_for(session, 'after_rollback')
+    def _discard(sess):
+        sess.info.pop('replica_wrote', None)
+
+
+def init_app(app, router):
+    """Registers ``router`` for ``app``; see ``watch_session`` for the session side."""
+    app.extensions[EXTENSION_KEY] = router
+
+    @app.after_request
+    def _set_sticky_cookie(response):
+        if router.replicas and router.sticky_seconds and g.get('db_wrote'):
+            response.set_cookie(STICKY_COOKIE, str(time.time() + router.sticky_seconds),
+                                max_age=math.ceil(router.sticky_seconds), httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,195 @@
+"""
+Full-text property search backed by an SQLite FTS5 index.
+
+``property_fts`` holds its own copy of the searchable text with ``rowid``
+equal to ``property.id``. Triggers on the ``property`` and
+``property_amenity`` tables keep it in sync, so every write path (ORM, raw
+SQL, bulk loads) updates the index without any application code having to
+remember to. The ``amenities`` column holds the space-joined amenity names.
+
+Queries are answered from the FTS index and ranked with BM25, so cost
+depends on the number of matches rather than on the size of the catalogue.
+"""
+import html
+import re
+
+from sqlalchemy import DDL, column, event, func, literal_column, select, table
+
+from listing import (
+    ListingQueryError, SUMMARY_FIELDS, column_fields, parse_fields, parse_filters, parse_limit, serialize_rows,
+)
+
+FTS_TABLE = 'property_fts'
+SEARCH_COLUMNS = ('title', 'description', 'location', 'amenities')
+# BM25 weights per column, in SEARCH_COLUMNS order: a hit in the title counts
+# more than the same hit buried in the description.
+BM25_WEIGHTS = (10.0, 1.0, 4.0, 2.0)
+MAX_OFFSET = 1000
+HIGHLIGHT_OPEN = '<mark>'
+HIGHLIGHT_CLOSE = '</mark>'
+SNIPPET_TOKENS = 16
+# FTS5 brackets matches with these Unicode noncharacters, which listings do not
+# contain; the text around them is HTML-escaped before they become the tags
+_MATCH_OPEN = '\ufdd0'
+_MATCH_CLOSE = '\ufdd1'
+
+# Columns copied straight from the property row
+PROPERTY_COLUMNS = ('title', 'description', 'location')
+_cols = ', '.join(PROPERTY_COLUMNS)
+_new_cols = ', '.join(f'new.{c}' for c in PROPERTY_COLUMNS)
+
+
+def _amenity_text(property_id):
+    return (
+        "(SELECT group_concat(a.name, ' ') FROM property_amenity pa "
+        f"JOIN amenity a ON a.id = pa.amenity_id WHERE pa.property_id = {property_id})"
+    )
+
+
+PROPERTY_TRIGGERS = (
+    f"CREATE TRIGGER IF NOT EXISTS property_fts_ai AFTER INSERT ON property BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_cols}) VALUES (new.id, {_new_cols}); END",
+    f"CREATE TRIGGER IF NOT EXISTS property_fts_ad AFTER DELETE ON property BEGIN "
+    f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END",
+    f"CREATE TRIGGER IF NOT EXISTS property_fts_au AFTER UPDATE OF {_cols} ON property BEGIN "
+    f"UPDATE {FTS_TABLE} SET ({_cols}) = ({_new_cols}) WHERE rowid = new.id; END",
+)
+AMENITY_TRIGGERS = (
+    f"CREATE TRIGGER IF NOT EXISTS property_amenity_fts_ai AFTER INSERT ON property_amenity BEGIN "
+    f"UPDATE {FTS_TABLE} SET amenities = {_amenity_text('new.property_id')} WHERE rowid = new.property_id; END",
+    f"CREATE TRIGGER IF NOT EXISTS property_amenity_fts_ad AFTER DELETE ON property_amenity BEGIN "
+    f"UPDATE {FTS_TABLE} SET amenities = {_amenity_text('old.property_id')} WHERE rowid = old.property_id; END",
+)
+CREATE_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"{', '.join(SEARCH_COLUMNS)}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+CREATE_STATEMENTS = (CREATE_TABLE,) + PROPERTY_TRIGGERS
+DROP_STATEMENTS = (
+    'DROP TRIGGER IF EXISTS property_fts_au',
+    'DROP TRIGGER IF EXISTS property_fts_ad',
+    'DROP TRIGGER IF EXISTS property_fts_ai',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+)
+DROP_AMENITY_TRIGGERS = (
+    'DROP TRIGGER IF EXISTS property_amenity_fts_ad',
+    'DROP TRIGGER IF EXISTS property_amenity_fts_ai',
+)
+REBUILD_STATEMENTS = (
+    f'DELETE FROM {FTS_TABLE}',
+    f"INSERT INTO {FTS_TABLE}(rowid, {_cols}, amenities) "
+    f"SELECT id, {_cols}, {_amenity_text('property.id')} FROM property",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')",
+)
+
+fts = table(FTS_TABLE, column('rowid'), *(column(c) for c in SEARCH_COLUMNS))
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def register(property_table, amenity_link_table):
+    """Creates and drops the FTS table and triggers together with their source tables."""
+    for target, create, drop in ((property_table, CREATE_STATEMENTS, DROP_STATEMENTS),
+                                 (amenity_link_table, AMENITY_TRIGGERS, DROP_AMENITY_TRIGGERS)):
+        for statement in create:
+            event.listen(target, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+        for statement in drop:
+            event.listen(target, 'before_drop', DDL(statement).execute_if(dialect='sqlite'))
+
+
+def rebuild_index(connection):
+    """Repopulates the FTS index from the property table."""
+    for statement in REBUILD_STATEMENTS:
+        connection.exec_driver_sql(statement)
+
+
+def build_match_expression(text):
+    """
+    Turns free user input into a safe FTS5 query.
+
+    Every word is quoted (so FTS5 operators in the input are treated as plain
+    text) and prefix-matched, and all words must match.
+    """
+    tokens = _TOKEN_RE.findall(text or '')
+    if not tokens:
+        raise ListingQueryError('Search query must contain at least one word')
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def mark_matches(text):
+    """HTML for FTS5 highlight()/snippet() output: the listing text escaped, matches in <mark>."""
+    if text is None:
+        return None
+    return html.escape(text).replace(_MATCH_OPEN, HIGHLIGHT_OPEN).replace(_MATCH_CLOSE, HIGHLIGHT_CLOSE)
+
+
+class SearchQuery:
+    """
+    Parses search request arguments and builds the ranked FTS SELECT.
+
+    Supported arguments are ``q`` (required), ``limit``, ``offset``,
+    ``fields`` and the same structured filters as the listing endpoints.
+    """
+
+    def __init__(self, model, args, default_fields=SUMMARY_FIELDS):
+        self.model = model
+        self.match = build_match_expression(args.get('q'))
+        self.limit = parse_limit(args.get('limit'))
+        self.offset = self._parse_offset(args.get('offset'))
+        self.fields = parse_fields(args.get('fields'), default_fields)
+        self.filters = parse_filters(model, args)
+
+    @staticmethod
+    def _parse_offset(value):
+        if value is None or value == '':
+            return 0
+        try:
+            offset = int(value)
+        except ValueError:
+            raise ListingQueryError(f'Invalid offset: {value}')
+        if not 0 <= offset <= MAX_OFFSET:
+            raise ListingQueryError(f'offset must be between 0 and {MAX_OFFSET}')
+        return offset
+
+    def statement(self):
+        weights = [literal_column(repr(w)) for w in BM25_WEIGHTS]
+        rank = func.bm25(literal_column(FTS_TABLE), *weights).label('score')
+        title_column = SEARCH_COLUMNS.index('title')
+        stmt = (
+            select(
+                *(getattr(self.model, f) for f in dict.fromkeys(('id',) + column_fields(self.fields))),
+                func.highlight(literal_column(FTS_TABLE), title_column, _MATCH_OPEN, _MATCH_CLOSE)
+                .label('title_highlight'),
+                # Column -1 lets FTS5 pick whichever column matched best
+                func.snippet(literal_column(FTS_TABLE), -1, _MATCH_OPEN, _MATCH_CLOSE, '…', SNIPPET_TOKENS)
+                .label('snippet'),
+                rank,
+            )
+            .select_from(fts.join(self.model, self.model.id == fts.c.rowid))
+            .where(literal_column(FTS_TABLE).op('MATCH')(self.match), *self.filters)
+            # bm25() is lower-is-better
+            .order_by(rank, self.model.id)
+            .limit(self.limit + 1)
+            .offset(self.offset)
+        )
+        return stmt
+
+    def execute(self, session):
+        """
+        Runs the search and returns ``(items, next_offset)``; ``next_offset``
+        is None on the last page and on the last one reachable by offset.
+        """
+        rows = session.execute(self.statement()).all()
+        next_offset = None
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            # No link to a page whose offset would be rejected
+            if self.offset + self.limit <= MAX_OFFSET:
+                next_offset = self.offset + self.limit
+        items = serialize_rows(session, self.model, rows, self.fields)
+        for item, row in zip(items, rows):
+            mapping = row._mapping
+            item['title_highlight'] = mark_matches(mapping['title_highlight'])
+            item['snippet'] = mark_matches(mapping['snippet'])
+            item['score'] = -mapping['score']
+        return items, next_offset
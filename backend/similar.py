@@ -0,0 +1,398 @@
+"""
+"Similar properties" recommendations from an in-memory feature matrix.
+
+Each property becomes one row of a NumPy matrix:
+
+    price, area        log-scaled, then standardized over the catalogue
+    bedrooms,          standardized
+    bathrooms
+    amenities          one column per amenity name, the row's set scaled to
+                       unit length so listings with many amenities do not
+                       dominate
+
+and a location code. Two properties are as similar as their weighted
+feature vectors are close: the squared distance is ``|a|^2 + |b|^2 - 2 a.b``
+plus ``LOCATION_PENALTY`` when their locations differ, so one matrix-vector
+product scores a property against the whole catalogue (a matrix-matrix
+product for a batch of properties). Only available listings are
+recommended. The score is reported as ``similarity = 1 / (1 + distance)``.
+
+The matrix is built from two queries on first use and then kept current by
+``watch_properties``: every committed ORM create, update or delete rewrites
+or frees just that property's row, read back with the same two queries
+restricted to the written ids once the transaction has committed, with spare rows and amenity columns so
+growth rarely reallocates. Writes the ORM does not see (bulk imports, other
+worker processes) are caught up with by a rebuild: after ``invalidate()`` or
+once the matrix is ``max_age`` seconds old, the next lookup starts one in a
+background thread and keeps answering from the current matrix meanwhile.
+
+NumPy is an optional dependency (``pip install .[similar]``); without it
+``available()`` is False and nothing here is built. It is imported by the
+first build rather than with this module, which keeps ~90 ms off start-up.
+"""
+import importlib.util
+import logging
+import math
+import threading
+import time
+
+from sqlalchemy import event, select
+
+from listing import ListingQueryError
+
+# Set by _load_numpy() on the first build
+np = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+NUMERIC_FEATURES = ('price', 'area', 'bedrooms', 'bathrooms')
+# Relative importance of each part of the vector; a different location counts
+# about as much as a price two standard deviations away
+WEIGHTS = {'price': 1.0, 'area': 1.0, 'bedrooms': 0.75, 'bathrooms': 0.5, 'amenities': 1.0}
+LOCATION_PENALTY = 4.0
+# Properties scored per matrix product, bounding the (rows x batch) score matrix
+QUERY_BATCH = 64
+MIN_CAPACITY = 1024
+# Columns kept free for amenity names first seen after the build
+SPARE_AMENITY_COLUMNS = 16
+
+
+def available():
+    return importlib.util.find_spec('numpy') is not None
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+def parse_limit(value):
+    if value is None or value == '':
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ListingQueryError(f'Invalid limit: {value}')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ListingQueryError(f'limit must be between 1 and {MAX_LIMIT}')
+    return limit
+
+
+def fetch(session, model, amenity_pairs, ids=None):
+    """
+    Feature rows ``(id, price, area, bedrooms, bathrooms, location,
+    is_available)`` and ``{id: [amenity names]}`` for ``ids`` or the whole
+    catalogue, read through ``session`` (or a connection); ``amenity_pairs``
+    selects ``(property_id, name)``.
+    """
+    stmt = select(model.id, model.price, model.area, model.bedrooms, model.bathrooms, model.location,
+                  model.is_available)
+    if ids is not None:
+        stmt = stmt.where(model.id.in_(ids))
+        amenity_pairs = amenity_pairs.where(amenity_pairs.selected_columns[0].in_(ids))
+    rows = [tuple(row) for row in session.execute(stmt)]
+    amenities = {}
+    for property_id, name in session.execute(amenity_pairs):
+        amenities.setdefault(property_id, []).append(name)
+    return rows, amenities
+
+
+def watch_properties(session, model, index, amenity_pairs):
+    """
+    Applies committed ORM writes of ``model`` rows to ``index``. Flushes only
+    note which ids changed: reading a relationship such as the amenities
+    inside a flush would load it mid-flush. The rows are fetched after the
+    commit, on a connection of their own, as the session can no longer
+    emit SQL by then; ``amenity_pairs()`` builds the select ``fetch`` takes.
+    """
+    @event.listens_for(session, 'after_flush')
+    def _record(sess, flush_context):
+        if not index.tracking:
+            return
+        upserts = sess.info.setdefault('similar_upserts', set())
+        removals = sess.info.setdefault('similar_removals', set())
+        for obj in (*sess.new, *sess.dirty):
+            if isinstance(obj, model) and obj not in sess.deleted:
+                upserts.add(obj.id)
+                removals.discard(obj.id)
+        for obj in sess.deleted:
+            if isinstance(obj, model):
+                upserts.discard(obj.id)
+                removals.add(obj.id)
+
+    @event.listens_for(session, 'after_commit')
+    def _apply(sess):
+        upserts = sess.info.pop('similar_upserts', None)
+        removals = sess.info.pop('similar_removals', None) or set()
+        if upserts:
+            with sess.get_bind(mapper=model).connect() as connection:
+                rows, amenities = fetch(connection, model, amenity_pairs(), ids=list(upserts))
+            # Deleted again by a later transaction
+            removals |= upserts - {row[0] for row in rows}
+            if rows:
+                index.upsert(rows, amenities)
+        if removals:
+            index.remove(removals)
+
+    @event.listens_for(session, 'after_rollback')
+    def _discard(sess):
+        sess.info.pop('similar_upserts', None)
+        sess.info.pop('similar_removals', None)
+
+
+class _Matrix:
+    """One generation of the index: the arrays plus the lookups that address them."""
+
+    def __init__(self, rows, amenities):
+        count = len(rows)
+        ids, price, area, bedrooms, bathrooms, locations, is_available = (
+            zip(*rows) if rows else ((),) * 7)
+        raw = np.column_stack([
+            np.log1p(np.maximum(np.asarray(price, dtype=np.float64), 0)),
+            np.log1p(np.maximum(np.asarray(area, dtype=np.float64), 0)),
+            np.asarray(bedrooms, dtype=np.float64),
+            np.asarray(bathrooms, dtype=np.float64),
+        ]) if count else np.zeros((0, len(NUMERIC_FEATURES)))
+        # Standardized with the build's statistics; later rows reuse them
+        self.mean = raw.mean(axis=0) if count else np.zeros(len(NUMERIC_FEATURES))
+        std = raw.std(axis=0) if count else np.ones(len(NUMERIC_FEATURES))
+        self.std = np.where(std > 0, std, 1.0)
+        self.scale = np.array([WEIGHTS[name] for name in NUMERIC_FEATURES])
+
+        names = sorted({name for names in amenities.values() for name in names})
+        self.amenity_columns = {name: len(NUMERIC_FEATURES) + i for i, name in enumerate(names)}
+        self.location_codes = {}
+        capacity = count + max(MIN_CAPACITY, count // 8)
+        width = len(NUMERIC_FEATURES) + len(names) + SPARE_AMENITY_COLUMNS
+
+        self.vectors = np.zeros((capacity, width), dtype=np.float32)
+        self.sqnorms = np.zeros(capacity, dtype=np.float32)
+        self.codes = np.full(capacity, -1, dtype=np.int32)
+        # -|row|^2 for recommendable rows, -inf for unavailable listings and free rows
+        self.bias = np.full(capacity, -np.inf, dtype=np.float32)
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.row_of = {}
+        self.free = list(range(capacity - 1, count - 1, -1))
+
+        if count:
+            self.vectors[:count, :len(NUMERIC_FEATURES)] = (raw - self.mean) / self.std * self.scale
+            self.ids[:count] = ids
+            self.row_of = {property_id: row for row, property_id in enumerate(ids)}
+            self.codes[:count] = [self._location_code(location) for location in locations]
+            pairs = [(self.row_of[property_id], self.amenity_columns[name])
+                     for property_id, names in amenities.items() if property_id in self.row_of for name in names]
+            if pairs:
+                rows_index, columns = zip(*pairs)
+                self.vectors[rows_index, columns] = 1.0
+                block = self.vectors[:count, len(NUMERIC_FEATURES):]
+                lengths = np.sqrt((block * block).sum(axis=1, keepdims=True))
+                np.divide(block, lengths, out=block, where=lengths > 0)
+                block *= WEIGHTS['amenities']
+            self.sqnorms[:count] = (self.vectors[:count] ** 2).sum(axis=1)
+            self.bias[:count] = np.where(np.asarray(is_available, dtype=bool), -self.sqnorms[:count], -np.inf)
+
+    def _location_code(self, location):
+        key = ' '.join((location or '').lower().split())
+        return self.location_codes.setdefault(key, len(self.location_codes))
+
+    def _grow(self, rows=0, columns=0):
+        capacity, width = self.vectors.shape
+        vectors = np.zeros((capacity + rows, width + columns), dtype=np.float32)
+        vectors[:capacity, :width] = self.vectors
+        if rows:
+            self.sqnorms = np.concatenate([self.sqnorms, np.zeros(rows, dtype=np.float32)])
+            self.codes = np.concatenate([self.codes, np.full(rows, -1, dtype=np.int32)])
+            self.bias = np.concatenate([self.bias, np.full(rows, -np.inf, dtype=np.float32)])
+            self.ids = np.concatenate([self.ids, np.full(rows, -1, dtype=np.int64)])
+            self.free.extend(range(capacity + rows - 1, capacity - 1, -1))
+        self.vectors = vectors
+
+    def vector(self, row, names):
+        _, price, area, bedrooms, bathrooms, _, _ = row
+        vector = np.zeros(self.vectors.shape[1], dtype=np.float32)
+        raw = np.array([math.log1p(max(price or 0, 0)), math.log1p(max(area or 0, 0)), bedrooms or 0,
+                        bathrooms or 0])
+        vector[:len(NUMERIC_FEATURES)] = (raw - self.mean) / self.std * self.scale
+        columns = [self.amenity_columns[name] for name in set(names)]
+        if columns:
+            vector[columns] = WEIGHTS['amenities'] / math.sqrt(len(columns))
+        return vector
+
+    def upsert(self, rows, amenities):
+        new_names = {name for names in amenities.values() for name in names} - set(self.amenity_columns)
+        spare = self.vectors.shape[1] - len(NUMERIC_FEATURES) - len(self.amenity_columns)
+        if len(new_names) > spare:
+            self._grow(columns=max(len(new_names), SPARE_AMENITY_COLUMNS))
+        for name in sorted(new_names):
+            self.amenity_columns[name] = len(NUMERIC_FEATURES) + len(self.amenity_columns)
+        missing = sum(row[0] not in self.row_of for row in rows) - len(self.free)
+        if missing > 0:
+            self._grow(rows=max(missing, self.vectors.shape[0]))
+        for row in rows:
+            property_id = row[0]
+            index = self.row_of.get(property_id)
+            if index is None:
+                index = self.row_of[property_id] = self.free.pop()
+                self.ids[index] = property_id
+            vector = self.vector(row, amenities.get(property_id, ()))
+            self.vectors[index] = vector
+            self.sqnorms[index] = vector @ vector
+            self.codes[index] = self._location_code(row[5])
+            self.bias[index] = -self.sqnorms[index] if row[6] else -np.inf
+
+    def remove(self, ids):
+        for property_id in ids:
+            index = self.row_of.pop(property_id, None)
+            if index is None:
+                continue
+            self.bias[index] = -np.inf
+            self.ids[index] = -1
+            self.vectors[index] = 0
+            self.sqnorms[index] = 0
+            self.free.append(index)
+
+
+class SimilarityIndex:
+    """The current ``_Matrix`` plus when and how it gets rebuilt; thread-safe."""
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._matrix = None
+        self._built_at = None
+        self._lock = threading.Lock()
+        # Held for a whole build, so concurrent first lookups wait for one build
+        self._build_lock = threading.Lock()
+        # Changes committed while a build reads the catalogue, replayed onto its
+        # result; not None from when a build is due until it is swapped in
+        self._replay = None
+
+    @property
+    def built(self):
+        return self._matrix is not None
+
+    @property
+    def tracking(self):
+        """Whether committed writes need applying: there is a matrix or one is being built."""
+        return self._matrix is not None or self._replay is not None
+
+    def __len__(self):
+        matrix = self._matrix
+        return len(matrix.row_of) if matrix is not None else 0
+
+    def invalidate(self):
+        """Rebuilds on the next lookup, e.g. after writes that bypassed the ORM."""
+        with self._lock:
+            self._built_at = None
+
+    def build(self, load):
+        """Replaces the matrix with one built from ``load()`` (see ``fetch``)."""
+        with self._build_lock:
+            self._build(load)
+
+    def _build(self, load):
+        _load_numpy()
+        with self._lock:
+            if self._replay is None:
+                self._replay = []
+        try:
+            started = time.perf_counter()
+            rows, amenities = load()
+            matrix = _Matrix(rows, amenities)
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+        with self._lock:
+            for method, args in self._replay:
+                getattr(matrix, method)(*args)
+            self._replay = None
+            self._matrix = matrix
+            self._built_at = time.monotonic()
+        logger.info('Built the similarity index of %s properties in %.0f ms', len(rows),
+                    (time.perf_counter() - started) * 1000)
+
+    def ensure(self, load):
+        """
+        Builds the matrix on first use; when it is stale, rebuilds it in a
+        background thread while lookups keep using the current one.
+        """
+        if self._matrix is None:
+            with self._build_lock:
+                if self._matrix is None:
+                    self._build(load)
+            return
+        with self._lock:
+            stale = self._built_at is None or time.monotonic() - self._built_at > self.max_age
+            if not stale or self._replay is not None:
+                return
+            # Marks the rebuild as started, so only one runs at a time
+            self._replay = []
+        threading.Thread(target=self._rebuild, args=(load,), name='similarity-rebuild', daemon=True).start()
+
+    def _rebuild(self, load):
+        try:
+            self.build(load)
+        except Exception:
+            logger.exception('Rebuilding the similarity index failed')
+            self.invalidate()
+
+    def _apply(self, method, *args):
+        with self._lock:
+            if self._matrix is not None:
+                getattr(self._matrix, method)(*args)
+            if self._replay is not None:
+                self._replay.append((method, args))
+
+    def upsert(self, rows, amenities):
+        """Adds or rewrites properties from ``fetch``-shaped rows and amenities."""
+        self._apply('upsert', rows, amenities)
+
+    def remove(self, ids):
+        self._apply('remove', list(ids))
+
+    def __contains__(self, property_id):
+        matrix = self._matrix
+        return matrix is not None and property_id in matrix.row_of
+
+    def top_k(self, ids, k):
+        """
+        ``{id: [(similar_id, similarity), ...]}``, best first, for each of
+        ``ids`` in the index, scored in batches of QUERY_BATCH.
+        """
+        with self._lock:
+            matrix = self._matrix
+            if matrix is None:
+                return {}
+            # Row writes race harmlessly with scoring; these arrays are only ever replaced whole
+            vectors, sqnorms, bias, codes, row_ids = (
+                matrix.vectors, matrix.sqnorms, matrix.bias, matrix.codes, matrix.ids)
+            rows = [(property_id, matrix.row_of[property_id]) for property_id in ids if property_id in matrix.row_of]
+        limit = min(k, len(bias))
+        results = {}
+        for start in range(0, len(rows), QUERY_BATCH):
+            batch = rows[start:start + QUERY_BATCH]
+            query_rows = np.array([row for _, row in batch])
+            # One row of scores per query: 2 q.x - |x|^2, i.e. minus the squared
+            # distance up to the query's own |q|^2, so larger is closer
+            scores = vectors[query_rows] @ vectors.T
+            scores *= 2
+            scores += bias
+            scores -= np.float32(LOCATION_PENALTY) * (codes != codes[query_rows][:, None])
+            scores[np.arange(len(batch)), query_rows] = -np.inf
+            top = np.argpartition(scores, -limit, axis=1)[:, -limit:]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            distances = np.sqrt(np.maximum(sqnorms[query_rows][:, None] - top_scores, 0))
+            for i, (property_id, _) in enumerate(batch):
+                results[property_id] = [
+                    (int(row_ids[row]), round(float(1 / (1 + distance)), 4))
+                    for row, distance, score in zip(top[i], distances[i], top_scores[i])
+                    if np.isfinite(score)
+                ]
+        return results
@@ -0,0 +1,400 @@
+"""
+Market statistics kept up to date as properties change.
+
+``property_stats`` holds one row per ``(location, bedrooms)`` group with the
+group's counts, price sum/min/max, price-per-area sum and two quantile
+sketches (price and price per area). Every ORM flush that creates, edits or
+deletes a property applies its *delta* to the affected rows in the same
+transaction, so the dashboard reads a few hundred small rows instead of
+scanning the catalogue. Totals by location, by bedrooms or overall are
+produced by merging group rows.
+
+Quantiles come from ``QuantileSketch``, a DDSketch-style log-bucketed
+histogram: values are counted in buckets whose width grows with the value,
+so any quantile is within ``RELATIVE_ACCURACY`` of the true one, sketches of
+two groups merge by adding bucket counts, and a removed value is just a
+decrement. Medians and percentiles therefore never sort rows.
+
+Writes that bypass the ORM (bulk imports, raw SQL) are not seen;
+``rebuild`` recomputes every group from the property table, and ``compare``
+reports where the maintained rows drifted from it. An empty table (a fresh
+migration over an existing catalogue) is rebuilt by the first property
+write, and read as computed from scratch until then.
+"""
+import json
+import logging
+import math
+from collections import defaultdict
+
+from sqlalchemy import delete, event, func, insert, inspect, select, update
+
+RELATIVE_ACCURACY = 0.01
+QUANTILES = {'p25': 0.25, 'median': 0.5, 'p75': 0.75, 'p90': 0.9}
+GROUPINGS = ('location', 'bedrooms', 'location_bedrooms')
+# Attributes whose change moves a property between groups or changes its contribution
+TRACKED = ('location', 'bedrooms', 'price', 'area', 'is_available')
+# Sums compared by ``compare``; float sums drift slightly under many deltas
+SUM_TOLERANCE = 1e-6
+
+logger = logging.getLogger(__name__)
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with relative error ``alpha`` that supports removals."""
+
+    def __init__(self, alpha=RELATIVE_ACCURACY, bins=None, zero=0):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = dict(bins or {})
+        # Values <= 0 (e.g. an unpriced listing) have no log bucket
+        self.zero = zero
+
+    @property
+    def count(self):
+        return self.zero + sum(self.bins.values())
+
+    def _index(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def add(self, value, count=1):
+        if value is None:
+            return
+        if value <= 0:
+            self.zero += count
+            return
+        index = self._index(value)
+        remaining = self.bins.get(index, 0) + count
+        if remaining > 0:
+            self.bins[index] = remaining
+        else:
+            self.bins.pop(index, None)
+
+    def remove(self, value):
+        if value is not None and value <= 0:
+            self.zero = max(self.zero - 1, 0)
+        else:
+            self.add(value, -1)
+
+    def merge(self, other):
+        self.zero += other.zero
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        return self
+
+    def quantile(self, q):
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                # Midpoint of the bucket in relative terms
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_json(self):
+        return json.dumps({'alpha': self.alpha, 'zero': self.zero, 'bins': self.bins}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, raw):
+        if not raw:
+            return cls()
+        data = json.loads(raw)
+        return cls(data['alpha'], {int(k): v for k, v in data['bins'].items()}, data['zero'])
+
+
+def _round(value):
+    # Sketch estimates are only good to RELATIVE_ACCURACY anyway
+    return round(value, 2) if value is not None else None
+
+
+def price_per_area(price, area):
+    return price / area if price is not None and area else None
+
+
+class GroupStats:
+    """Aggregates for one group; rows of ``property_stats`` load into and save from this."""
+
+    def __init__(self, count=0, available=0, price_sum=0.0, price_min=None, price_max=None,
+                 ppa_sum=0.0, ppa_count=0, price_sketch=None, ppa_sketch=None):
+        self.count = count
+        self.available = available
+        self.price_sum = price_sum
+        self.price_min = price_min
+        self.price_max = price_max
+        self.ppa_sum = ppa_sum
+        self.ppa_count = ppa_count
+        self.price_sketch = price_sketch or QuantileSketch()
+        self.ppa_sketch = ppa_sketch or QuantileSketch()
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.property_count, row.available_count, row.price_sum, row.price_min, row.price_max, row.ppa_sum,
+                   row.ppa_count, QuantileSketch.from_json(row.price_sketch), QuantileSketch.from_json(row.ppa_sketch))
+
+    def values(self):
+        return {
+            'property_count': self.count,
+            'available_count': self.available,
+            'price_sum': self.price_sum,
+            'price_min': self.price_min,
+            'price_max': self.price_max,
+            'ppa_sum': self.ppa_sum,
+            'ppa_count': self.ppa_count,
+            'price_sketch': self.price_sketch.to_json(),
+            'ppa_sketch': self.ppa_sketch.to_json(),
+        }
+
+    def add(self, price, area, available, sign=1):
+        """Adds (``sign=1``) or removes (``sign=-1``) one property's contribution."""
+        self.count += sign
+        self.available += sign if available else 0
+        self.price_sum += sign * (price or 0)
+        ppa = price_per_area(price, area)
+        if ppa is not None:
+            self.ppa_sum += sign * ppa
+            self.ppa_count += sign
+        if sign > 0:
+            self.price_sketch.add(price)
+            self.ppa_sketch.add(ppa)
+            if price is not None:
+                self.price_min = price if self.price_min is None else min(self.price_min, price)
+                self.price_max = price if self.price_max is None else max(self.price_max, price)
+        else:
+            self.price_sketch.remove(price)
+            self.ppa_sketch.remove(ppa)
+
+    def merge(self, other):
+        self.count += other.count
+        self.available += other.available
+        self.price_sum += other.price_sum
+        self.ppa_sum += other.ppa_sum
+        self.ppa_count += other.ppa_count
+        self.price_sketch.merge(other.price_sketch)
+        self.ppa_sketch.merge(other.ppa_sketch)
+        mins = [v for v in (self.price_min, other.price_min) if v is not None]
+        maxes = [v for v in (self.price_max, other.price_max) if v is not None]
+        self.price_min = min(mins) if mins else None
+        self.price_max = max(maxes) if maxes else None
+        return self
+
+    def _price_quantile(self, q):
+        # A bucket midpoint can fall just outside the values actually seen
+        value = self.price_sketch.quantile(q)
+        if value is None or self.price_min is None:
+            return value
+        return min(max(value, self.price_min), self.price_max)
+
+    def summary(self):
+        count = self.count
+        return {
+            'count': count,
+            'available': self.available,
+            'availability_ratio': round(self.available / count, 4) if count else None,
+            'price': {
+                'min': self.price_min,
+                'max': self.price_max,
+                'mean': self.price_sum / count if count else None,
+                **{name: _round(self._price_quantile(q)) for name, q in QUANTILES.items()},
+            },
+            'price_per_area': {
+                'mean': self.ppa_sum / self.ppa_count if self.ppa_count else None,
+                'median': _round(self.ppa_sketch.quantile(0.5)),
+            },
+        }
+
+
+# --- Maintenance ---
+
+def _group_columns(source):
+    return source.location, source.bedrooms
+
+
+def _current(obj):
+    """``((location, bedrooms), price, area, is_available)`` as the object holds them now."""
+    location, bedrooms, price, area, available = (getattr(obj, name) for name in TRACKED)
+    return (location, bedrooms), price, area, available
+
+
+def _committed(obj):
+    """The same tuple as last loaded from the database, ignoring pending changes."""
+    attrs = inspect(obj).attrs
+    values = []
+    for name in TRACKED:
+        current = getattr(obj, name)  # loads an expired attribute while the row still exists
+        history = attrs[name].history
+        values.append(history.deleted[0] if history.deleted else current)
+    location, bedrooms, price, area, available = values
+    return (location, bedrooms), price, area, available
+
+
+def _changed(obj):
+    attrs = inspect(obj).attrs
+    return any(attrs[name].history.has_changes() for name in TRACKED)
+
+
+def _keep_history(target, value, oldvalue, initiator):
+    pass
+
+
+def watch_properties(session, model, stats_table):
+    """Applies each flush's property changes to ``stats_table`` within the same transaction."""
+    # Load the replaced value on every set, so a removal always knows what it removes
+    for name in TRACKED:
+        event.listen(getattr(model, name), 'set', _keep_history, active_history=True)
+
+    @event.listens_for(session, 'before_flush')
+    def _collect_removals(sess, flush_context, instances):
+        removed, changed = [], []
+        for obj in sess.dirty:
+            if isinstance(obj, model) and obj not in sess.deleted and _changed(obj):
+                removed.append((-1, *_committed(obj)))
+                changed.append(obj)
+        for obj in sess.deleted:
+            if isinstance(obj, model):
+                removed.append((-1, *_committed(obj)))
+        if removed:
+            sess.info['stats_pending'] = (removed, changed)
+
+    @event.listens_for(session, 'after_flush')
+    def _apply(sess, flush_context):
+        # New rows are read after the INSERT so column defaults are filled in
+        removed, changed = sess.info.pop('stats_pending', ((), ()))
+        added = [(1, *_current(obj)) for obj in (*sess.new, *changed) if isinstance(obj, model)]
+        if (removed or added) and not seed_if_empty(sess, model, stats_table):
+            apply_deltas(sess, model, stats_table, [*removed, *added])
+
+    @event.listens_for(session, 'after_rollback')
+    def _discard(sess):
+        sess.info.pop('stats_pending', None)
+
+
+def apply_deltas(session, model, stats_table, deltas):
+    """Applies ``(sign, key, price, area, available)`` deltas to the group rows they touch."""
+    by_key = defaultdict(list)
+    for sign, key, price, area, available in deltas:
+        by_key[key].append((sign, price, area, available))
+
+    key_columns = _group_columns(stats_table.c)
+    for key, changes in by_key.items():
+        where = [column == value for column, value in zip(key_columns, key)]
+        # Serializes concurrent writers to the same group (no-op on SQLite, which has one writer)
+        row = session.execute(select(stats_table).where(*where).with_for_update()).first()
+        group = GroupStats.from_row(row) if row is not None else GroupStats()
+        stale_bounds = False
+        for sign, price, area, available in changes:
+            group.add(price, area, available, sign)
+            if sign < 0 and price is not None and price in (group.price_min, group.price_max):
+                stale_bounds = True
+
+        if group.count < 0 or (row is None and any(sign < 0 for sign, *_ in changes)):
+            logger.warning('Statistics for %s are out of date; run `flask rebuild-stats`', key)
+        if group.count <= 0:
+            if row is not None:
+                session.execute(delete(stats_table).where(*where))
+            continue
+        if stale_bounds:
+            # A removed value was the minimum or maximum; read the new bounds through the group index
+            group.price_min, group.price_max = session.execute(
+                select(func.min(model.price), func.max(model.price))
+                .where(*[column == value for column, value in zip(_group_columns(model), key)])
+            ).one()
+        if row is None:
+            session.execute(insert(stats_table).values(location=key[0], bedrooms=key[1], **group.values()))
+        else:
+            session.execute(update(stats_table).where(*where).values(**group.values()))
+
+
+def compute(session, model, batch_size=1000):
+    """Aggregates every property from scratch as ``{(location, bedrooms): GroupStats}``."""
+    groups = defaultdict(GroupStats)
+    rows = session.execute(
+        select(model.location, model.bedrooms, model.price, model.area, model.is_available)
+        .execution_options(yield_per=batch_size)
+    )
+    for location, bedrooms, price, area, available in rows:
+        groups[(location, bedrooms)].add(price, area, available)
+    return dict(groups)
+
+
+def load(session, stats_table):
+    """The maintained groups as ``{(location, bedrooms): GroupStats}``."""
+    return {(row.location, row.bedrooms): GroupStats.from_row(row) for row in session.execute(select(stats_table))}
+
+
+def rebuild(session, model, stats_table):
+    """Replaces ``stats_table`` with freshly computed groups; returns the number of groups."""
+    groups = compute(session, model)
+    session.execute(delete(stats_table))
+    if groups:
+        session.execute(insert(stats_table), [
+            {'location': location, 'bedrooms': bedrooms, **group.values()}
+            for (location, bedrooms), group in groups.items()
+        ])
+    return len(groups)
+
+
+def seed_if_empty(session, model, stats_table):
+    """
+    Rebuilds ``stats_table`` if it has no rows while properties exist, as
+    right after the migration that created it, so deltas are never applied
+    to groups that were not counted yet. True if it rebuilt.
+    """
+    if session.execute(select(stats_table.c.location).limit(1)).first() is not None:
+        return False
+    return rebuild(session, model, stats_table) > 0
+
+
+def compare(maintained, computed):
+    """Keys whose maintained aggregates differ from a from-scratch computation."""
+    mismatched = []
+    for key in sorted(maintained.keys() | computed.keys(), key=lambda k: (str(k[0]), k[1] or 0)):
+        a, b = maintained.get(key), computed.get(key)
+        if a is None or b is None:
+            mismatched.append(key)
+            continue
+        exact = ('count', 'available', 'price_min', 'price_max', 'ppa_count')
+        if (any(getattr(a, f) != getattr(b, f) for f in exact)
+                or not math.isclose(a.price_sum, b.price_sum, rel_tol=SUM_TOLERANCE, abs_tol=SUM_TOLERANCE)
+                or not math.isclose(a.ppa_sum, b.ppa_sum, rel_tol=SUM_TOLERANCE, abs_tol=SUM_TOLERANCE)
+                or a.price_sketch.bins != b.price_sketch.bins or a.price_sketch.zero != b.price_sketch.zero
+                or a.ppa_sketch.bins != b.ppa_sketch.bins or a.ppa_sketch.zero != b.ppa_sketch.zero):
+            mismatched.append(key)
+    return mismatched
+
+
+# --- Reporting ---
+
+def parse_groupings(value):
+    if not value:
+        return ('location', 'bedrooms')
+    names = tuple(name.strip() for name in value.split(',') if name.strip())
+    unknown = [name for name in names if name not in GROUPINGS]
+    if unknown:
+        raise ValueError(f'Unknown group_by: {", ".join(unknown)}')
+    return names
+
+
+def report(groups, groupings=('location', 'bedrooms')):
+    """Overall statistics plus one list per requested grouping, merged from group rows."""
+    overall = GroupStats()
+    rollups = {name: defaultdict(GroupStats) for name in groupings}
+    for (location, bedrooms), group in groups.items():
+        overall.merge(group)
+        keys = {'location': (location,), 'bedrooms': (bedrooms,), 'location_bedrooms': (location, bedrooms)}
+        for name in groupings:
+            rollups[name][keys[name]].merge(group)
+
+    result = {'overall': overall.summary()}
+    for name in groupings:
+        columns = ('location', 'bedrooms') if name == 'location_bedrooms' else (name,)
+        result[f'by_{name}'] = [
+            {**dict(zip(columns, key)), **group.summary()}
+            for key, group in sorted(rollups[name].items(), key=lambda item: (-item[1].count, str(item[0])))
+        ]
+    return result
@@ -0,0 +1,466 @@
+"""
+Incremental property sync between this app and the Node backend.
+
+Both stores keep a ``property_change`` log that triggers append to on every
+insert, update and delete of a property (here, also of its image and amenity
+rows). ``flask sync-properties`` reads each log from a stored checkpoint,
+collapses the entries of a batch to the latest operation per property,
+fetches only those rows and applies them to the other side. Work is
+therefore proportional to the number of changes, not to the catalogue size.
+
+Conflicts are settled by ``updated_at``: a row is only overwritten by a
+strictly newer version, and the copy keeps the source's timestamp, so
+changes that come back from the other side (the target's triggers log them
+too) are recognised as already applied and skipped. A delete loses against
+a target edited after it; that row is re-logged and flows back as new. The
+other way round, an edit older than a delete still waiting in the target's
+log is skipped, and the delete reaches the source on its own.
+
+Records missing a field this app requires (a Node row without a location or
+timestamps, say) are reported as failed and left out; the rest of the batch
+still applies.
+
+On PostgreSQL, log ids come from a sequence and a transaction may commit an
+entry after one with a higher id has already been read. The checkpoint keeps
+the ids it stepped over and reads them again on later runs, for up to
+``GAP_TIMEOUT`` seconds, after which they are taken for rolled back.
+
+Ids differ between the stores and are matched through
+``property_sync_link``. Links and checkpoints live in this app's database;
+the Node database only gets the change log table and its triggers, installed
+(and backfilled) on first sync.
+"""
+import json
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import DDL, and_, column, delete, event, func, insert, or_, select, table, text, update
+
+CHANGE_TABLE = 'property_change'
+DEFAULT_BATCH_SIZE = 500
+REMOTE_NAME = 'node'
+DIRECTIONS = ('push', 'pull', 'both')
+# How long a skipped log id is waited for before it counts as rolled back
+GAP_TIMEOUT = 15 * 60
+MAX_GAPS = 1000
+MAX_REPORTED_ERRORS = 20
+# Canonical record exchanged between the stores
+RECORD_FIELDS = ('title', 'description', 'price', 'location', 'bedrooms', 'bathrooms', 'area',
+                 'is_available', 'images', 'amenities', 'created_at', 'updated_at')
+REQUIRED_FIELDS = ('title', 'location', 'created_at', 'updated_at')
+
+
+_LOG = f"INSERT INTO {CHANGE_TABLE}(property_id, op) VALUES"
+
+
+def sqlite_triggers(source_table):
+    """SQLite triggers logging every insert, update and delete of ``source_table`` rows."""
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS {source_table}_change_ai AFTER INSERT ON {source_table} BEGIN "
+        f"{_LOG} (new.id, 'upsert'); END",
+        f"CREATE TRIGGER IF NOT EXISTS {source_table}_change_au AFTER UPDATE ON {source_table} BEGIN "
+        f"{_LOG} (new.id, 'upsert'); END",
+        f"CREATE TRIGGER IF NOT EXISTS {source_table}_change_ad AFTER DELETE ON {source_table} BEGIN "
+        f"{_LOG} (old.id, 'delete'); END",
+    )
+
+
+def sqlite_child_triggers(child_table, fk_column='property_id'):
+    """SQLite triggers logging a change of the parent property when a child row is added or removed."""
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS {child_table}_change_ai AFTER INSERT ON {child_table} BEGIN "
+        f"{_LOG} (new.{fk_column}, 'upsert'); END",
+        f"CREATE TRIGGER IF NOT EXISTS {child_table}_change_ad AFTER DELETE ON {child_table} BEGIN "
+        f"{_LOG} (old.{fk_column}, 'upsert'); END",
+    )
+
+
+POSTGRES_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION log_property_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'property' THEN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO {CHANGE_TABLE}(property_id, op, changed_at) VALUES (OLD.id, 'delete', now() AT TIME ZONE 'utc');
+        ELSE
+            INSERT INTO {CHANGE_TABLE}(property_id, op, changed_at) VALUES (NEW.id, 'upsert', now() AT TIME ZONE 'utc');
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO {CHANGE_TABLE}(property_id, op, changed_at) VALUES (OLD.property_id, 'upsert', now() AT TIME ZONE 'utc');
+    ELSE
+        INSERT INTO {CHANGE_TABLE}(property_id, op, changed_at) VALUES (NEW.property_id, 'upsert', now() AT TIME ZONE 'utc');
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql
+"""
+
+
+def postgres_trigger(table_name, events):
+    return (f"CREATE TRIGGER {table_name}_change_log AFTER {events} ON {table_name} "
+            "FOR EACH ROW EXECUTE FUNCTION log_property_change()")
+
+
+def register(property_table, image_table, amenity_link_table):
+    """Installs the change-log triggers whenever the property tables are created."""
+    sqlite_statements = (
+        (property_table, sqlite_triggers(property_table.name)),
+        (image_table, sqlite_child_triggers(image_table.name)),
+        (amenity_link_table, sqlite_child_triggers(amenity_link_table.name)),
+    )
+    for target, statements in sqlite_statements:
+        for statement in statements:
+            event.listen(target, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+    postgres_events = (
+        (property_table, 'INSERT OR UPDATE OR DELETE'),
+        (image_table, 'INSERT OR DELETE'),
+        (amenity_link_table, 'INSERT OR DELETE'),
+    )
+    for target, events in postgres_events:
+        event.listen(target, 'after_create', DDL(POSTGRES_FUNCTION).execute_if(dialect='postgresql'))
+        event.listen(target, 'after_create', DDL(postgres_trigger(target.name, events)).execute_if(dialect='postgresql'))
+    event.listen(property_table, 'after_drop',
+                 DDL('DROP FUNCTION IF EXISTS log_property_change() CASCADE').execute_if(dialect='postgresql'))
+
+
+def _naive_utc(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _json_list(value):
+    if not value:
+        return []
+    try:
+        items = json.loads(value)
+    except ValueError:
+        return []
+    return [str(item) for item in items] if isinstance(items, list) else []
+
+
+# --- Stores ---
+
+def _changes_since(changes, position, limit, gaps):
+    after = changes.c.id > position
+    return (
+        select(changes.c.id, changes.c.property_id, changes.c.op, changes.c.changed_at)
+        .where(or_(after, changes.c.id.in_(gaps)) if gaps else after)
+        .order_by(changes.c.id).limit(limit)
+    )
+
+
+def _deleted_at(changes, ids):
+    return (
+        select(changes.c.property_id, func.max(changes.c.changed_at))
+        .where(changes.c.op == 'delete', changes.c.property_id.in_(ids)).group_by(changes.c.property_id)
+    )
+
+
+def _prune(changes, position, gaps):
+    # Entries still awaited are below the checkpoint but not consumed yet
+    consumed = changes.c.id <= position
+    return delete(changes).where(and_(consumed, changes.c.id.notin_(gaps)) if gaps else consumed)
+
+
+class FlaskStore:
+    """This app's properties, written through the ORM so caches and search stay consistent."""
+
+    def __init__(self, session, model, change_table):
+        self.session = session
+        self.model = model
+        self.changes = change_table
+
+    def changes_since(self, position, limit, gaps=()):
+        return self.session.execute(_changes_since(self.changes, position, limit, gaps)).all()
+
+    def fetch(self, ids):
+        records = {}
+        for obj in self.session.scalars(select(self.model).where(self.model.id.in_(ids))):
+            record = {field: getattr(obj, field) for field in RECORD_FIELDS}
+            record['created_at'] = _naive_utc(record['created_at'])
+            record['updated_at'] = _naive_utc(record['updated_at'])
+            records[obj.id] = record
+        return records
+
+    def updated_at(self, ids):
+        rows = self.session.execute(select(self.model.id, self.model.updated_at).where(self.model.id.in_(ids)))
+        return {row.id: _naive_utc(row.updated_at) for row in rows}
+
+    def write(self, target_id, record):
+        obj = self.session.get(self.model, target_id) if target_id is not None else None
+        if obj is None:
+            obj = self.model()
+            self.session.add(obj)
+        for field in RECORD_FIELDS:
+            setattr(obj, field, record[field])
+        self.session.flush()
+        return obj.id
+
+    def delete(self, target_id):
+        obj = self.session.get(self.model, target_id)
+        if obj is not None:
+            self.session.delete(obj)
+            self.session.flush()
+
+    def deleted_at(self, ids):
+        rows = self.session.execute(_deleted_at(self.changes, ids))
+        return {property_id: _naive_utc(changed_at) for property_id, changed_at in rows}
+
+    def touch(self, target_id):
+        self.session.execute(insert(self.changes).values(property_id=target_id, op='upsert'))
+
+    def prune(self, position, gaps=()):
+        self.session.execute(_prune(self.changes, position, gaps))
+
+
+node_properties = table(
+    'properties', column('id'), column('title'), column('description'), column('type'), column('price'),
+    column('price_per_night'), column('location'), column('bedrooms'), column('bathrooms'), column('sqft'),
+    column('image_url'), column('images'), column('amenities'), column('status'),
+    column('created_at'), column('updated_at'),
+)
+node_changes = table(CHANGE_TABLE, column('id'), column('property_id'), column('op'), column('changed_at'))
+NODE_CHANGE_TABLE = (
+    f"CREATE TABLE IF NOT EXISTS {CHANGE_TABLE} (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "property_id INTEGER NOT NULL, op TEXT NOT NULL, changed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+)
+
+
+def _node_timestamp(value):
+    return value.isoformat(sep=' ') if value else None
+
+
+class NodeStore:
+    """The Node backend's ``properties`` table in luxury_properties.db."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def ensure_change_log(self):
+        """Creates the change log and its triggers; a new log starts with every existing row."""
+        exists = self.connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': CHANGE_TABLE}
+        ).first()
+        self.connection.exec_driver_sql(NODE_CHANGE_TABLE)
+        for statement in sqlite_triggers(node_properties.name):
+            self.connection.exec_driver_sql(statement)
+        if not exists:
+            self.connection.exec_driver_sql(
+                f"INSERT INTO {CHANGE_TABLE}(property_id, op) SELECT id, 'upsert' FROM properties ORDER BY id"
+            )
+
+    def changes_since(self, position, limit, gaps=()):
+        return self.connection.execute(_changes_since(node_changes, position, limit, gaps)).all()
+
+    def fetch(self, ids):
+        records = {}
+        for row in self.connection.execute(select(node_properties).where(node_properties.c.id.in_(ids))):
+            images = _json_list(row.images) or ([row.image_url] if row.image_url else [])
+            records[row.id] = {
+                'title': row.title,
+                'description': row.description or '',
+                'price': row.price if row.price is not None else (row.price_per_night or 0),
+                'location': row.location,
+                'bedrooms': row.bedrooms or 0,
+                'bathrooms': row.bathrooms or 0,
+                'area': row.sqft or 0,
+                'is_available': (row.status or 'available') == 'available',
+                'images': images,
+                'amenities': _json_list(row.amenities),
+                'created_at': _naive_utc(row.created_at),
+                'updated_at': _naive_utc(row.updated_at),
+            }
+        return records
+
+    def updated_at(self, ids):
+        rows = self.connection.execute(
+            select(node_properties.c.id, node_properties.c.updated_at).where(node_properties.c.id.in_(ids))
+        )
+        return {row.id: _naive_utc(row.updated_at) for row in rows}
+
+    def write(self, target_id, record):
+        values = {
+            'title': record['title'],
+            'description': record['description'],
+            'location': record['location'],
+            'bedrooms': record['bedrooms'],
+            'bathrooms': record['bathrooms'],
+            'sqft': record['area'],
+            'images': json.dumps(record['images']),
+            'image_url': record['images'][0] if record['images'] else None,
+            'amenities': json.dumps(record['amenities']),
+            'updated_at': _node_timestamp(record['updated_at']),
+        }
+        current = None
+        if target_id is not None:
+            current = self.connection.execute(
+                select(node_properties.c.type, node_properties.c.price, node_properties.c.status)
+                .where(node_properties.c.id == target_id)
+            ).first()
+        kind = current.type if current else 'sale'
+        # Nightly-priced rentals keep their price in price_per_night
+        price_column = 'price_per_night' if current and kind == 'rental' and current.price is None else 'price'
+        values[price_column] = record['price']
+        if record['is_available']:
+            values['status'] = 'available'
+        elif current and current.status != 'available':
+            values['status'] = current.status
+        else:
+            values['status'] = 'rented' if kind == 'rental' else 'sold'
+
+        if current is not None:
+            self.connection.execute(update(node_properties).where(node_properties.c.id == target_id).values(values))
+            return target_id
+        values.update(type=kind, created_at=_node_timestamp(record['created_at']))
+        return self.connection.execute(insert(node_properties).values(values)).lastrowid
+
+    def delete(self, target_id):
+        self.connection.execute(delete(node_properties).where(node_properties.c.id == target_id))
+
+    def deleted_at(self, ids):
+        rows = self.connection.execute(_deleted_at(node_changes, ids))
+        return {property_id: _naive_utc(changed_at) for property_id, changed_at in rows}
+
+    def touch(self, target_id):
+        self.connection.execute(insert(node_changes).values(property_id=target_id, op='upsert'))
+
+    def prune(self, position, gaps=()):
+        self.connection.execute(_prune(node_changes, position, gaps))
+
+
+# --- Bookkeeping ---
+
+class SyncState:
+    """Checkpoints and id links, stored in this app's database."""
+
+    def __init__(self, session, checkpoint_table, link_table, remote=REMOTE_NAME):
+        self.session = session
+        self.checkpoints = checkpoint_table
+        self.links = link_table
+        self.remote = remote
+
+    def position(self, direction):
+        """Returns the ``direction`` checkpoint and the ids below it still awaited, ``{id: first seen}``."""
+        row = self.session.execute(
+            select(self.checkpoints.c.position, self.checkpoints.c.gaps)
+            .where(self.checkpoints.c.name == f'{self.remote}:{direction}')
+        ).first()
+        if row is None:
+            return 0, {}
+        gaps = {int(change_id): seen for change_id, seen in json.loads(row.gaps or '{}').items()}
+        return row.position or 0, gaps
+
+    def save_position(self, direction, position, gaps=None):
+        name = f'{self.remote}:{direction}'
+        values = {'position': position, 'gaps': json.dumps(gaps) if gaps else None}
+        updated = self.session.execute(
+            update(self.checkpoints).where(self.checkpoints.c.name == name).values(values)
+        ).rowcount
+        if not updated:
+            self.session.execute(insert(self.checkpoints).values(name=name, **values))
+
+    def lookup(self, ids, from_local):
+        """Maps source ids to linked target ids; local ids when pushing, remote ids when pulling."""
+        local, remote = self.links.c.property_id, self.links.c.remote_id
+        source, target = (local, remote) if from_local else (remote, local)
+        rows = self.session.execute(
+            select(source, target).where(self.links.c.remote == self.remote, source.in_(ids))
+        )
+        return dict(rows.tuples().all())
+
+    def link(self, local_id, remote_id):
+        self.session.execute(insert(self.links).values(remote=self.remote, property_id=local_id, remote_id=remote_id))
+
+    def unlink(self, local_id):
+        self.session.execute(delete(self.links).where(self.links.c.remote == self.remote,
+                                                      self.links.c.property_id == local_id))
+
+
+# --- Replication ---
+
+def replicate(source, target, state, direction, batch_size=DEFAULT_BATCH_SIZE, commit=lambda: None):
+    """
+    Applies ``source``'s logged changes since the ``direction`` checkpoint to
+    ``target`` in batches. ``commit()`` is called after each batch, once the
+    checkpoint has been moved; consumed log entries are pruned at the end.
+    """
+    from_local = direction == 'push'
+    report = {'inserted': 0, 'updated': 0, 'deleted': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+    position, gaps = state.position(direction)
+    now = time.time()
+    gaps = {change_id: seen for change_id, seen in gaps.items() if now - seen < GAP_TIMEOUT}
+    while True:
+        changes = source.changes_since(position, batch_size, list(gaps))
+        if not changes:
+            break
+        latest = {}
+        for change in changes:
+            latest[change.property_id] = change
+        ids = list(latest)
+        records = source.fetch([i for i in ids if latest[i].op == 'upsert'])
+        links = state.lookup(ids, from_local)
+        current = target.updated_at(list(links.values()))
+        # Linked rows gone from the target, with the delete its log has not passed back yet
+        gone = target.deleted_at([i for i in links.values() if i not in current])
+
+        for source_id in ids:
+            target_id = links.get(source_id)
+            target_updated = current.get(target_id)
+            record = records.get(source_id)
+            missing = [field for field in REQUIRED_FIELDS if record[field] in (None, '')] if record else []
+            if missing:
+                report['failed'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'id': source_id, 'error': f"missing {', '.join(missing)}"})
+            elif record is not None:
+                deleted_at = gone.get(target_id)
+                if target_updated is None and deleted_at is not None and record['updated_at'] <= deleted_at:
+                    # Deleted on the target after this edit; the delete goes the other way
+                    report['skipped'] += 1
+                elif target_updated is None:
+                    if target_id is not None:
+                        # Deleted on the target side without a synced delete
+                        _unlink(state, source_id, target_id, from_local)
+                    new_id = target.write(None, record)
+                    state.link(*((source_id, new_id) if from_local else (new_id, source_id)))
+                    report['inserted'] += 1
+                elif record['updated_at'] and record['updated_at'] > target_updated:
+                    target.write(target_id, record)
+                    report['updated'] += 1
+                else:
+                    report['skipped'] += 1
+            elif target_id is not None:
+                # Deleted at the source (or gone before it could be fetched)
+                _unlink(state, source_id, target_id, from_local)
+                deleted_at = _naive_utc(latest[source_id].changed_at)
+                if target_updated is not None and deleted_at is not None and target_updated > deleted_at:
+                    # Edited on the target after the delete: keep it and send it back as new
+                    target.touch(target_id)
+                    report['skipped'] += 1
+                else:
+                    target.delete(target_id)
+                    report['deleted'] += 1
+
+        for change in changes:
+            gaps.pop(change.id, None)
+            # Ids skipped over may belong to transactions that have not committed yet
+            gaps.update(dict.fromkeys(range(max(position + 1, change.id - MAX_GAPS), change.id), now))
+            position = max(position, change.id)
+        # Keep the newest; a long run of missing ids is a rollback rather than open transactions
+        for change_id in sorted(gaps)[:-MAX_GAPS]:
+            del gaps[change_id]
+        state.save_position(direction, position, gaps)
+        commit()
+    # Also records the ids given up on when the log had nothing new
+    state.save_position(direction, position, gaps)
+    source.prune(position, list(gaps))
+    commit()
+    return report
+
+
+def _unlink(state, source_id, target_id, from_local):
+    state.unlink(source_id if from_local else target_id)
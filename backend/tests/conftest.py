@@ -4,28 +4,45 @@ Pytest configuration file for Flask backend tests
 import pytest
 import tempfile
 import os
-from app import app, db, User, Property
+
+# TEST_DATABASE_URL runs the suite against another backend, e.g.
+#   TEST_DATABASE_URL=postgresql://postgres@localhost/realestate_test pytest
+db_fd, db_path = tempfile.mkstemp(suffix='.db')
+
+from app import create_app, db, User, Property, response_cache
+from db_config import database_uri
+
+app = create_app({
+    'TESTING': True,
+    'SQLALCHEMY_DATABASE_URI': database_uri({'SQLALCHEMY_DATABASE_URI': os.getenv('TEST_DATABASE_URL')
+                                             or f'sqlite:///{db_path}'}),
+    'JWT_SECRET_KEY': 'test-secret-key',
+    # Cheapest bcrypt cost, hashed inline: tests exercise the flow, not the cost
+    'BCRYPT_LOG_ROUNDS': 4,
+    'PASSWORD_HASH_WORKERS': 0,
+    # Every test client comes from 127.0.0.1 and would share one login bucket
+    'RATELIMIT_ENABLED': False,
+})
+
+
+def pytest_sessionfinish(session, exitstatus):
+    os.close(db_fd)
+    os.unlink(db_path)
 
 
 @pytest.fixture
 def app_instance():
     """Create and configure a new app instance for each test."""
-    # Create a temporary file to serve as the test database
-    db_fd, db_path = tempfile.mkstemp()
-
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
     app.config['WTF_CSRF_ENABLED'] = False
-    app.config['JWT_SECRET_KEY'] = 'test-secret-key'
 
     with app.app_context():
         db.create_all()
+        # Tables are recreated per test, so responses cached by earlier tests are stale
+        response_cache.invalidate()
         yield app
+        db.session.remove()
         db.drop_all()
 
-    os.close(db_fd)
-    os.unlink(db_path)
-
 
 @pytest.fixture
 def client(app_instance):
@@ -0,0 +1,67 @@
+"""
+Access tokens: revoked by a token version bump or by deleting the user,
+and authorization following the user's current role rather than the one
+the token was issued with.
+"""
+from auth import UserStateCache
+from app import db, User
+
+ME = '/api/auth/me'
+ADMIN_ONLY = '/api/admin/properties'
+
+
+def user_named(email):
+    return db.session.scalars(db.select(User).where(User.email == email)).one()
+
+
+def test_token_version_bump_revokes_issued_tokens(client, runner, login_user, auth_headers):
+    assert client.get(ME, headers=auth_headers(login_user)).status_code == 200
+
+    result = runner.invoke(args=['revoke-tokens', 'test@example.com'])
+    assert 'revoked' in result.output
+    assert client.get(ME, headers=auth_headers(login_user)).status_code == 401
+
+    fresh = client.post('/api/auth/login', json={'email': 'test@example.com', 'password': 'testpassword'})
+    assert client.get(ME, headers=auth_headers(fresh.json['access_token'])).status_code == 200
+
+
+def test_deleted_user_tokens_are_revoked(client, login_user, auth_headers):
+    assert client.get(ME, headers=auth_headers(login_user)).status_code == 200
+    db.session.delete(user_named('test@example.com'))
+    db.session.commit()
+    assert client.get(ME, headers=auth_headers(login_user)).status_code == 401
+
+
+def test_role_changes_apply_to_tokens_already_issued(client, login_user, login_admin, auth_headers):
+    user_token, admin_token = auth_headers(login_user), auth_headers(login_admin)
+    assert client.get(ADMIN_ONLY, headers=user_token).status_code == 403
+    assert client.get(ME, headers=user_token).json['logged_in_as']['role'] == 'user'
+
+    user_named('test@example.com').role = 'admin'
+    user_named('admin@example.com').role = 'user'
+    db.session.commit()
+
+    assert client.get(ADMIN_ONLY, headers=user_token).status_code == 200
+    assert client.get(ME, headers=user_token).json['logged_in_as']['role'] == 'admin'
+    assert client.get(ADMIN_ONLY, headers=admin_token).status_code == 403
+    assert client.get(ME, headers=admin_token).json['logged_in_as']['role'] == 'user'
+
+
+def test_user_state_cache_treats_missing_users_as_revoked():
+    rows = {1: User(role='admin', token_version=2)}
+    loads = []
+
+    def load(user_id):
+        loads.append(user_id)
+        return rows.get(user_id)
+
+    cache = UserStateCache(load, ttl=60)
+    assert not cache.is_revoked({'sub': '1', 'ver': 2})
+    assert cache.is_revoked({'sub': '1', 'ver': 1})
+    assert cache.is_revoked({'sub': '2', 'ver': 0})
+    assert cache.is_revoked({'sub': '2', 'ver': 0})
+    assert loads == [1, 2]
+
+    rows[2] = User(role='user', token_version=0)
+    cache.invalidate([2])
+    assert not cache.is_revoked({'sub': '2', 'ver': 0})
@@ -0,0 +1,172 @@
+"""
+Bookings: no double-booking under concurrent reservations, and the
+availability search against a brute-force reference and its query plan.
+"""
+import os
+import random
+import threading
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import text
+from werkzeug.datastructures import MultiDict
+
+import bookings
+from app import db, Booking, Property
+
+THREADS = 12
+ATTEMPTS_PER_THREAD = 8
+HORIZON_DAYS = 30
+
+
+@pytest.fixture
+def properties(app_instance):
+    rows = [
+        Property(title=f'Stay {i}', description='Bookable', price=100, location='Manga, Cartagena', bedrooms=2,
+                 bathrooms=1, area=70)
+        for i in range(3)
+    ]
+    db.session.add_all(rows)
+    db.session.commit()
+    return [row.id for row in rows]
+
+
+def booking_payload(property_id, check_in, nights):
+    return {
+        'property_id': property_id,
+        'guest_name': 'Guest',
+        'guest_email': 'guest@example.com',
+        'check_in_date': check_in.isoformat(),
+        'check_out_date': (check_in + timedelta(days=nights)).isoformat(),
+        'guests_count': 2,
+        'total_price': 100.0 * nights,
+    }
+
+
+def run_concurrently(app, payloads_per_thread):
+    """POSTs each thread's payloads from its own client, all threads starting together."""
+    barrier = threading.Barrier(len(payloads_per_thread))
+    results = [[] for _ in payloads_per_thread]
+    errors = []
+
+    def worker(index, payloads):
+        client = app.test_client()
+        try:
+            barrier.wait()
+            for payload in payloads:
+                response = client.post('/api/bookings', json=payload)
+                results[index].append((payload, response.status_code))
+        except Exception as e:  # surfaced by the assertion below
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i, p)) for i, p in enumerate(payloads_per_thread)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+    return [result for per_thread in results for result in per_thread]
+
+
+def blocking_stays(property_id):
+    return db.session.execute(
+        db.select(Booking.check_in_date, Booking.check_out_date)
+        .where(Booking.property_id == property_id, Booking.status.in_(bookings.BLOCKING_STATUSES))
+        .order_by(Booking.check_in_date)
+    ).all()
+
+
+def test_same_stay_is_booked_once(app_instance, properties):
+    start = bookings.today() + timedelta(days=7)
+    payload = booking_payload(properties[0], start, 3)
+    results = run_concurrently(app_instance, [[payload]] * THREADS)
+
+    statuses = sorted(status for _, status in results)
+    assert statuses == [201] + [409] * (THREADS - 1)
+    assert len(blocking_stays(properties[0])) == 1
+
+
+def test_concurrent_reservations_never_overlap(app_instance, properties):
+    start = bookings.today() + timedelta(days=1)
+    payloads_per_thread = []
+    for thread in range(THREADS):
+        rng = random.Random(thread)
+        payloads_per_thread.append([
+            booking_payload(rng.choice(properties), start + timedelta(days=rng.randrange(HORIZON_DAYS)),
+                            rng.randint(1, 5))
+            for _ in range(ATTEMPTS_PER_THREAD)
+        ])
+    results = run_concurrently(app_instance, payloads_per_thread)
+
+    assert {status for _, status in results} <= {201, 409}
+    created = sum(status == 201 for _, status in results)
+    assert created > len(properties)  # contention, but not everything refused
+    stored = 0
+    for property_id in properties:
+        stays = blocking_stays(property_id)
+        stored += len(stays)
+        for earlier, later in zip(stays, stays[1:]):
+            assert earlier.check_out_date <= later.check_in_date, f'property {property_id}: {earlier} and {later}'
+    assert stored == created
+    if db.engine.dialect.name == 'sqlite':
+        assert db.session.scalar(text(f'SELECT count(*) FROM {bookings.RTREE_TABLE}')) == created
+
+
+def test_available_search_matches_brute_force(app_instance, properties, client):
+    start = bookings.today() + timedelta(days=1)
+    rng = random.Random(7)
+    for _ in range(40):
+        client.post('/api/bookings', json=booking_payload(
+            rng.choice(properties), start + timedelta(days=rng.randrange(HORIZON_DAYS)), rng.randint(1, 4)))
+    cancelled = db.session.scalars(db.select(Booking).limit(2)).all()
+    for booking in cancelled:
+        booking.status = 'cancelled'
+    db.session.commit()
+
+    all_bookings = db.session.scalars(db.select(Booking)).all()
+    for offset in range(0, HORIZON_DAYS, 3):
+        check_in = start + timedelta(days=offset)
+        check_out = check_in + timedelta(days=2)
+        expected = {
+            property_id for property_id in properties
+            if not any(b.property_id == property_id and b.status in bookings.BLOCKING_STATUSES
+                       and b.check_in_date < check_out and b.check_out_date > check_in for b in all_bookings)
+        }
+        response = client.get('/api/properties/available', query_string={
+            'check_in': check_in.isoformat(), 'check_out': check_out.isoformat(), 'fields': 'id'})
+        assert response.status_code == 200
+        assert {item['id'] for item in response.json} == expected, f'{check_in} to {check_out}'
+
+
+def test_cancelled_dates_can_be_rebooked(app_instance, properties, client):
+    check_in = bookings.today() + timedelta(days=3)
+    first = client.post('/api/bookings', json=booking_payload(properties[0], check_in, 2))
+    assert first.status_code == 201
+    assert client.post('/api/bookings', json=booking_payload(properties[0], check_in, 2)).status_code == 409
+
+    db.session.get(Booking, first.json['id']).status = 'cancelled'
+    db.session.commit()
+    assert client.post('/api/bookings', json=booking_payload(properties[0], check_in, 2)).status_code == 201
+    # The day of check-out is free for the next arrival
+    assert client.post('/api/bookings', json=booking_payload(properties[0], check_in + timedelta(days=2), 1)
+                       ).status_code == 201
+
+    calendar = client.get(f'/api/properties/{properties[0]}/calendar').json['booked']
+    assert [(stay['check_in_date'], stay['check_out_date']) for stay in calendar] == [
+        (check_in.isoformat(), (check_in + timedelta(days=2)).isoformat()),
+        ((check_in + timedelta(days=2)).isoformat(), (check_in + timedelta(days=3)).isoformat()),
+    ]
+
+
+@pytest.mark.skipif(not (os.getenv('TEST_DATABASE_URL') or 'sqlite').startswith('sqlite'),
+                    reason='query plan checks target SQLite')
+def test_available_search_uses_interval_index(app_instance):
+    check_in = bookings.today()
+    query = bookings.AvailabilityQuery(
+        Property, MultiDict({'check_in': check_in.isoformat(), 'check_out': (check_in + timedelta(days=3)).isoformat()}),
+        booking_table=Booking.__table__, dialect='sqlite')
+    sql = str(query.statement().compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    plan = [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+
+    assert any(step.startswith(f'SCAN {bookings.RTREE_TABLE} VIRTUAL TABLE INDEX') for step in plan), plan
+    assert not any(step.startswith('SCAN booking ') or step == 'SCAN booking' for step in plan), plan
@@ -0,0 +1,153 @@
+"""
+Bulk import: batched writes, per-line errors for bad input, the caches
+catching up with what the import committed, and lists copied over from the
+old comma-separated columns.
+"""
+import io
+import json
+
+from sqlalchemy import event, insert, text
+
+import bulk
+import geo
+from app import db, Property, PropertyImage
+
+ADMIN_BULK = '/api/admin/properties/bulk'
+
+
+def listing(i, **overrides):
+    return {'title': f'Imported {i}', 'description': 'Bulk', 'price': 100000 + i, 'location': 'Manga',
+            'bedrooms': 2, 'bathrooms': 1, 'area': 80, 'amenities': ['Pool', f'View {i % 3}'],
+            'images': [f'https://cdn.example.com/{i}.jpg'], **overrides}
+
+
+def ndjson(records):
+    return ''.join(json.dumps(record) + '\n' for record in records).encode()
+
+
+def post_import(client, headers, body, **args):
+    return client.post(ADMIN_BULK, data=body, headers=headers, content_type='application/x-ndjson',
+                       query_string=args)
+
+
+class StatementCounter:
+    """Counts executions (an executemany counts once) of statements starting with ``prefix``."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith(self.prefix):
+            self.count += 1
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self)
+
+
+def test_import_writes_each_batch_with_one_insert(client, login_admin, auth_headers):
+    with StatementCounter('INSERT INTO property ') as inserts:
+        response = post_import(client, auth_headers(login_admin), ndjson(listing(i) for i in range(200)),
+                               batch_size=50)
+
+    assert response.status_code == 200
+    assert response.json == {'inserted': 200, 'updated': 0, 'failed': 0, 'errors': []}
+    assert inserts.count == 4
+    stored = db.session.scalars(db.select(Property).order_by(Property.id)).all()
+    assert [p.title for p in stored] == [f'Imported {i}' for i in range(200)]
+    # Related rows went to the ids each listing actually got
+    assert all(p.images == [f'https://cdn.example.com/{p.title.split()[1]}.jpg'] for p in stored)
+    assert stored[7].amenities == sorted(['Pool', 'View 1'])
+
+
+def test_import_updates_by_id_and_reports_bad_lines(client, login_admin, auth_headers, sample_property):
+    existing_id = db.session.scalar(db.select(Property.id))
+    body = b''.join([
+        ndjson([listing(1, id=existing_id, title='Renamed')]),
+        b'{not json\n',
+        ndjson([listing(2, price='cheap'), listing(3, bedrooms=None), listing(4)]),
+    ])
+    response = post_import(client, auth_headers(login_admin), body)
+
+    assert response.status_code == 200
+    assert (response.json['inserted'], response.json['updated'], response.json['failed']) == (1, 1, 3)
+    assert [error['line'] for error in response.json['errors']] == [2, 3, 4]
+    assert db.session.get(Property, existing_id).title == 'Renamed'
+
+
+def test_imported_rows_are_geocoded(client, login_admin, auth_headers):
+    records = [listing(1, location='Bocagrande, Cartagena'), listing(2, location='Nowhere in particular'),
+               listing(3, location='Bocagrande, Cartagena', latitude=10.5, longitude=-75.25)]
+    response = post_import(client, auth_headers(login_admin), ndjson(records))
+    assert response.json['inserted'] == 3
+    stored = db.session.execute(db.select(Property.id, Property.latitude, Property.longitude)
+                                .order_by(Property.id)).all()
+    assert [(row.latitude, row.longitude) for row in stored] == [
+        geo.DEFAULT_PLACES['Bocagrande, Cartagena'], (None, None), (10.5, -75.25)]
+
+    # A new location replaces the coordinates; an unchanged one keeps them
+    moved = listing(1, id=stored[0].id, location='Getsemaní, Cartagena')
+    unchanged = listing(3, id=stored[2].id, location='Bocagrande, Cartagena', price=1)
+    assert post_import(client, auth_headers(login_admin), ndjson([moved, unchanged])).json['updated'] == 2
+    db.session.expire_all()
+    assert [(row.latitude, row.longitude) for row in db.session.execute(
+        db.select(Property.latitude, Property.longitude).where(Property.id.in_([stored[0].id, stored[2].id]))
+        .order_by(Property.id))] == [geo.DEFAULT_PLACES['Getsemaní, Cartagena'], (10.5, -75.25)]
+
+
+def test_lines_that_are_not_utf8_are_rejected_alone(client, login_admin, auth_headers):
+    assert client.get('/api/properties').json == []  # now cached
+    latin1 = json.dumps(listing(9, title='Café'), ensure_ascii=False).encode('latin-1') + b'\n'
+    body = ndjson(listing(i) for i in range(3)) + latin1 + ndjson([listing(4)])
+    response = post_import(client, auth_headers(login_admin), body, batch_size=2)
+
+    assert response.status_code == 200
+    assert response.json['inserted'] == 4
+    assert response.json['errors'] == [{'line': 4, 'error': 'Invalid UTF-8'}]
+    assert len(client.get('/api/properties').json) == 4
+
+
+def test_strictly_decoded_stream_stops_at_bad_bytes():
+    stream = io.TextIOWrapper(io.BytesIO(ndjson([listing(1)]) + b'\xff\n'), encoding='utf-8')
+    records = list(bulk.iter_records(stream, 'ndjson'))
+    assert len(records) == 1 and isinstance(records[0][1], bulk.RowError)
+
+
+def test_batch_size_must_be_positive(client, login_admin, auth_headers):
+    for value in ('0', '-5', 'many'):
+        response = post_import(client, auth_headers(login_admin), ndjson([listing(1)]), batch_size=value)
+        assert response.status_code == 400
+    assert db.session.scalar(db.select(db.func.count()).select_from(Property)) == 0
+
+
+def test_old_list_columns_are_copied_in_resumable_batches(client, runner, login_admin, auth_headers):
+    # A database between e2a8c41d7b59 and 8a4d6c2e9f13: the old columns still hold the lists
+    db.session.execute(text('ALTER TABLE property ADD COLUMN images TEXT'))
+    db.session.execute(text('ALTER TABLE property ADD COLUMN amenities TEXT'))
+    db.session.execute(insert(Property.__table__), [
+        {'title': f'Old {i}', 'description': 'Legacy', 'price': 100000, 'location': 'Manga', 'bedrooms': 2,
+         'bathrooms': 1, 'area': 80, 'is_available': True} for i in range(5)])
+    db.session.execute(text("UPDATE property SET images = 'a.jpg, b.jpg,a.jpg', amenities = 'Pool,Gym'"))
+    db.session.commit()
+    ids = db.session.scalars(db.select(Property.id).order_by(Property.id)).all()
+    # Edited through the app before the copy ran: its new list wins
+    client.put(f'/api/admin/properties/{ids[0]}', json={'images': ['new.jpg']}, headers=auth_headers(login_admin))
+
+    result = runner.invoke(args=['normalize-properties', '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'of 5 properties' in result.output
+    db.session.expire_all()
+    stored = db.session.scalars(db.select(Property).order_by(Property.id)).all()
+    assert stored[0].images == ['new.jpg']
+    assert all(p.images == ['a.jpg', 'b.jpg'] for p in stored[1:])
+    assert all(p.amenities == ['Gym', 'Pool'] for p in stored)
+    assert db.session.execute(text('SELECT count(*) FROM property WHERE images IS NOT NULL '
+                                   'OR amenities IS NOT NULL')).scalar() == 0
+
+    # Nothing is left to copy, and a rerun does not duplicate anything
+    assert 'of 0 properties' in runner.invoke(args=['normalize-properties']).output
+    assert db.session.scalar(db.select(db.func.count()).select_from(PropertyImage)) == 9
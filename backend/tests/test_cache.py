@@ -0,0 +1,109 @@
+"""
+Response cache: a miss followed by hits until a write bumps the generation,
+conditional requests answered with 304, per-client responses never stored,
+and the stored body kept free of any Content-Encoding.
+"""
+import gzip
+import json
+
+import pytest
+from flask import Flask, jsonify, request
+
+from app import db, Property, response_cache
+from cache import MemoryCache, ResponseCache
+
+LISTINGS = '/api/properties'
+
+
+@pytest.fixture
+def listing_ids(app_instance):
+    rows = [Property(title=f'Cached {i}', description='A listing long enough to be worth compressing ' * 4,
+                     price=100000 + i, location='Manga', bedrooms=2, bathrooms=1, area=80) for i in range(12)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return [row.id for row in rows]
+
+
+def test_hit_after_miss_until_a_write(client, listing_ids, login_admin, auth_headers):
+    first = client.get(LISTINGS)
+    second = client.get(LISTINGS)
+    assert (first.headers['X-Cache'], second.headers['X-Cache']) == ('MISS', 'HIT')
+    assert first.get_data() == second.get_data() and first.headers['ETag'] == second.headers['ETag']
+    # Another query string is another entry
+    assert client.get(LISTINGS, query_string={'limit': 3}).headers['X-Cache'] == 'MISS'
+
+    client.put(f'/api/admin/properties/{listing_ids[0]}', json={'title': 'Renamed'},
+               headers=auth_headers(login_admin))
+    after = client.get(LISTINGS)
+    assert after.headers['X-Cache'] == 'MISS'
+    assert 'Renamed' in [item['title'] for item in after.json]
+    assert after.headers['ETag'] != first.headers['ETag']
+
+
+def test_if_none_match_answers_304_on_miss_and_hit(client, listing_ids):
+    etag = client.get(f'{LISTINGS}/{listing_ids[0]}').headers['ETag']
+    hit = client.get(f'{LISTINGS}/{listing_ids[0]}', headers={'If-None-Match': etag})
+    assert (hit.status_code, hit.get_data()) == (304, b'')
+
+    # Revalidating against a new generation still matches the unchanged body
+    response_cache.invalidate()
+    miss = client.get(f'{LISTINGS}/{listing_ids[0]}', headers={'If-None-Match': etag})
+    assert miss.status_code == 304
+    assert client.get(f'{LISTINGS}/{listing_ids[0]}', headers={'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_link_headers_are_not_shared_between_hosts(client, listing_ids):
+    a = client.get(LISTINGS, query_string={'limit': 2}, base_url='http://a.example')
+    b = client.get(LISTINGS, query_string={'limit': 2}, base_url='http://b.example')
+    assert 'http://a.example/' in a.headers['Link'] and 'http://b.example/' in b.headers['Link']
+
+
+def test_stored_body_is_the_identity_encoding(client, listing_ids):
+    compressed = client.get(LISTINGS, headers={'Accept-Encoding': 'gzip'})
+    assert (compressed.headers['X-Cache'], compressed.headers['Content-Encoding']) == ('MISS', 'gzip')
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+
+    plain = client.get(LISTINGS)
+    assert plain.headers['X-Cache'] == 'HIT' and 'Content-Encoding' not in plain.headers
+    assert json.loads(gzip.decompress(compressed.get_data())) == plain.json
+
+
+@pytest.fixture
+def private_views():
+    """A bare app whose cached views answer per client."""
+    app = Flask(__name__)
+    cache = ResponseCache(MemoryCache())
+
+    @app.route('/whoami')
+    @cache.cached
+    def whoami():
+        response = jsonify({'user': request.headers.get('Authorization')})
+        response.vary.add('Authorization')
+        return response
+
+    @app.route('/visit')
+    @cache.cached
+    def visit():
+        response = jsonify({'welcome': True})
+        response.set_cookie('visited', '1')
+        return response
+
+    @app.route('/public')
+    @cache.cached
+    def public():
+        return jsonify({'user': None})
+
+    return app.test_client()
+
+
+def test_per_client_responses_are_never_replayed(private_views):
+    assert private_views.get('/whoami', headers={'Authorization': 'Bearer alice'}).json == {'user': 'Bearer alice'}
+    bob = private_views.get('/whoami', headers={'Authorization': 'Bearer bob'})
+    assert bob.json == {'user': 'Bearer bob'} and 'X-Cache' not in bob.headers
+
+    for _ in range(2):
+        visit = private_views.get('/visit')
+        assert 'X-Cache' not in visit.headers and 'visited=1' in visit.headers['Set-Cookie']
+
+    private_views.get('/public')
+    assert private_views.get('/public').headers['X-Cache'] == 'HIT'
@@ -0,0 +1,138 @@
+"""
+Fast JSON and response compression: orjson output matching Flask's encoding
+of Decimal and datetime values, Content-Encoding negotiation, the minimum
+size below which bodies are sent as is, and ``Vary: Accept-Encoding``.
+"""
+import gzip
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+from flask import Flask, Response, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+import compression
+import jsonio
+
+VALUES = {'price': Decimal('250000.10'), 'listed': datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+          'available_from': date(2026, 1, 2), 'location': 'Bogotá'}
+
+
+@pytest.fixture
+def app():
+    """A bare app with the fast provider and a compressor with a 100 byte threshold."""
+    app = Flask(__name__)
+    app.json = jsonio.FastJSONProvider(app)
+    compression.init_app(app, compression.Compressor(min_size=100))
+
+    @app.route('/values')
+    def values():
+        return jsonify(VALUES)
+
+    @app.route('/small')
+    def small():
+        return jsonify({'ok': True})
+
+    @app.route('/large')
+    def large():
+        return jsonify([{'title': f'Listing {i}', 'location': 'Manga'} for i in range(50)])
+
+    @app.route('/image')
+    def image():
+        return Response(b'\x89PNG' + b'\0' * 1000, mimetype='image/png')
+
+    @app.route('/export')
+    def export():
+        return Response(jsonio.iter_ndjson(({'n': n} for n in range(500)), app.json.dumps_bytes, chunk_size=256),
+                        mimetype='application/x-ndjson')
+
+    return app
+
+
+def test_orjson_encodes_decimal_and_datetime_like_flask(app):
+    pytest.importorskip('orjson')
+    body = app.test_client().get('/values').get_data()
+    stock = Flask(__name__)
+    with stock.app_context():
+        expected = DefaultJSONProvider(stock).dumps(VALUES)
+    assert json.loads(body) == json.loads(expected) == {
+        'available_from': 'Fri, 02 Jan 2026 00:00:00 GMT', 'listed': 'Fri, 02 Jan 2026 03:04:05 GMT',
+        'location': 'Bogotá', 'price': '250000.10'}
+    # Sorted keys, UTF-8 rather than \u escapes, and the trailing newline
+    assert body.startswith(b'{"available_from"') and 'Bogotá'.encode() in body and body.endswith(b'}\n')
+
+
+def test_gzip_when_accepted(app):
+    client = app.test_client()
+    compressed = client.get('/large', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['Vary'] == 'Accept-Encoding'
+    plain = client.get('/large')
+    assert 'Content-Encoding' not in plain.headers and plain.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+
+    # An encoding refused with q=0 is never used
+    assert 'Content-Encoding' not in client.get('/large', headers={'Accept-Encoding': 'gzip;q=0'}).headers
+
+
+@pytest.mark.skipif(compression.brotli is None, reason='brotli is not installed')
+def test_brotli_preferred_when_installed(app):
+    client = app.test_client()
+    response = client.get('/large', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert compression.brotli.decompress(response.get_data()) == client.get('/large').get_data()
+    assert client.get('/large', headers={'Accept-Encoding': 'gzip, br;q=0.5'}).headers['Content-Encoding'] == 'gzip'
+
+
+@pytest.mark.skipif(compression.brotli is not None, reason='brotli is installed')
+def test_gzip_when_brotli_is_missing(app):
+    client = app.test_client()
+    response = client.get('/large', headers={'Accept-Encoding': 'br, gzip;q=0.5'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in client.get('/large', headers={'Accept-Encoding': 'br'}).headers
+
+
+def test_bodies_under_the_minimum_size_are_sent_as_is(app):
+    client = app.test_client()
+    small = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers and 'Vary' not in small.headers
+    assert small.json == {'ok': True}
+    # Nor are bodies that are not text
+    image = client.get('/image', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in image.headers and 'Vary' not in image.headers
+
+
+def test_streamed_exports_are_compressed_whatever_their_size(app):
+    response = app.test_client().get('/export', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip' and 'Content-Length' not in response.headers
+    lines = gzip.decompress(response.get_data()).splitlines()
+    assert [json.loads(line) for line in lines] == [{'n': n} for n in range(500)]
+
+
+def test_strong_etags_become_weak_and_compress_once(app, monkeypatch):
+    @app.route('/tagged')
+    def tagged():
+        response = jsonify([{'title': f'Listing {i}'} for i in range(50)])
+        response.set_etag('abc')
+        return response
+
+    compressor = app.extensions['compressor']
+    calls = []
+    compress = compressor.compress
+
+    def counted(data, encoding):
+        calls.append(encoding)
+        return compress(data, encoding)
+
+    monkeypatch.setattr(compressor, 'compress', counted)
+    client = app.test_client()
+    first, second = (client.get('/tagged', headers={'Accept-Encoding': 'gzip'}) for _ in range(2))
+    assert first.headers['ETag'] == 'W/"abc"' and first.get_data() == second.get_data()
+    assert calls == ['gzip']
+
+
+def test_compression_can_be_switched_off(app):
+    app.config['COMPRESS_ENABLED'] = False
+    response = app.test_client().get('/large', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
@@ -0,0 +1,84 @@
+"""
+Coordinates: validated and only ever replaced as a pair, filled in from the
+location when left out, and the spatial queries answering from them.
+"""
+import pytest
+
+import geo
+from app import db, Property
+
+ADMIN_PROPERTIES = '/api/admin/properties'
+
+
+def new_listing(**overrides):
+    return {'title': 'Listing', 'description': 'On the map', 'price': 300000, 'location': 'Manga, Cartagena',
+            'bedrooms': 2, 'bathrooms': 1, 'area': 90, **overrides}
+
+
+@pytest.fixture
+def admin(client, login_admin, auth_headers):
+    return auth_headers(login_admin)
+
+
+def create(client, admin, **overrides):
+    response = client.post(ADMIN_PROPERTIES, json=new_listing(**overrides), headers=admin)
+    assert response.status_code == 201, response.json
+    return response.json
+
+
+def test_missing_coordinates_are_geocoded_from_location(client, admin):
+    created = create(client, admin)
+    assert (created['latitude'], created['longitude']) == geo.DEFAULT_PLACES['Manga, Cartagena']
+
+    moved = client.put(f'{ADMIN_PROPERTIES}/{created["id"]}', json={'location': 'Getsemaní, Cartagena'},
+                       headers=admin).json
+    assert (moved['latitude'], moved['longitude']) == geo.DEFAULT_PLACES['Getsemaní, Cartagena']
+
+
+def test_explicit_coordinates_are_kept(client, admin):
+    created = create(client, admin, latitude=10.5, longitude='-75.25')
+    assert (created['latitude'], created['longitude']) == (10.5, -75.25)
+
+
+@pytest.mark.parametrize('coordinates', [
+    {'latitude': 10.4},
+    {'longitude': -75.5},
+    {'latitude': None},
+    {'latitude': 10.4, 'longitude': None},
+    {'latitude': 91, 'longitude': -75.5},
+    {'latitude': 10.4, 'longitude': -181},
+    {'latitude': 'north', 'longitude': -75.5},
+])
+def test_invalid_or_partial_coordinates_are_rejected(client, admin, coordinates):
+    response = client.post(ADMIN_PROPERTIES, json=new_listing(**coordinates), headers=admin)
+    assert response.status_code == 400
+
+    created = create(client, admin, latitude=10.41, longitude=-75.54)
+    response = client.put(f'{ADMIN_PROPERTIES}/{created["id"]}', json=coordinates, headers=admin)
+    assert response.status_code == 400
+    stored = db.session.get(Property, created['id'])
+    assert (stored.latitude, stored.longitude) == (10.41, -75.54)
+
+
+def test_point_is_replaced_whole_or_cleared(client, admin):
+    created = create(client, admin, latitude=10.41, longitude=-75.54)
+    url = f'{ADMIN_PROPERTIES}/{created["id"]}'
+
+    moved = client.put(url, json={'latitude': 10.42, 'longitude': -75.55}, headers=admin).json
+    assert (moved['latitude'], moved['longitude']) == (10.42, -75.55)
+    # Both null hands the point back to the geocoder
+    cleared = client.put(url, json={'latitude': None, 'longitude': None}, headers=admin).json
+    assert (cleared['latitude'], cleared['longitude']) == (None, None)
+
+
+def test_near_returns_listings_within_radius_nearest_first(client, admin):
+    near = create(client, admin, latitude=10.4105, longitude=-75.5360)
+    nearer = create(client, admin, latitude=10.4010, longitude=-75.5360)
+    create(client, admin, location='Bogotá')
+
+    items = client.get('/api/properties/near', query_string={'lat': 10.40, 'lng': -75.536, 'radius_km': 3}).json
+    assert [item['id'] for item in items] == [nearer['id'], near['id']]
+    assert items[0]['distance_km'] < items[1]['distance_km'] < 3
+
+    for args in ({'lat': 10.4}, {'lat': 95, 'lng': 0}, {'lat': 10.4, 'lng': -75.5, 'radius_km': 0}):
+        assert client.get('/api/properties/near', query_string=args).status_code == 400
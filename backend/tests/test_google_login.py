@@ -0,0 +1,269 @@
+"""
+Google sign-in against a local stub OpenID provider: ID tokens verified
+from cached keys, connections pooled and reused by concurrent callbacks,
+timeouts opening the circuit breaker, and half-open trials always ending.
+"""
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import oidc
+from app import db, google_provider, User
+
+CLIENT_ID = 'test-client.apps.example.com'
+THREADS = 12
+SIGN_INS_PER_THREAD = 3
+TOKEN_DELAY = 0.1
+SIGNED_IN = 'http://localhost:3001/login/callback?token='
+FAILED = 'http://localhost:3001/login?error=oauth_failed'
+
+
+class StubProvider:
+    """
+    A threaded HTTP/1.1 OpenID provider on a free local port. Codes come
+    from ``issue_code``; the token endpoint answers after ``delay`` seconds
+    with an RS256 ID token signed by the current key. Counts requests per
+    path and the TCP connections opened.
+    """
+
+    def __init__(self):
+        self.delay = 0.0
+        self.hits = {}
+        self.connections = 0
+        self.codes = {}
+        self.published = []
+        self.signing_key = None
+        self.kid = None
+        self._lock = threading.Lock()
+        self.rotate()
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with provider._lock:
+                    provider.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                provider.handle(self, 'GET')
+
+            def do_POST(self):
+                provider.handle(self, 'POST')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler, bind_and_activate=False)
+        self.server.request_queue_size = 64  # the default backlog of 5 drops concurrent connects
+        self.server.server_bind()
+        self.server.server_activate()
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def rotate(self):
+        """Signs with a new key from now on and publishes only that one."""
+        self.signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.kid = f'key-{len(self.published) + 1}'
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.signing_key.public_key()))
+        jwk.update(kid=self.kid, use='sig', alg='RS256')
+        self.published = [jwk]
+
+    def issue_code(self, email, nonce):
+        code = base64.urlsafe_b64encode(f'{email} {nonce}'.encode()).decode()
+        self.codes[code] = (email, nonce)
+        return code
+
+    def id_token(self, email, nonce):
+        now = int(time.time())
+        return jwt.encode({
+            'iss': self.url, 'aud': CLIENT_ID, 'sub': email, 'email': email, 'email_verified': True,
+            'name': email.split('@')[0].title(), 'nonce': nonce, 'iat': now, 'exp': now + 3600,
+        }, self.signing_key, algorithm='RS256', headers={'kid': self.kid})
+
+    def handle(self, request, method):
+        path = urlsplit(request.path).path
+        with self._lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+        body = request.rfile.read(int(request.headers.get('Content-Length') or 0))
+        status, document = 200, None
+        if method == 'GET' and path == '/.well-known/openid-configuration':
+            document = {'issuer': self.url, 'authorization_endpoint': f'{self.url}/authorize',
+                        'token_endpoint': f'{self.url}/token', 'jwks_uri': f'{self.url}/jwks',
+                        'userinfo_endpoint': f'{self.url}/userinfo'}
+        elif method == 'GET' and path == '/jwks':
+            document = {'keys': self.published}
+        elif method == 'POST' and path == '/token':
+            time.sleep(self.delay)
+            code = parse_qs(body.decode())['code'][0]
+            if code in self.codes:
+                document = {'access_token': 'stub-access-token', 'token_type': 'Bearer', 'expires_in': 3600,
+                            'id_token': self.id_token(*self.codes.pop(code))}
+            else:
+                status, document = 400, {'error': 'invalid_grant'}
+        else:
+            status, document = 404, {'error': 'not_found'}
+        payload = json.dumps(document).encode()
+        try:
+            request.send_response(status)
+            request.send_header('Content-Type', 'application/json')
+            request.send_header('Content-Length', str(len(payload)))
+            request.send_header('Cache-Control', 'public, max-age=3600')
+            request.end_headers()
+            request.wfile.write(payload)
+        except OSError:
+            pass  # the client gave up waiting
+
+
+@pytest.fixture
+def stub(app_instance):
+    provider = StubProvider()
+    provider.start()
+    saved = {name: getattr(google_provider, name) for name in (
+        'discovery_url', 'client_id', 'client_secret', 'connect_timeout', 'read_timeout', 'pool_size',
+        'failure_threshold', 'reset_seconds')}
+    google_provider.configure(discovery_url=f'{provider.url}/.well-known/openid-configuration',
+                              client_id=CLIENT_ID, client_secret='stub-secret', connect_timeout=1,
+                              read_timeout=1, pool_size=THREADS, failure_threshold=3, reset_seconds=60)
+    yield provider
+    provider.stop()
+    for name, value in saved.items():
+        setattr(google_provider, name, value)
+    google_provider.configure()
+
+
+def sign_in(client, stub, email, nonce=None):
+    """Runs the login redirect and the callback; returns the callback response and its duration."""
+    login = client.get('/api/auth/google/login')
+    assert login.status_code == 302
+    assert login.location.startswith(f'{stub.url}/authorize?')
+    query = parse_qs(urlsplit(login.location).query)
+    code = stub.issue_code(email, nonce or query['nonce'][0])
+    started = time.perf_counter()
+    response = client.get('/api/auth/google/callback', query_string={'code': code, 'state': query['state'][0]})
+    return response, time.perf_counter() - started
+
+
+def test_sign_in_verifies_id_token_locally(stub, client):
+    for _ in range(3):
+        response, _ = sign_in(client, stub, 'ana@example.com')
+        assert response.status_code == 302
+        assert response.location.startswith(SIGNED_IN)
+
+    assert db.session.scalar(db.select(User.name).where(User.email == 'ana@example.com')) == 'Ana'
+    assert stub.hits.get('/userinfo', 0) == 0
+    assert stub.hits['/.well-known/openid-configuration'] == 1
+    assert stub.hits['/jwks'] == 1
+    assert stub.hits['/token'] == 3
+
+
+def test_mismatched_or_forged_sign_ins_are_refused(stub, client):
+    response, _ = sign_in(client, stub, 'ana@example.com', nonce='another-sign-in')
+    assert response.location == FAILED
+
+    login = client.get('/api/auth/google/login')
+    nonce = parse_qs(urlsplit(login.location).query)['nonce'][0]
+    response = client.get('/api/auth/google/callback', query_string={
+        'code': stub.issue_code('ana@example.com', nonce), 'state': 'forged'})
+    assert response.location == FAILED
+
+    published, kid = stub.published, stub.kid
+    stub.rotate()
+    stub.published, stub.kid = published, kid  # a new key under the published key's id
+    response, _ = sign_in(client, stub, 'ana@example.com')
+    assert response.location == FAILED
+    assert db.session.scalar(db.select(db.func.count()).select_from(User)) == 0
+
+
+def test_rotated_signing_key_is_fetched_once(stub, client):
+    assert sign_in(client, stub, 'ana@example.com')[0].location.startswith(SIGNED_IN)
+    stub.rotate()
+    for _ in range(3):
+        assert sign_in(client, stub, 'ana@example.com')[0].location.startswith(SIGNED_IN)
+    assert stub.hits['/jwks'] == 2
+
+
+def test_concurrent_callbacks_reuse_connections(stub, app_instance):
+    # Slow enough that the threads' token calls overlap
+    stub.delay = TOKEN_DELAY
+    sign_in(app_instance.test_client(), stub, 'warm-up@example.com')  # discovery and keys cached
+    barrier = threading.Barrier(THREADS)
+    locations, errors = [], []
+
+    def worker(index):
+        client = app_instance.test_client()
+        try:
+            barrier.wait()
+            for _ in range(SIGN_INS_PER_THREAD):
+                # A few accounts signed in from several threads at once
+                locations.append(sign_in(client, stub, f'guest{index % 4}@example.com')[0].location)
+        except Exception as e:  # surfaced by the assertion below
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+
+    assert len(locations) == THREADS * SIGN_INS_PER_THREAD
+    assert all(location.startswith(SIGNED_IN) for location in locations)
+    # At most one connection per pooled slot however many calls went out
+    assert stub.hits['/token'] == THREADS * SIGN_INS_PER_THREAD + 1
+    assert stub.connections <= THREADS + 1 < sum(stub.hits.values())
+    assert stub.hits['/jwks'] == 1
+    assert db.session.scalar(db.select(db.func.count()).select_from(User)) == 5
+
+
+def test_slow_provider_times_out_then_breaker_fails_fast(stub, client):
+    assert sign_in(client, stub, 'ana@example.com')[0].location.startswith(SIGNED_IN)
+    stub.delay = google_provider.read_timeout + 1
+
+    for _ in range(google_provider.failure_threshold):
+        response, seconds = sign_in(client, stub, 'ana@example.com')
+        assert response.location == FAILED
+        assert seconds < google_provider.read_timeout + 0.5
+    assert google_provider.breaker.state == 'open'
+
+    calls = stub.hits['/token']
+    response, seconds = sign_in(client, stub, 'ana@example.com')
+    assert response.location == FAILED
+    assert seconds < 0.1
+    assert stub.hits['/token'] == calls
+
+
+def test_half_open_trial_that_raises_unexpectedly_is_released(stub):
+    now = [0.0]
+    client = oidc.HTTPClient(breaker=oidc.CircuitBreaker(failure_threshold=1, reset_seconds=10,
+                                                         clock=lambda: now[0]))
+    url = f'{stub.url}/.well-known/openid-configuration'
+    stub.stop()
+    with pytest.raises(oidc.ProviderError):
+        client.request('GET', url)
+    assert client.breaker.state == 'open'
+
+    now[0] = 10
+    with pytest.raises(TypeError):
+        client.request('GET', url, unknown_argument=True)  # the trial call, failing before any I/O
+    # Neither outcome was recorded, and the next call may still try again
+    assert client.breaker.state == 'open'
+    with pytest.raises(oidc.ProviderError):
+        client.request('GET', url)
+    with pytest.raises(oidc.ProviderUnavailable):
+        client.request('GET', url)
@@ -0,0 +1,154 @@
+"""
+Background jobs: idempotent enqueues, leased claims taken back when the
+lease runs out, retries with backoff ending in the failed state, and
+concurrent workers never claiming the same job.
+"""
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import event
+
+import jobs
+from app import db, Job
+
+NOW = jobs._utcnow()
+
+
+@pytest.fixture
+def queue(app_instance):
+    queue = jobs.JobQueue(Job.__table__, lease_seconds=60)
+    queue.failures = []
+
+    @queue.task('jobs.ok')
+    def ok(n=0):
+        pass
+
+    def record_failure(payload, error):
+        queue.failures.append((payload, error.strip().splitlines()[-1]))
+
+    @queue.task('jobs.flaky', max_attempts=3, backoff=10, on_failure=record_failure)
+    def flaky(n=0):
+        raise RuntimeError(f'flaky {n}')
+
+    return queue
+
+
+def enqueue(queue, name='jobs.ok', run_at=NOW, **kwargs):
+    with db.engine.begin() as connection:
+        return queue.enqueue(connection, name, run_at=run_at, **kwargs)
+
+
+def claim(queue, worker='w1', limit=10, now=NOW):
+    with db.engine.begin() as connection:
+        return queue.claim(connection, jobs.DEFAULT_QUEUE, limit, worker, now)
+
+
+def job(job_id):
+    db.session.expire_all()
+    return db.session.get(Job, job_id)
+
+
+def test_idempotency_key_enqueues_once(queue):
+    assert enqueue(queue, payload={'n': 1}, idempotency_key='welcome:7')
+    assert not enqueue(queue, payload={'n': 2}, idempotency_key='welcome:7')
+    assert enqueue(queue, payload={'n': 3})
+    assert db.session.scalar(db.select(db.func.count()).select_from(Job)) == 2
+
+    # Through the request's session, the job exists only if the request commits
+    queue.enqueue(db.session, 'jobs.ok', idempotency_key='rolled-back')
+    db.session.rollback()
+    assert enqueue(queue, idempotency_key='rolled-back')
+
+
+def test_claim_is_one_update_returning(queue):
+    enqueue(queue)
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)  # noqa: E731
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        claimed = claim(queue)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert len(claimed) == 1
+    assert len(statements) == 1
+    assert statements[0].lstrip().startswith('UPDATE') and 'RETURNING' in statements[0]
+
+
+def test_lease_expiry_hands_the_job_to_another_worker(queue):
+    enqueue(queue)
+    [first] = claim(queue, 'w1')
+    assert (job(first.id).status, job(first.id).locked_by) == ('running', 'w1')
+    assert job(first.id).locked_until == NOW + timedelta(seconds=60)
+    assert claim(queue, 'w2') == []
+
+    # Renewed leases survive; w1 stopped renewing here
+    with db.engine.begin() as connection:
+        queue.requeue_expired(connection, NOW + timedelta(seconds=59))
+    assert claim(queue, 'w2', now=NOW + timedelta(seconds=59)) == []
+    with db.engine.begin() as connection:
+        queue.requeue_expired(connection, NOW + timedelta(seconds=61))
+    [second] = claim(queue, 'w2', now=NOW + timedelta(seconds=61))
+    assert (second.id, second.attempts) == (first.id, 2)
+    assert job(first.id).locked_by == 'w2'
+
+
+def test_failures_back_off_then_fail_for_good(queue):
+    enqueue(queue, 'jobs.flaky')
+    now = NOW
+    for attempt in (1, 2):
+        [claimed] = claim(queue, now=now)
+        assert claimed.attempts == attempt
+        with db.engine.begin() as connection:
+            assert queue.fail(connection, claimed, 'boom', now)
+        retry_at = job(claimed.id).run_at
+        # 10s doubling per attempt, jittered down to half
+        delay = 10 * 2 ** (attempt - 1)
+        assert now + timedelta(seconds=delay / 2) <= retry_at <= now + timedelta(seconds=delay)
+        assert claim(queue, now=retry_at - timedelta(seconds=1)) == []
+        now = retry_at
+
+    [claimed] = claim(queue, now=now)
+    with db.engine.begin() as connection:
+        assert not queue.fail(connection, claimed, 'boom', now)
+    assert (job(claimed.id).status, job(claimed.id).last_error) == ('failed', 'boom')
+    assert claim(queue, now=now + timedelta(days=1)) == []
+
+
+def test_worker_runs_jobs_and_reports_the_last_failure(queue, app_instance):
+    enqueue(queue, payload={'n': 1})
+    with db.engine.begin() as connection:
+        connection.execute(db.insert(Job).values(
+            queue=jobs.DEFAULT_QUEUE, name='jobs.flaky', payload='{"n": 2}', status='queued', attempts=2,
+            max_attempts=3, run_at=NOW, created_at=NOW))
+    worker = jobs.Worker(app_instance, queue, db.engine, concurrency=2)
+    try:
+        assert worker.run_once() == 2
+    finally:
+        worker.shutdown()
+    db.session.expire_all()
+    assert sorted(db.session.scalars(db.select(Job.status))) == ['done', 'failed']
+    assert queue.failures == [({'n': 2}, 'RuntimeError: flaky 2')]
+
+
+def test_concurrent_workers_never_share_a_job(queue, app_instance):
+    for n in range(40):
+        enqueue(queue, payload={'n': n})
+    claimed = {'w1': [], 'w2': []}
+    start = threading.Barrier(2)
+
+    def consume(worker):
+        with app_instance.app_context():
+            start.wait()
+            while batch := claim(queue, worker, limit=3):
+                claimed[worker] += [row.id for row in batch]
+                time.sleep(0)
+
+    threads = [threading.Thread(target=consume, args=(worker,)) for worker in claimed]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not set(claimed['w1']) & set(claimed['w2'])
+    assert len(claimed['w1']) + len(claimed['w2']) == 40
@@ -0,0 +1,102 @@
+"""
+Property listings: keyset pages that cover every row exactly once, the next
+cursor exposed in headers, and malformed sort or cursor arguments refused.
+"""
+import base64
+import json
+
+import pytest
+
+from app import db, Property
+from listing import encode_cursor
+
+
+def make_property(i, price):
+    return Property(title=f'Listing {i}', description='For paging', price=price, location='Manga',
+                    bedrooms=1 + i % 3, bathrooms=1, area=50 + i)
+
+
+@pytest.fixture
+def listings(app_instance):
+    # Repeated prices so pages have to break ties on id
+    rows = [make_property(i, price=100000 * (1 + i % 4)) for i in range(11)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return [row.id for row in rows]
+
+
+def raw_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode().rstrip('=')
+
+
+def walk(client, **args):
+    """Follows X-Next-Cursor to the end; returns the items and the number of pages."""
+    items, pages, cursor = [], 0, None
+    while True:
+        response = client.get('/api/properties', query_string={**args, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200, response.json
+        items += response.json
+        pages += 1
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            assert 'Link' not in response.headers
+            return items, pages
+        assert f'cursor={cursor}' in response.headers['Link']
+
+
+@pytest.mark.parametrize('sort', ['price', '-price', 'bedrooms', '-created_at'])
+def test_pages_cover_every_listing_once_in_order(client, listings, sort):
+    items, pages = walk(client, sort=sort, limit=3)
+    assert pages == 4
+    assert sorted(item['id'] for item in items) == sorted(listings)
+
+    field, descending = sort.lstrip('-'), sort.startswith('-')
+    keys = [(item[field], item['id']) for item in items]
+    assert keys == sorted(keys, reverse=descending)
+
+
+def test_default_page_says_more_remain(client, listings):
+    response = client.get('/api/properties')
+    assert len(response.json) == 11
+    assert 'X-Next-Cursor' not in response.headers
+
+    db.session.add_all([make_property(i, price=90000) for i in range(11, 25)])
+    db.session.commit()
+    response = client.get('/api/properties', headers={'Origin': 'http://localhost:3001'})
+    assert len(response.json) == 20
+    assert response.headers['X-Next-Cursor']
+    assert 'X-Next-Cursor' in response.headers['Access-Control-Expose-Headers']
+
+
+def test_filters_apply_to_every_page(client, listings):
+    items, _ = walk(client, sort='price', limit=2, min_price=200000, max_price=300000)
+    assert len(items) == 6
+    assert all(200000 <= item['price'] <= 300000 for item in items)
+
+
+@pytest.mark.parametrize('args', [
+    {'sort': '--price'},
+    {'sort': '-'},
+    {'sort': 'title'},
+    {'limit': '0'},
+    {'fields': 'title,secret'},
+    {'cursor': 'not base64!'},
+    {'sort': 'price', 'cursor': raw_cursor('x', 1)},
+    {'sort': 'price', 'cursor': raw_cursor(True, 1)},
+    {'sort': 'bedrooms', 'cursor': raw_cursor(2.5, 1)},
+    {'sort': 'price', 'cursor': raw_cursor(100000, '1')},
+    {'sort': '-created_at', 'cursor': raw_cursor(12, 1)},
+    {'sort': '-created_at', 'cursor': raw_cursor('yesterday', 1)},
+    {'sort': 'price', 'cursor': raw_cursor(100000)},
+])
+def test_malformed_arguments_are_rejected(client, listings, args):
+    response = client.get('/api/properties', query_string=args)
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+
+def test_cursor_from_another_page_size_still_resumes(client, listings):
+    first = client.get('/api/properties', query_string={'sort': 'price', 'limit': 4}).json
+    cursor = encode_cursor(first[-1]['price'], first[-1]['id'])
+    rest, _ = walk(client, sort='price', limit=5, cursor=cursor)
+    assert [item['id'] for item in first + rest] == [item['id'] for item in walk(client, sort='price')[0]]
@@ -0,0 +1,104 @@
+"""
+Image uploads: identical bytes stored once under one digest, one
+``media.variants`` job per image, the variants it builds served by content
+negotiation, and files that are not images or are too large turned away.
+"""
+import hashlib
+import io
+import json
+import os
+
+import pytest
+
+import media
+from app import db, generate_media_variants, Job, MediaAsset
+
+PIL = pytest.importorskip('PIL.Image')
+
+UPLOAD = '/api/admin/upload-image'
+
+
+@pytest.fixture
+def media_root(app_instance, tmp_path, monkeypatch):
+    """Uploads written under a temporary directory instead of static/uploads."""
+    monkeypatch.setitem(app_instance.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return tmp_path
+
+
+def image_bytes(color='red', size=(800, 600), fmt='PNG'):
+    buffer = io.BytesIO()
+    PIL.new('RGB', size, color).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def upload(client, headers, data, filename='photo.png'):
+    return client.post(UPLOAD, data={'file': (io.BytesIO(data), filename)}, headers=headers,
+                       content_type='multipart/form-data')
+
+
+def test_identical_uploads_share_one_digest_and_file(client, login_admin, auth_headers, media_root):
+    headers = auth_headers(login_admin)
+    data = image_bytes()
+    first = upload(client, headers, data)
+    second = upload(client, headers, data, filename='copy.png')
+    assert (first.status_code, second.status_code) == (202, 202)
+    assert first.json['digest'] == second.json['digest'] == hashlib.sha256(data).hexdigest()
+
+    digest = first.json['digest']
+    stored = [path for path in media_root.rglob('*') if path.is_file()]
+    assert stored == [media_root / media.original_path(digest, 'png')]
+    assert db.session.scalar(db.select(db.func.count()).select_from(MediaAsset)) == 1
+    # Other bytes are another asset
+    assert upload(client, headers, image_bytes('blue')).json['digest'] != digest
+
+
+def test_variants_job_is_enqueued_once_per_image(client, login_admin, auth_headers, media_root):
+    headers = auth_headers(login_admin)
+    data = image_bytes()
+    digest = upload(client, headers, data).json['digest']
+    upload(client, headers, data)
+    jobs = db.session.execute(db.select(Job.name, Job.queue, Job.payload, Job.idempotency_key)).all()
+    assert [(name, queue, json.loads(payload), key) for name, queue, payload, key in jobs] == [
+        ('media.variants', 'media', {'digest': digest}, f'media.variants:{digest}')]
+
+    generate_media_variants(digest)
+    asset = client.get(f'/api/admin/media/{digest}', headers=headers).json
+    assert asset['status'] == 'ready' and (asset['width'], asset['height']) == (800, 600)
+    assert asset['placeholder'].startswith('data:image/jpeg;base64,')
+    assert {variant['width'] for variant in asset['variants']} == {640, 768, 800}
+    # Ready images need no further job
+    assert upload(client, headers, data).status_code == 200
+    assert db.session.scalar(db.select(db.func.count()).select_from(Job)) == 1
+
+    # A variant is served in the best format the client lists
+    webp = client.get(f'/media/{media.variant_path(digest, 640, "jpeg")}', headers={'Accept': 'image/webp'})
+    assert webp.status_code == 200 and webp.headers['Content-Type'] == 'image/webp'
+    assert webp.headers['Cache-Control'] == media.IMMUTABLE_CACHE_CONTROL
+
+
+def test_files_that_are_not_images_are_rejected(client, login_admin, auth_headers, media_root):
+    headers = auth_headers(login_admin)
+    assert upload(client, headers, b'#!/bin/sh\necho hi\n', filename='script.sh').status_code == 400
+    # The name alone does not make an image
+    renamed = upload(client, headers, b'<html>not an image</html>', filename='photo.png')
+    assert renamed.status_code == 400 and 'not a PNG' in renamed.json['error']
+    assert not any(path.is_file() for path in media_root.rglob('*'))
+    assert db.session.scalar(db.select(db.func.count()).select_from(MediaAsset)) == 0
+
+
+def test_format_comes_from_the_bytes(client, login_admin, auth_headers, media_root):
+    data = image_bytes(fmt='JPEG')
+    response = upload(client, auth_headers(login_admin), data, filename='photo.png')
+    assert response.status_code == 202 and response.json['url'].endswith('.jpg')
+    assert db.session.get(MediaAsset, response.json['digest']).content_type == 'image/jpeg'
+
+
+def test_oversize_uploads_are_rejected(client, app_instance, login_admin, auth_headers, media_root, monkeypatch):
+    monkeypatch.setitem(app_instance.config, 'MEDIA_MAX_UPLOAD_SIZE', 4096)
+    headers = auth_headers(login_admin)
+    large = image_bytes(size=(64, 64)) + os.urandom(8192)
+    response = upload(client, headers, large)
+    assert response.status_code == 413 and '4096 bytes' in response.json['error']
+    assert not any(path.is_file() for path in media_root.rglob('*'))
+    # Under the limit is fine
+    assert upload(client, headers, image_bytes(size=(16, 16))).status_code == 202
@@ -0,0 +1,122 @@
+"""
+Metrics: the /metrics scrape labelled by route template, Server-Timing on
+responses, cumulative histogram buckets, label escaping, and requests that
+repeat one statement counted and logged as likely N+1 queries.
+"""
+import logging
+
+import pytest
+from flask import Flask, jsonify
+from sqlalchemy import create_engine, text
+
+import metrics
+from app import db, Property
+
+
+@pytest.fixture
+def property_id(app_instance):
+    listing = Property(title='Measured', description='Measured', price=250000, location='Manga', bedrooms=2,
+                       bathrooms=1, area=80)
+    db.session.add(listing)
+    db.session.commit()
+    return listing.id
+
+
+def sample(scrape, line_prefix):
+    """The value of the first sample line starting with ``line_prefix``, or 0."""
+    for line in scrape.splitlines():
+        if line.startswith(line_prefix + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0
+
+
+def scrape(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+    return response.get_data(as_text=True)
+
+
+def test_scrape_counts_requests_by_route_template(client, property_id):
+    counted = 'http_requests_total{route="/api/properties/<int:property_id>",method="GET",status="200"}'
+    before = sample(scrape(client), counted)
+    for _ in range(2):
+        assert client.get(f'/api/properties/{property_id}').status_code == 200
+    after = scrape(client)
+    assert sample(after, counted) == before + 2
+    # The raw path never becomes a label
+    assert f'/api/properties/{property_id}"' not in after
+    assert '# TYPE http_request_duration_seconds histogram' in after
+    assert 'db_queries_per_request_bucket{route="/api/properties/<int:property_id>",le="+Inf"}' in after
+    assert '# TYPE password_hash_queue_depth gauge' in after
+
+
+def test_scrape_requires_the_token_when_set(client, app_instance, monkeypatch):
+    monkeypatch.setitem(app_instance.config, 'METRICS_TOKEN', 's3cret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+
+def test_server_timing_reports_app_and_database_time(client, property_id):
+    timing = client.get(f'/api/properties/{property_id}').headers['Server-Timing']
+    app_part, db_part = timing.split(', ')
+    assert app_part.startswith('app;dur=') and float(app_part.split('=')[1]) > 0
+    assert db_part.startswith('db;dur=') and db_part.endswith(' queries"')
+    assert int(db_part.split('desc="')[1].split()[0]) >= 1
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(('/a',), value)
+    assert histogram.render()[2:] == [
+        # A value on a bound falls in that bucket (le is "less than or equal")
+        'latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a",le="1.0"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 3.65',
+        'latency_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    assert metrics._escape('say "hi"\\\nbye') == 'say \\"hi\\"\\\\\\nbye'
+    counter = metrics.Counter('odd_total', 'Odd labels.', ('route',))
+    counter.inc(('/a"b\n',))
+    assert counter.render()[-1] == 'odd_total{route="/a\\"b\\n"} 1'
+
+
+@pytest.fixture
+def n_plus_one_app():
+    """A bare app whose view runs one statement per item, as an N+1 loop would."""
+    app = Flask(__name__)
+    engine = create_engine('sqlite://')
+    tracked = metrics.RequestMetrics(n_plus_one_threshold=3)
+    tracked.init_app(app, [engine])
+
+    @app.route('/items/<int:count>')
+    def items(count):
+        with engine.connect() as connection:
+            rows = [connection.execute(text('SELECT :n'), {'n': n}).scalar() for n in range(count)]
+        return jsonify(rows)
+
+    yield app, tracked
+    engine.dispose()
+
+
+def test_repeated_statements_are_counted_and_logged(n_plus_one_app, caplog):
+    app, tracked = n_plus_one_app
+    client = app.test_client()
+    repeated = 'db_repeated_statements_total{route="/items/<int:count>"}'
+    with caplog.at_level(logging.WARNING, logger='metrics'):
+        client.get('/items/2')
+        assert sample(tracked.registry.render(), repeated) == 0
+        assert not caplog.records
+
+        assert client.get('/items/3').headers['Server-Timing'].endswith('desc="3 queries"')
+    scrape = tracked.registry.render()
+    assert sample(scrape, repeated) == 1
+    assert 'Possible N+1 query: GET /items/<int:count> ran this statement 3 times: SELECT ?' in caplog.text
+    assert sample(scrape, 'db_queries_per_request_bucket{route="/items/<int:count>",le="2"}') == 1
+    assert sample(scrape, 'db_queries_per_request_count{route="/items/<int:count>"}') == 2
+    assert sample(scrape, 'http_requests_in_flight') == 0
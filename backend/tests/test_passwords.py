@@ -0,0 +1,46 @@
+"""
+Password hashing pool: a timed-out call keeps its queue slot until the work
+ends, and a pool whose worker died is replaced.
+"""
+import os
+import time
+
+import pytest
+
+from passwords import PasswordHasher, PasswordHasherBusy
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(rounds=4, workers=1, max_pending=1, timeout=30)
+    yield hasher
+    hasher.shutdown()
+
+
+def wait_for_idle(hasher, deadline=10):
+    give_up = time.monotonic() + deadline
+    while hasher.stats()['queue_depth'] and time.monotonic() < give_up:
+        time.sleep(0.05)
+    return hasher.stats()['queue_depth']
+
+
+def test_timed_out_work_holds_its_slot_until_it_finishes(hasher):
+    # Start the worker first so the next call times out while running, not while spawning
+    hasher._run(time.sleep, 0)
+    hasher.configure(timeout=0.1)
+
+    with pytest.raises(PasswordHasherBusy, match='timed out'):
+        hasher._run(time.sleep, 1)
+    with pytest.raises(PasswordHasherBusy, match='in flight'):
+        hasher.hash('secret')
+
+    assert wait_for_idle(hasher) == 0
+    hasher.configure(timeout=30)
+    assert hasher.check('secret', hasher.hash('secret'))
+
+
+def test_broken_pool_is_replaced(hasher):
+    with pytest.raises(PasswordHasherBusy, match='restarted'):
+        hasher._run(os._exit, 1)
+    assert wait_for_idle(hasher) == 0
+    assert hasher.check('secret', hasher.hash('secret'))
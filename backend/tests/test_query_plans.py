@@ -0,0 +1,138 @@
+"""
+Query-plan checks for the Property listing hot paths.
+
+Each hot query is compiled exactly as the listing endpoints build it and run
+through EXPLAIN QUERY PLAN; a plain table scan means an index went missing.
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from flask_migrate import downgrade, stamp, upgrade
+from sqlalchemy import inspect, text
+from werkzeug.datastructures import MultiDict
+
+from app import db, init_migrate, Property
+from listing import ListingQuery, encode_cursor
+
+# EXPLAIN QUERY PLAN output is SQLite's; other backends only run the migration check
+sqlite_only = pytest.mark.skipif(not (os.getenv('TEST_DATABASE_URL') or 'sqlite').startswith('sqlite'),
+                                 reason='query plan checks target SQLite')
+
+HOT_QUERIES = {
+    'default listing': ({}, 'ix_property_created_at_id'),
+    'next page': ({'cursor': encode_cursor(datetime(2025, 1, 1, 12), 250)}, 'ix_property_created_at_id'),
+    'available by price': ({'is_available': 'true', 'min_price': '250000', 'max_price': '900000', 'sort': 'price'},
+                           'ix_property_available_price'),
+    'location and bedrooms': ({'location': 'Bocagrande', 'min_bedrooms': '3'}, 'ix_property_location_bedrooms'),
+    'has amenity': ({'amenities': 'Pool'}, 'ix_property_amenity_amenity_property'),
+}
+
+
+@pytest.fixture
+def seeded_properties(app_instance):
+    locations = ['Bocagrande', 'Centro Histórico', 'Getsemaní', 'Manga', 'Castillogrande']
+    start = datetime(2025, 1, 1)
+    db.session.add_all([
+        Property(
+            title=f'Property {i}',
+            description='Seeded listing',
+            price=150000 + (i * 3517) % 1200000,
+            location=locations[i % len(locations)],
+            bedrooms=1 + i % 6,
+            bathrooms=1 + i % 4,
+            area=60 + i % 400,
+            is_available=i % 3 != 0,
+            created_at=start + timedelta(minutes=i),
+            amenities=['Pool', 'Gym'][:1 + i % 2],
+        )
+        for i in range(500)
+    ])
+    db.session.commit()
+    db.session.execute(text('ANALYZE'))
+
+
+def query_plan(statement):
+    sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    rows = db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')).all()
+    return [row[-1] for row in rows]
+
+
+@sqlite_only
+@pytest.mark.parametrize('name', HOT_QUERIES)
+def test_hot_query_uses_index(seeded_properties, name):
+    args, expected_index = HOT_QUERIES[name]
+    plan = query_plan(ListingQuery(Property, MultiDict(args)).statement())
+
+    full_scans = [step for step in plan if step.startswith('SCAN') and 'INDEX' not in step]
+    assert not full_scans, f'{name} falls back to a table scan: {plan}'
+    assert any(expected_index in step for step in plan), f'{name} does not use {expected_index}: {plan}'
+
+
+@sqlite_only
+def test_property_lookup_uses_primary_key(seeded_properties):
+    plan = query_plan(db.select(Property).where(Property.id == 42))
+    assert plan == ['SEARCH property USING INTEGER PRIMARY KEY (rowid=?)']
+
+
+@pytest.fixture
+def migrations(app_instance):
+    """The migrations directory; Alembic's own tables are dropped afterwards, even on failure."""
+    init_migrate(app_instance)
+    yield os.path.join(app_instance.root_path, 'migrations')
+    db.session.rollback()
+    db.session.execute(text('DROP TABLE IF EXISTS alembic_version'))
+    db.session.execute(text('DROP TABLE IF EXISTS migration_created'))
+    db.session.commit()
+
+
+def test_migration_creates_property_indexes(migrations):
+    db.drop_all()
+    upgrade(directory=migrations)
+
+    indexes = {index['name'] for index in inspect(db.engine).get_indexes('property')}
+    assert {'ix_property_available_price', 'ix_property_location_bedrooms', 'ix_property_created_at_id'} <= indexes
+
+
+def test_downgrade_keeps_a_property_table_it_did_not_create(migrations, sample_property):
+    # A database from db.create_all() before the composite indexes existed
+    for name in ('ix_property_available_price', 'ix_property_location_bedrooms', 'ix_property_created_at_id'):
+        db.session.execute(text(f'DROP INDEX {name}'))
+    db.session.commit()
+    stamp(directory=migrations, revision='c5981d3fa772')
+    upgrade(directory=migrations, revision='4b7e2d9a1c3f')
+    downgrade(directory=migrations, revision='c5981d3fa772')
+
+    inspector = inspect(db.engine)
+    assert not {index['name'] for index in inspector.get_indexes('property')} & {
+        'ix_property_available_price', 'ix_property_location_bedrooms', 'ix_property_created_at_id'}
+    assert not inspector.has_table('migration_created')
+    assert db.session.scalar(text('SELECT count(*) FROM property')) == 1
+
+
+def test_list_columns_outlive_the_upgrade_that_adds_their_tables(migrations):
+    db.drop_all()
+    upgrade(directory=migrations, revision='9d31f0c6a2e8')
+    db.session.execute(text(
+        'INSERT INTO property (title, description, price, location, bedrooms, bathrooms, area, is_available, '
+        'created_at, updated_at, images, amenities) VALUES (:title, :title, 1, :title, 1, 1, 1, :yes, :now, :now, '
+        ':images, :amenities)'), {'title': 'Old', 'yes': True, 'now': datetime(2025, 1, 1), 'images': 'a.jpg,b.jpg',
+                                  'amenities': 'Pool, Gym'})
+    db.session.commit()
+
+    # The new tables arrive without a copy inside the migration's transaction
+    upgrade(directory=migrations, revision='e2a8c41d7b59')
+    assert db.session.scalar(text('SELECT images FROM property')) == 'a.jpg,b.jpg'
+    assert db.session.scalar(text('SELECT count(*) FROM property_image')) == 0
+    db.session.commit()  # PostgreSQL would hold the upgrade's ALTER TABLE behind these reads
+
+    # Whatever the copy command left is copied before the columns go
+    upgrade(directory=migrations)
+    assert not {'images', 'amenities'} & {c['name'] for c in inspect(db.engine).get_columns('property')}
+    stored = db.session.scalars(db.select(Property)).one()
+    assert (stored.images, stored.amenities) == (['a.jpg', 'b.jpg'], ['Gym', 'Pool'])
+    db.session.commit()
+
+    downgrade(directory=migrations, revision='9d31f0c6a2e8')
+    images, amenities = db.session.execute(text('SELECT images, amenities FROM property')).one()
+    assert (images, set(amenities.split(','))) == ('a.jpg,b.jpg', {'Gym', 'Pool'})
@@ -0,0 +1,110 @@
+"""
+Rate limits and load shedding: 429 with Retry-After once a bucket is empty,
+one bucket per user or client address, and 503 while more requests are in
+flight than the shedder admits, lifted as they finish.
+"""
+import threading
+import time
+
+import pytest
+from flask import Flask, jsonify
+
+import ratelimit
+from app import rate_limiter
+
+LISTINGS = '/api/properties'
+
+
+@pytest.fixture
+def limited(app_instance, monkeypatch):
+    """Limiting switched on (conftest turns it off) with empty buckets and small limits."""
+    monkeypatch.setattr(rate_limiter, 'enabled', True)
+    monkeypatch.setattr(rate_limiter, 'backend', ratelimit.MemoryBuckets())
+    monkeypatch.setitem(app_instance.config, 'RATELIMIT_PUBLIC', '3/minute')
+    monkeypatch.setitem(app_instance.config, 'RATELIMIT_LOGIN', '2/minute')
+    return app_instance
+
+
+def test_empty_bucket_answers_429_with_retry_after(client, limited):
+    remaining = [client.get(LISTINGS).headers['RateLimit-Remaining'] for _ in range(3)]
+    assert remaining == ['2', '1', '0']
+
+    rejected = client.get(LISTINGS)
+    assert rejected.status_code == 429
+    assert 0 < int(rejected.headers['Retry-After']) <= 20
+    assert rejected.headers['RateLimit-Policy'] == '3;w=60'
+
+
+def test_login_attempts_are_limited(client, sample_user, limited):
+    attempts = [client.post('/api/auth/login', json={'email': 'test@example.com', 'password': 'wrong'}).status_code
+                for _ in range(3)]
+    assert attempts == [401, 401, 429]
+
+
+def test_buckets_are_per_user_then_per_address(login_user, login_admin, auth_headers, client, limited):
+    for token in (login_user, login_admin):
+        statuses = [client.get(LISTINGS, headers=auth_headers(token)).status_code for _ in range(4)]
+        assert statuses == [200, 200, 200, 429]
+
+    # Anonymous clients are told apart by address
+    for address in ('10.0.0.1', '10.0.0.2'):
+        statuses = [client.get(LISTINGS, environ_base={'REMOTE_ADDR': address}).status_code for _ in range(4)]
+        assert statuses == [200, 200, 200, 429]
+
+
+def test_backend_outage_lets_requests_through(client, limited, monkeypatch):
+    def broken(key, limit):
+        raise ConnectionError('redis is down')
+
+    monkeypatch.setattr(rate_limiter.backend, 'hit', broken)
+    assert all(client.get(LISTINGS).status_code == 200 for _ in range(5))
+
+
+@pytest.fixture
+def shed_app():
+    """A bare app whose only view holds its request until released."""
+    app = Flask(__name__)
+    shedder = ratelimit.LoadShedder(max_in_flight=2, target_p99_ms=100, window=0)
+    shedder.init_app(app)
+    app.release = threading.Event()
+
+    @app.route('/slow')
+    def slow():
+        app.release.wait(10)
+        return jsonify({'ok': True})
+
+    yield app, shedder
+    app.release.set()
+
+
+def test_load_shedder_rejects_over_the_limit_then_recovers(shed_app):
+    app, shedder = shed_app
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(app.test_client().get('/slow').status_code))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while shedder.stats()['in_flight'] < 2:
+        time.sleep(0.01)
+
+    rejected = app.test_client().get('/slow')
+    assert rejected.status_code == 503 and rejected.headers['Retry-After'] == '1'
+    assert shedder.stats()['shed'] == 1
+
+    app.release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [200, 200]
+    assert app.test_client().get('/slow').status_code == 200
+
+
+def test_load_shedder_limit_backs_off_and_recovers():
+    shedder = ratelimit.LoadShedder(max_in_flight=10, target_p99_ms=100, window=0)
+    for _ in range(3):
+        shedder.in_flight += 1
+        shedder.record(0.5)
+    assert shedder.in_flight_limit == 7  # 10 -> 9 -> 8 -> 7 at 0.9x
+    for _ in range(5):
+        shedder.in_flight += 1
+        shedder.record(0.01)
+    assert shedder.in_flight_limit == 10
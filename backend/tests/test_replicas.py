@@ -0,0 +1,100 @@
+"""
+Read replicas: read-only views answered from a replica file, the primary used
+after a write in this or any other process and by the client that wrote, and
+a replica that cannot be reached skipped.
+"""
+import os
+import sqlite3
+
+import pytest
+from flask import g
+
+import db_config
+import replicas
+from app import db, Property, response_cache
+from cache import MemoryCache
+
+pytestmark = pytest.mark.skipif(not (os.getenv('TEST_DATABASE_URL') or 'sqlite').startswith('sqlite'),
+                                reason='replicas here are copies of the SQLite primary file')
+
+
+@pytest.fixture
+def listing_id(app_instance):
+    listing = Property(title='Primary copy', description='Replicated', price=250000, location='Manga',
+                       bedrooms=2, bathrooms=1, area=80)
+    db.session.add(listing)
+    db.session.commit()
+    return listing.id
+
+
+def use_replica(monkeypatch, app, uri):
+    """Points the app's router at ``uri``, with no recent write on record."""
+    router = app.extensions[replicas.EXTENSION_KEY]
+    engine = db_config.create_engine(uri, app.config['SQLITE_PRAGMAS'])
+    monkeypatch.setattr(router, 'replicas', [engine])
+    monkeypatch.setattr(router, '_down_until', {})
+    monkeypatch.setattr(router, 'last_write', float('-inf'))
+    monkeypatch.setattr(response_cache, 'backend', MemoryCache())
+    return router
+
+
+@pytest.fixture
+def replica(app_instance, listing_id, tmp_path, monkeypatch):
+    """A snapshot of the primary file whose listing title gives away where a read went."""
+    path = tmp_path / 'replica.db'
+    with sqlite3.connect(db.engine.url.database) as primary, sqlite3.connect(path) as copy:
+        primary.backup(copy)
+        copy.execute("UPDATE property SET title = 'Replica copy'")
+    yield use_replica(monkeypatch, app_instance, f'sqlite:///{path}')
+
+
+def get(client, url, **kwargs):
+    # Requests share the test's app context, and so its session and g; start each afresh
+    db.session.remove()
+    g.pop('db_replica', None)
+    g.pop('db_wrote', None)
+    response = client.get(url, **kwargs)
+    assert response.status_code == 200
+    return response.json
+
+
+def title(client, listing_id):
+    return get(client, f'/api/properties/{listing_id}')['title']
+
+
+def test_only_read_only_views_use_the_replica(login_admin, auth_headers, client, replica, listing_id):
+    assert title(client, listing_id) == 'Replica copy'
+    # Views not marked read_replica stay on the primary
+    admin_view = get(client, f'/api/admin/properties/{listing_id}', headers=auth_headers(login_admin))
+    assert admin_view['title'] == 'Primary copy'
+
+
+def test_writer_reads_its_own_write(client, replica, listing_id, login_admin, auth_headers):
+    response = client.put(f'/api/admin/properties/{listing_id}', json={'price': 260000},
+                          headers=auth_headers(login_admin))
+    assert response.status_code == 200
+    assert replicas.STICKY_COOKIE in response.headers['Set-Cookie']
+    # This process wrote too, so forget that to see the cookie alone at work
+    replica.last_write = float('-inf')
+    response_cache.backend = MemoryCache()
+    assert title(client, listing_id) == 'Primary copy'
+
+    client.delete_cookie(replicas.STICKY_COOKIE)
+    response_cache.backend = MemoryCache()
+    assert title(client, listing_id) == 'Replica copy'
+
+
+def test_write_in_another_process_keeps_reads_on_the_primary(client, replica, listing_id, monkeypatch):
+    # Another worker's commit only shows up as the shared cache generation bump
+    response_cache.invalidate()
+    assert title(client, listing_id) == 'Primary copy'
+
+    monkeypatch.setattr(replica, 'sticky_seconds', 0)
+    response_cache.invalidate()
+    assert title(client, listing_id) == 'Replica copy'
+
+
+def test_unreachable_replica_falls_back_to_the_primary(client, app_instance, listing_id, tmp_path, monkeypatch):
+    router = use_replica(monkeypatch, app_instance, f'sqlite:///{tmp_path}/missing/replica.db')
+    assert title(client, listing_id) == 'Primary copy'
+    assert router._down_until
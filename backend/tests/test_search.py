@@ -0,0 +1,84 @@
+"""
+Full-text search: ranking, prefix and amenity matches, paging, safe handling
+of query syntax, and highlights that never pass listing markup through.
+"""
+import os
+
+import pytest
+
+import search as search_module
+from app import db, Property
+
+pytestmark = pytest.mark.skipif(not (os.getenv('TEST_DATABASE_URL') or 'sqlite').startswith('sqlite'),
+                                reason='search is backed by SQLite FTS5')
+
+
+def make_property(title, description='A listing', location='Cartagena', amenities=()):
+    return Property(title=title, description=description, price=250000, location=location, bedrooms=2,
+                    bathrooms=1, area=80, amenities=list(amenities))
+
+
+@pytest.fixture
+def listings(app_instance):
+    rows = [
+        make_property('Apartment near the beach', description='Bright rooms with a terrace'),
+        make_property('Colonial house', description='Steps from the beach, with a patio'),
+        make_property('Penthouse', description='Rooftop terrace', amenities=['Swimming pool']),
+        make_property('Studio downtown', location='Getsemaní'),
+    ]
+    db.session.add_all(rows)
+    db.session.commit()
+    return [row.id for row in rows]
+
+
+def search(client, **args):
+    response = client.get('/api/properties/search', query_string=args)
+    assert response.status_code == 200, response.json
+    return response
+
+
+def test_title_hits_rank_above_description_hits(client, listings):
+    items = search(client, q='beach').json
+    assert [item['id'] for item in items] == [listings[0], listings[1]]
+    assert items[0]['title_highlight'] == 'Apartment near the <mark>beach</mark>'
+    assert '<mark>beach</mark>' in items[1]['snippet']
+
+
+def test_prefix_amenity_and_accent_insensitive_matches(client, listings):
+    assert {item['id'] for item in search(client, q='terr').json} == {listings[0], listings[2]}
+    assert [item['id'] for item in search(client, q='pool').json] == [listings[2]]
+    assert [item['id'] for item in search(client, q='getsemani').json] == [listings[3]]
+
+
+def test_query_syntax_is_treated_as_text(client, listings):
+    assert search(client, q='beach OR "house" NEAR(*').json == []
+    assert client.get('/api/properties/search', query_string={'q': '"*()'}).status_code == 400
+
+
+def test_results_page_by_offset(client, listings):
+    first = search(client, q='a*', limit=2)
+    assert first.headers['X-Next-Offset'] == '2'
+    second = search(client, q='a*', limit=2, offset=2)
+    assert {item['id'] for item in first.json}.isdisjoint(item['id'] for item in second.json)
+
+
+def test_last_reachable_page_has_no_next_offset(client, listings, monkeypatch):
+    monkeypatch.setattr(search_module, 'MAX_OFFSET', 1)
+    assert search(client, q='a*', limit=1).headers['X-Next-Offset'] == '1'
+    # More results follow, but offset=2 would be rejected
+    last = search(client, q='a*', limit=1, offset=1)
+    assert len(last.json) == 1 and 'X-Next-Offset' not in last.headers and 'Link' not in last.headers
+    assert client.get('/api/properties/search', query_string={'q': 'a*', 'offset': 2}).status_code == 400
+
+
+def test_highlights_escape_listing_markup(client, app_instance):
+    db.session.add(make_property('<img src=x onerror=alert(1)> Beach loft',
+                                 description='<script>steal()</script> beach & bay'))
+    db.session.commit()
+
+    item = search(client, q='beach').json[0]
+    assert item['title_highlight'] == '&lt;img src=x onerror=alert(1)&gt; <mark>Beach</mark> loft'
+    item = search(client, q='bay').json[0]
+    assert '<script>' not in item['snippet']
+    assert '&lt;script&gt;' in item['snippet'] and '&amp;' in item['snippet']
+    assert item['snippet'].count('<mark>') == item['snippet'].count('</mark>') == 1
@@ -0,0 +1,102 @@
+"""
+Similar properties: ranking over a small fixed catalogue, committed writes
+applied to the matrix once the transaction ends, unavailable listings never
+recommended, and 501 when NumPy is missing.
+"""
+import pytest
+
+import similar
+from app import amenity_pairs, db, Property, similar_index
+
+pytest.importorskip('numpy')
+
+
+def listing(title, price, area, bedrooms, location='Manga', amenities=(), **kwargs):
+    return Property(title=title, description=title, price=price, area=area, bedrooms=bedrooms, bathrooms=1,
+                    location=location, amenities=list(amenities), **kwargs)
+
+
+@pytest.fixture
+def catalogue(app_instance, monkeypatch):
+    """Five listings around a 2-bedroom flat in Manga, and an index that has not been built."""
+    monkeypatch.setattr(similar_index, '_matrix', None)
+    monkeypatch.setattr(similar_index, '_built_at', None)
+    monkeypatch.setattr(similar_index, '_replay', None)
+    rows = {
+        'flat': listing('Flat', 200000, 80, 2, amenities=['pool']),
+        'twin': listing('Twin', 205000, 82, 2, amenities=['pool']),
+        'bigger': listing('Bigger', 320000, 130, 3, amenities=['pool']),
+        'elsewhere': listing('Elsewhere', 200000, 80, 2, location='Bocagrande', amenities=['pool']),
+        'mansion': listing('Mansion', 2000000, 600, 6, amenities=['pool', 'gym', 'garden']),
+    }
+    db.session.add_all(rows.values())
+    db.session.commit()
+    return {name: row.id for name, row in rows.items()}
+
+
+def similar_ids(client, property_id, **query):
+    response = client.get(f'/api/properties/{property_id}/similar', query_string=query)
+    assert response.status_code == 200
+    return [item['id'] for item in response.json]
+
+
+def test_ranking_prefers_close_features_in_the_same_location(client, catalogue):
+    ids = catalogue
+    ranked = similar_ids(client, ids['flat'])
+    assert ranked[:2] == [ids['twin'], ids['bigger']]
+    # Identical features in another location still rank below a near twin
+    assert ranked.index(ids['elsewhere']) > ranked.index(ids['twin'])
+    scores = [item['similarity'] for item in client.get(f'/api/properties/{ids["flat"]}/similar').json]
+    assert scores == sorted(scores, reverse=True) and all(0 < score <= 1 for score in scores)
+    assert similar_ids(client, ids['flat'], limit=1) == [ids['twin']]
+
+
+def test_committed_writes_update_and_free_rows(catalogue):
+    ids = catalogue
+    similar_index.build(lambda: similar.fetch(db.session, Property, amenity_pairs()))
+    top = lambda: [match for match, _ in similar_index.top_k([ids['flat']], 2)[ids['flat']]]  # noqa: E731
+    assert top() == [ids['twin'], ids['bigger']]
+
+    twin = db.session.get(Property, ids['twin'])
+    twin.price, twin.area, twin.bedrooms = 2000000, 600, 6
+    db.session.flush()
+    # Nothing changes until the commit
+    assert top() == [ids['twin'], ids['bigger']]
+    db.session.commit()
+    assert top()[0] == ids['bigger']
+
+    # Amenities are read back after the commit too
+    mansion = db.session.get(Property, ids['mansion'])
+    mansion.amenities = []
+    db.session.commit()
+    matrix = similar_index._matrix
+    assert not matrix.vectors[matrix.row_of[ids['mansion']], len(similar.NUMERIC_FEATURES):].any()
+
+    db.session.delete(db.session.get(Property, ids['bigger']))
+    db.session.commit()
+    assert ids['bigger'] not in similar_index and ids['bigger'] not in top()
+
+    # Rolled-back writes are dropped
+    db.session.add(listing('Discarded', 200000, 80, 2))
+    db.session.flush()
+    db.session.rollback()
+    db.session.add(listing('Added', 200000, 80, 2, amenities=['pool']))
+    db.session.commit()
+    assert len(similar_index) == 5
+
+
+def test_unavailable_listings_are_not_recommended(client, catalogue):
+    ids = catalogue
+    db.session.get(Property, ids['twin']).is_available = False
+    db.session.commit()
+    assert ids['twin'] not in similar_ids(client, ids['flat'])
+    # It still has recommendations of its own
+    assert similar_ids(client, ids['twin'])[0] == ids['flat']
+
+
+def test_without_numpy_the_endpoint_answers_501(client, catalogue, monkeypatch):
+    monkeypatch.setattr(similar, 'available', lambda: False)
+    response = client.get(f'/api/properties/{catalogue["flat"]}/similar')
+    assert response.status_code == 501
+    assert 'NumPy' in response.json['error']
+    assert not similar_index.built
@@ -0,0 +1,83 @@
+"""
+Market statistics: percentiles within the observed prices, incremental
+maintenance matching a from-scratch computation, and an empty table (as
+left by its migration) being filled instead of receiving deltas.
+"""
+import random
+
+from sqlalchemy import insert
+
+import stats
+from app import db, Property, PropertyStats
+
+
+def make_property(price, location='Manga', bedrooms=2, area=100, **extra):
+    return Property(title='Listing', description='For stats', price=price, location=location, bedrooms=bedrooms,
+                    bathrooms=1, area=area, **extra)
+
+
+def group_summary(response, location):
+    return next(group for group in response.json['by_location'] if group['location'] == location)
+
+
+def test_percentiles_stay_within_observed_prices(client, login_admin, auth_headers):
+    db.session.add(make_property(1.0, location='Cheap'))
+    db.session.add_all([make_property(price, location='Tight') for price in (100, 101, 102, 103, 104)])
+    db.session.commit()
+
+    response = client.get('/api/admin/stats', headers=auth_headers(login_admin))
+    assert response.status_code == 200
+    single = group_summary(response, 'Cheap')['price']
+    assert single['median'] == single['p25'] == single['p90'] == 1.0
+    tight = group_summary(response, 'Tight')['price']
+    for name in stats.QUANTILES:
+        assert 100 <= tight[name] <= 104, (name, tight[name])
+    assert abs(tight['median'] - 102) <= 102 * stats.RELATIVE_ACCURACY
+
+
+def test_sketch_quantiles_are_within_relative_accuracy():
+    rng = random.Random(3)
+    values = sorted(rng.uniform(50_000, 2_000_000) for _ in range(2000))
+    sketch = stats.QuantileSketch()
+    for value in values:
+        sketch.add(value)
+    for q in (0.25, 0.5, 0.75, 0.9):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= exact * stats.RELATIVE_ACCURACY * 1.01
+
+
+def test_incremental_updates_match_a_rebuild(app_instance):
+    rng = random.Random(11)
+    rows = [make_property(rng.randint(80, 900) * 1000, location=rng.choice(['Manga', 'Centro', 'Bocagrande']),
+                          bedrooms=rng.randint(1, 4), area=rng.randint(40, 300)) for _ in range(60)]
+    db.session.add_all(rows)
+    db.session.commit()
+    for row in rows[:20]:
+        row.price = rng.randint(80, 900) * 1000
+        row.location = rng.choice(['Manga', 'Centro'])
+    for row in rows[20:30]:
+        db.session.delete(row)
+    rows[40].is_available = False
+    db.session.commit()
+
+    maintained = stats.load(db.session, PropertyStats.__table__)
+    assert stats.compare(maintained, stats.compute(db.session, Property)) == []
+
+
+def test_empty_table_is_filled_rather_than_given_deltas(client, login_admin, auth_headers):
+    # Listings written behind the ORM's back, as before the stats table existed
+    db.session.execute(insert(Property.__table__), [
+        {'title': 'Old', 'description': 'Existing', 'price': 100000 * (i + 1), 'location': 'Manga', 'bedrooms': 2,
+         'bathrooms': 1, 'area': 50, 'is_available': True} for i in range(5)
+    ])
+    db.session.commit()
+    assert stats.load(db.session, PropertyStats.__table__) == {}
+
+    response = client.get('/api/admin/stats', headers=auth_headers(login_admin))
+    assert response.json['overall']['count'] == 5
+
+    db.session.add(make_property(900000))
+    db.session.commit()
+    maintained = stats.load(db.session, PropertyStats.__table__)
+    assert maintained[('Manga', 2)].count == 6
+    assert stats.compare(maintained, stats.compute(db.session, Property)) == []
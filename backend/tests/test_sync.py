@@ -0,0 +1,173 @@
+"""
+Node sync: rows created on either side copied to the other, conflicts
+settled by ``updated_at``, deletes propagated, rows this app cannot store
+reported without failing the batch, and log entries committed after a later
+id was read still applied.
+"""
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import sync
+from app import db, Property, PropertyChange, PropertySyncLink, SyncCheckpoint, sync_with_node
+
+NODE_SCHEMA = """
+CREATE TABLE properties (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, description TEXT, type TEXT NOT NULL,
+    price REAL, price_per_night REAL, location TEXT, bedrooms INTEGER, bathrooms INTEGER, sqft REAL,
+    image_url TEXT, images TEXT, amenities TEXT, status TEXT DEFAULT 'available',
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+EARLIER = datetime(2026, 1, 1, 12, 0)
+LATER = EARLIER + timedelta(hours=1)
+
+
+@pytest.fixture
+def node_db(app_instance, tmp_path):
+    path = tmp_path / 'luxury_properties.db'
+    with sqlite3.connect(path) as connection:
+        connection.execute(NODE_SCHEMA)
+    return str(path)
+
+
+def node_execute(path, sql, params=()):
+    with sqlite3.connect(path) as connection:
+        connection.row_factory = sqlite3.Row
+        return connection.execute(sql, params).fetchall()
+
+
+def add_node_row(path, title, location='Bocagrande', updated_at=EARLIER):
+    stamp = updated_at.isoformat(sep=' ') if updated_at else None
+    node_execute(path, "INSERT INTO properties(title, description, type, price, location, bedrooms, bathrooms, "
+                       "sqft, status, created_at, updated_at) VALUES (?, 'From Node', 'sale', 250000, ?, 2, 1, 80, "
+                       "'available', ?, ?)", (title, location, stamp, stamp))
+
+
+def add_local(title, updated_at=EARLIER):
+    listing = Property(title=title, description='From Flask', price=300000, location='Manga', bedrooms=3,
+                       bathrooms=2, area=120, created_at=updated_at, updated_at=updated_at)
+    db.session.add(listing)
+    db.session.commit()
+    return listing.id
+
+
+def local_titles():
+    return sorted(db.session.scalars(db.select(Property.title)))
+
+
+def node_titles(path):
+    return sorted(row['title'] for row in node_execute(path, 'SELECT title FROM properties'))
+
+
+def run(path, direction='both'):
+    return dict(sync_with_node(path, direction))
+
+
+def test_pull_and_push_copy_new_rows_once(node_db):
+    add_node_row(node_db, 'Node villa')
+    add_local('Flask loft')
+
+    reports = run(node_db)
+    assert reports['pull']['inserted'] == 1 and reports['push']['inserted'] == 1
+    assert local_titles() == node_titles(node_db) == ['Flask loft', 'Node villa']
+
+    # The copies logged on each side come back unchanged and are skipped
+    reports = run(node_db)
+    assert not any(report['inserted'] or report['updated'] for report in reports.values())
+    assert local_titles() == node_titles(node_db) == ['Flask loft', 'Node villa']
+
+
+def test_newer_updated_at_wins_in_both_directions(node_db):
+    add_node_row(node_db, 'Node villa')
+    local_id = add_local('Flask loft')
+    run(node_db)
+
+    node_execute(node_db, "UPDATE properties SET title = 'Node villa, renovated', updated_at = ? "
+                          "WHERE title = 'Node villa'", (LATER.isoformat(sep=' '),))
+    listing = db.session.get(Property, local_id)
+    listing.title, listing.updated_at = 'Flask loft, repainted', LATER
+    # An older edit does not overwrite the newer copy on the other side
+    pulled = db.session.scalars(db.select(Property).where(Property.title == 'Node villa')).one()
+    pulled.title, pulled.updated_at = 'Node villa, stale', EARLIER + timedelta(minutes=1)
+    db.session.commit()
+
+    run(node_db, 'pull')
+    run(node_db, 'push')
+    assert local_titles() == node_titles(node_db) == ['Flask loft, repainted', 'Node villa, renovated']
+
+
+def test_deletes_propagate_unless_the_other_side_edited_later(node_db):
+    add_node_row(node_db, 'Node villa')
+    add_node_row(node_db, 'Node house')
+    local_id = add_local('Flask loft')
+    run(node_db)
+
+    db.session.delete(db.session.get(Property, local_id))
+    db.session.commit()
+    node_execute(node_db, "DELETE FROM properties WHERE title = 'Node villa'")
+    run(node_db)
+    assert local_titles() == node_titles(node_db) == ['Node house']
+
+    # Edited here after Node deleted it: kept, and sent back as a new row
+    node_execute(node_db, "DELETE FROM properties WHERE title = 'Node house'")
+    kept = db.session.scalars(db.select(Property)).one()
+    kept.updated_at = datetime.utcnow() + timedelta(days=1)
+    db.session.commit()
+    run(node_db)
+    assert local_titles() == node_titles(node_db) == ['Node house']
+
+
+@pytest.mark.parametrize('row', [
+    {'location': None},
+    {'location': ''},
+    {'updated_at': None},
+])
+def test_rows_missing_required_fields_are_reported_not_fatal(node_db, runner, row):
+    add_node_row(node_db, 'Incomplete', **row)
+    add_node_row(node_db, 'Node villa')
+
+    report = run(node_db, 'pull')['pull']
+    assert (report['inserted'], report['failed']) == (1, 1)
+    assert 'missing' in report['errors'][0]['error']
+    assert local_titles() == ['Node villa']
+
+    node_execute(node_db, "UPDATE properties SET title = 'Incomplete again'")
+    result = runner.invoke(args=['sync-properties', '--direction', 'pull', '--node-db', node_db])
+    assert result.exit_code == 0
+    assert '1 failed' in result.output and 'missing' in result.output
+
+
+def test_change_committed_after_a_later_id_is_still_applied(node_db, monkeypatch):
+    late_id = add_local('Committed late')
+    add_local('Committed first')
+    # The late transaction's log entries are not visible yet when the sync reads
+    late = db.session.execute(db.select(PropertyChange.__table__).where(PropertyChange.property_id == late_id)).all()
+    db.session.execute(db.delete(PropertyChange).where(PropertyChange.property_id == late_id))
+    db.session.commit()
+
+    run(node_db, 'push')
+    assert node_titles(node_db) == ['Committed first']
+
+    db.session.execute(db.insert(PropertyChange), [row._asdict() for row in late])
+    db.session.commit()
+    run(node_db, 'push')
+    assert node_titles(node_db) == ['Committed first', 'Committed late']
+    assert db.session.scalar(db.select(db.func.count()).select_from(PropertyChange)) == 0
+
+    # Ids still missing after GAP_TIMEOUT count as rolled back and are dropped from the checkpoint
+    rolled_back = add_local('Rolled back')
+    add_local('Kept')
+    db.session.execute(db.delete(PropertyChange).where(PropertyChange.property_id == rolled_back))
+    db.session.commit()
+    run(node_db, 'push')
+    assert awaited_ids()
+    monkeypatch.setattr(sync, 'GAP_TIMEOUT', 0)
+    run(node_db, 'push')
+    assert awaited_ids() == set()
+
+
+def awaited_ids():
+    state = sync.SyncState(db.session, SyncCheckpoint.__table__, PropertySyncLink.__table__)
+    return set(state.position('push')[1])
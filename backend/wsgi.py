@@ -0,0 +1,12 @@
+"""
+WSGI entry point for production servers, e.g.
+
+    gunicorn --preload --workers 4 wsgi:app
+
+The app is built once, in the server's master process when preloading, and
+inherited by the workers it forks; app.py gives each child its own database
+connections. Process-mode job workers import it too.
+"""
+from app import create_app
+
+app = create_app()